@@ -0,0 +1,32 @@
+"""Per-request cost of finding the layers, with and without the registry.
+
+Before the registry, every search request introspected all models of the app to find
+the leaf geomodels and then built the SQL for each of them; now this is done once,
+when the app is ready. Run this from the Enhydris directory:
+
+    DJANGO_SETTINGS_MODULE=enhydris_project.settings \\
+        python ../enhydris-openhigis/benchmarks/geomodels.py
+"""
+
+import timeit
+
+import django
+
+django.setup()
+
+from enhydris_openhigis import registry  # noqa: E402 (needs django.setup())
+
+NUMBER = 1000
+
+
+def main():
+    for description, stmt in (
+        ("Introspection (before)", registry.build_registry),
+        ("Registry (after)", registry.get_registry),
+    ):
+        seconds = min(timeit.repeat(stmt, number=NUMBER, repeat=5))
+        print("{:25} {:10.2f} µs/request".format(description, seconds / NUMBER * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+default_app_config = "enhydris_openhigis.apps.EnhydrisOpenhigisConfig"
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class EnhydrisOpenhigisConfig(AppConfig):
     name = "enhydris_openhigis"
+
+    def ready(self):
+        from . import changes, layers, receivers, registry  # noqa: F401 (layers)
+
+        registry.load()
+        changes.connect_model_signals()
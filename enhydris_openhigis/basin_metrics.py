@@ -0,0 +1,340 @@
+"""Calculation of basin metrics from the hydrographic network.
+
+The max_river_length of a river basin or drainage basin is the length of the
+longest flow path formed by its watercourses (see Network.get_longest_paths()). A
+watercourse belongs to a river basin through its river_basin foreign key, and to the
+smallest drainage basin of that river basin that contains a point of it.
+
+The total_area of a drainage basin is its area plus the area of all drainage basins
+upstream of it. A drainage basin is directly upstream of another if one of its
+watercourses flows into a watercourse of the other; the transitive closure of that
+relation is calculated with boolean matrix products, which is fast because river
+basins have at most a few hundred drainage basins.
+
+Each river basin is independent of the others, so they are calculated in parallel,
+in a pool of processes, from data loaded with a couple of queries; the results are
+written with a few set-based UPDATEs that touch only the rows whose values change.
+
+The calculation can be limited to the river basins that have changed since the last
+run, i.e. those in which the river basin itself, a drainage basin or a watercourse
+has a last_modified later than the start of the last run (which is stored in the
+cache; if it isn't there, all river basins are calculated). The basins whose metrics
+the run itself changes get the time of the run's transaction as their
+last_modified, which is also stored and excluded, as these aren't changes to the
+input. Deleted watercourses and watercourses moved to another river basin are not
+detected, so an occasional run on all river basins is still needed.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connection, transaction
+
+import numpy as np
+
+from .changes import get_cache, mark_features_changed
+from .network import Network, get_indices
+
+LAST_RUN_KEY = "openhigis:basin_metrics:last_run"
+
+
+def update_basin_metrics(river_basin_ids=None, processes=None, changed=False):
+    """Calculate max_river_length and total_area and store them.
+
+    river_basin_ids are imported ids; if None, all river basins are calculated, or,
+    if changed is True, those that have changed since the last run (see
+    get_changed_river_basins()). processes is the number of processes to use (by
+    default, the number of CPUs). Returns a dict with the number of river basins and
+    drainage basins updated. Raises ValueError if a river basin does not exist.
+    """
+    with connection.cursor() as cursor:
+        # Not now(), which, if we are in a transaction, is when it started.
+        cursor.execute("SELECT clock_timestamp()")
+        started = cursor.fetchone()[0]
+    if river_basin_ids is None and changed:
+        river_basin_ids = get_changed_river_basins()
+    river_basins = load_river_basins(river_basin_ids)
+    if processes == 1 or len(river_basins) < 2:
+        results = [calculate_river_basin(*x) for x in river_basins]
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(calculate_river_basin, *zip(*river_basins)))
+    with transaction.atomic(), connection.cursor() as cursor:
+        # The last_modified that save_results() sets
+        cursor.execute("SELECT now()")
+        saved = cursor.fetchone()[0]
+        result = save_results(river_basins, results)
+    if river_basin_ids is None or changed:
+        get_cache().set(LAST_RUN_KEY, (started, saved), None)
+    return result
+
+
+def get_changed_river_basins():
+    """Return the imported ids of the river basins changed since the last run.
+
+    Returns None (i.e. all river basins) if there is no record of a last run.
+    """
+    last_run = get_cache().get(LAST_RUN_KEY)
+    if last_run is None:
+        return None
+    since, saved = last_run
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT b.imported_id
+            FROM
+                enhydris_openhigis_riverbasin r
+                INNER JOIN enhydris_openhigis_basin b
+                ON b.garea_ptr_id = r.basin_ptr_id
+                INNER JOIN enhydris_gentity g ON g.id = r.basin_ptr_id
+            WHERE
+                (g.last_modified > %(since)s AND g.last_modified <> %(saved)s)
+                OR EXISTS (
+                    SELECT 1
+                    FROM
+                        enhydris_openhigis_drainagebasin d
+                        INNER JOIN enhydris_gentity dg ON dg.id = d.basin_ptr_id
+                    WHERE
+                        d.river_basin_id = r.basin_ptr_id
+                        AND dg.last_modified > %(since)s
+                        AND dg.last_modified <> %(saved)s
+                )
+                OR EXISTS (
+                    SELECT 1
+                    FROM
+                        enhydris_openhigis_watercourse w
+                        INNER JOIN enhydris_openhigis_surfacewater s
+                        ON s.gentity_ptr_id = w.surfacewater_ptr_id
+                        INNER JOIN enhydris_gentity wg ON wg.id = s.gentity_ptr_id
+                    WHERE
+                        s.river_basin_id = r.basin_ptr_id
+                        AND wg.last_modified > %(since)s
+                )
+            ORDER BY b.imported_id
+            """,
+            {"since": since, "saved": saved},
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def load_river_basins(river_basin_ids=None):
+    """Load the data needed for the calculation.
+
+    Returns a list of tuples of arguments for calculate_river_basin(), one for each
+    river basin.
+    """
+    with connection.cursor() as cursor:
+        ids = _get_river_basin_ids(cursor, river_basin_ids)
+        cursor.execute(
+            """
+            SELECT
+                s.river_basin_id,
+                w.surfacewater_ptr_id,
+                COALESCE(w.start_node_id, -1),
+                COALESCE(w.end_node_id, -1),
+                COALESCE(s.length, 0),
+                COALESCE(
+                    (
+                        SELECT d.basin_ptr_id
+                        FROM
+                            enhydris_openhigis_drainagebasin d
+                            INNER JOIN enhydris_openhigis_basin b
+                            ON b.garea_ptr_id = d.basin_ptr_id
+                        WHERE
+                            d.river_basin_id = s.river_basin_id
+                            AND ST_Intersects(
+                                b.geom2100, ST_PointOnSurface(s.geom2100)
+                            )
+                        ORDER BY b.area
+                        LIMIT 1
+                    ),
+                    -1
+                )
+            FROM
+                enhydris_openhigis_watercourse w
+                INNER JOIN enhydris_openhigis_surfacewater s
+                ON s.gentity_ptr_id = w.surfacewater_ptr_id
+            WHERE s.river_basin_id = ANY(%s)
+            ORDER BY s.river_basin_id, w.surfacewater_ptr_id
+            """,
+            [ids],
+        )
+        watercourses = np.array(cursor.fetchall(), dtype=float).reshape(-1, 6)
+        cursor.execute(
+            """
+            SELECT d.river_basin_id, d.basin_ptr_id, COALESCE(b.area, 0)
+            FROM
+                enhydris_openhigis_drainagebasin d
+                INNER JOIN enhydris_openhigis_basin b
+                ON b.garea_ptr_id = d.basin_ptr_id
+            WHERE d.river_basin_id = ANY(%s)
+            ORDER BY d.river_basin_id, d.basin_ptr_id
+            """,
+            [ids],
+        )
+        drainage_basins = np.array(cursor.fetchall(), dtype=float).reshape(-1, 3)
+    watercourse_groups = _split(watercourses)
+    drainage_basin_groups = _split(drainage_basins)
+    empty = np.zeros((0, 6)), np.zeros((0, 3))
+    return [
+        (
+            id,
+            watercourse_groups.get(id, empty[0])[:, 1:],
+            drainage_basin_groups.get(id, empty[1])[:, 1:],
+        )
+        for id in ids
+    ]
+
+
+def calculate_river_basin(river_basin_id, watercourses, drainage_basins):
+    """Calculate the metrics of a river basin.
+
+    watercourses is an array with a row (id, start node id, end node id, length,
+    drainage basin id) for each watercourse of the river basin; the node ids and
+    drainage basin id are -1 if null. drainage_basins has a row (id, area) for each
+    drainage basin. Returns (max_river_length of the river basin, array of
+    max_river_length of the drainage basins, array of total_area of the drainage
+    basins); lengths are NaN if there are no watercourses.
+    """
+    ids, starts, ends, lengths, basins = watercourses.T
+    basins = basins.astype(np.int64)
+    network = _make_network(ids, starts, ends)
+    max_river_length = _nanmax(network.get_longest_paths(lengths))
+
+    basin_ids = drainage_basins[:, 0].astype(np.int64)
+    max_river_lengths = np.full(len(basin_ids), np.nan)
+    for i, basin_id in enumerate(basin_ids):
+        mask = basins == basin_id
+        if mask.any():
+            subnetwork = _make_network(ids[mask], starts[mask], ends[mask])
+            max_river_lengths[i] = _nanmax(subnetwork.get_longest_paths(lengths[mask]))
+
+    # upstream[i] is directly upstream of downstream[i]
+    upstream, downstream = network.get_connections()
+    upstream = get_indices(basin_ids, basins[upstream])
+    downstream = get_indices(basin_ids, basins[downstream])
+    valid = (upstream >= 0) & (downstream >= 0) & (upstream != downstream)
+    reaches = np.zeros((len(basin_ids), len(basin_ids)), dtype=bool)
+    reaches[upstream[valid], downstream[valid]] = True
+    while True:
+        new_reaches = reaches | (reaches.astype(np.int64) @ reaches > 0)
+        if (new_reaches == reaches).all():
+            break
+        reaches = new_reaches
+    np.fill_diagonal(reaches, False)
+    areas = drainage_basins[:, 1]
+    total_areas = areas + reaches.T.astype(float) @ areas
+
+    return max_river_length, max_river_lengths, total_areas
+
+
+def save_results(river_basins, results):
+    """Store the results of calculate_river_basin() and mark the basins changed.
+
+    Returns a dict with the number of river basins and drainage basins updated.
+    """
+    river_basin_ids = [x[0] for x in river_basins]
+    drainage_basin_ids = np.concatenate(
+        [np.zeros(0)] + [x[2][:, 0] for x in river_basins]
+    )
+    river_basin_lengths = [x[0] for x in results]
+    drainage_basin_lengths = np.concatenate([np.zeros(0)] + [x[1] for x in results])
+    total_areas = np.concatenate([np.zeros(0)] + [x[2] for x in results])
+    with transaction.atomic(), connection.cursor() as cursor:
+        changed_river_basins = _update(
+            cursor,
+            "enhydris_openhigis_basin",
+            "garea_ptr_id",
+            "max_river_length",
+            river_basin_ids,
+            river_basin_lengths,
+        )
+        changed_drainage_basins = set(
+            _update(
+                cursor,
+                "enhydris_openhigis_basin",
+                "garea_ptr_id",
+                "max_river_length",
+                drainage_basin_ids,
+                drainage_basin_lengths,
+            )
+        )
+        changed_drainage_basins.update(
+            _update(
+                cursor,
+                "enhydris_openhigis_drainagebasin",
+                "basin_ptr_id",
+                "total_area",
+                drainage_basin_ids,
+                total_areas,
+            )
+        )
+        mark_features_changed(cursor, "RiverBasin", changed_river_basins)
+        mark_features_changed(cursor, "DrainageBasin", list(changed_drainage_basins))
+    return {
+        "RiverBasin": len(changed_river_basins),
+        "DrainageBasin": len(changed_drainage_basins),
+    }
+
+
+def _get_river_basin_ids(cursor, imported_ids):
+    query = """
+        SELECT b.garea_ptr_id, b.imported_id
+        FROM
+            enhydris_openhigis_basin b
+            INNER JOIN enhydris_openhigis_riverbasin r
+            ON r.basin_ptr_id = b.garea_ptr_id
+    """
+    if imported_ids is None:
+        cursor.execute(query + " ORDER BY b.garea_ptr_id")
+        return [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        query + " WHERE b.imported_id = ANY(%s) ORDER BY b.garea_ptr_id",
+        [list(imported_ids)],
+    )
+    rows = cursor.fetchall()
+    missing = set(imported_ids) - {row[1] for row in rows}
+    if missing:
+        raise ValueError(
+            "River basin(s) not found: {}".format(
+                ", ".join(str(x) for x in sorted(missing))
+            )
+        )
+    return [row[0] for row in rows]
+
+
+def _split(rows):
+    """Group rows by the first column (which must be sorted)."""
+    if not len(rows):
+        return {}
+    keys, indices = np.unique(rows[:, 0], return_index=True)
+    return {int(key): group for key, group in zip(keys, np.split(rows, indices[1:]))}
+
+
+def _make_network(ids, starts, ends):
+    nodes = np.unique(np.concatenate([starts, ends]))
+    nodes = nodes[nodes >= 0]
+    return Network(ids, ids, starts, ends, nodes, nodes)
+
+
+def _nanmax(values):
+    values = values[~np.isnan(values)]
+    return values.max() if len(values) else np.nan
+
+
+def _update(cursor, table, primary_key, column, ids, values):
+    """Set column to values where it differs; return the ids of the updated rows."""
+    cursor.execute(
+        """
+        UPDATE {table} t SET {column} = u.value
+        FROM unnest(%s::integer[], %s::double precision[]) AS u(id, value)
+        WHERE t.{primary_key} = u.id AND t.{column} IS DISTINCT FROM u.value
+        RETURNING t.{primary_key}
+        """.format(
+            table=table, primary_key=primary_key, column=column
+        ),
+        [
+            [int(x) for x in ids],
+            [None if np.isnan(x) else float(x) for x in values],
+        ],
+    )
+    return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,129 @@
+"""Notification of changes to the layers.
+
+Layers are changed either through Django or, more commonly, by GIS staff who edit
+the views of the "openhigis" schema with QGIS. In the first case, post_save and
+post_delete call layer_has_changed() when the transaction commits. In the second
+case, the views' triggers send a PostgreSQL NOTIFY on CHANNEL, with the name of the
+view as the payload; the "openhigis_listen" management command listens for these
+and calls layer_has_changed() (NOTIFY is also delivered on commit).
+
+layer_has_changed() stores a new random version token for the layer in the cache
+(so that other processes, which don't receive the signal, can find out that their
+cached data are stale), and sends the layer_changed signal.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.contrib.gis.db.models.functions import Envelope
+from django.contrib.gis.geos import Polygon
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal
+
+from .models import DirtyRegion
+from .registry import get_registry
+
+CHANNEL = "openhigis_layer_changed"
+
+layer_changed = Signal()  # Arguments: "layer" (a registry.Layer)
+
+
+def get_cache():
+    return caches[getattr(settings, "ENHYDRIS_OPENHIGIS_CACHE", "default")]
+
+
+def _get_version_key(layer_name):
+    return "openhigis:version:{}".format(layer_name)
+
+
+def layer_has_changed(layer_name):
+    layer = get_registry()[layer_name]
+    get_cache().set(_get_version_key(layer.name), uuid.uuid4().hex, None)
+    layer_changed.send(sender=layer.model, layer=layer)
+
+
+def get_layer_versions(layer_names):
+    """Return a dict with the current version token of each of the layers."""
+    cache = get_cache()
+    keys = {_get_version_key(name): name for name in layer_names}
+    versions = cache.get_many(keys.keys())
+    for key in keys:
+        if key not in versions:
+            # Never set (or evicted); any new token will do, but if another process
+            # is doing the same thing at the same time, we must agree on one.
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return {keys[key]: value for key, value in versions.items()}
+
+
+def mark_features_changed(cursor, layer_name, ids):
+    """Record the extent of some features of a layer as dirty and notify of it.
+
+    This is for code that changes the tables with SQL rather than through the views
+    (whose triggers do the same); ids are gentity ids. The last_modified of the
+    features is also set. The notification is delivered on commit.
+    """
+    if not ids:
+        return
+    layer = get_registry()[layer_name]
+    cursor.execute(
+        "UPDATE enhydris_gentity SET last_modified = now() WHERE id = ANY(%s)",
+        [list(ids)],
+    )
+    cursor.execute(
+        """
+        SELECT openhigis.mark_dirty(%s, NULL, ST_Extent({geom})::geometry)
+        FROM {from_clause}
+        WHERE g.id = ANY(%s)
+        """.format(
+            geom=layer.geom, from_clause=layer.from_clause
+        ),
+        [layer.name, list(ids)],
+    )
+    cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, layer.name.lower()])
+
+
+def get_layer_by_view_name(view_name):
+    """Return the layer whose view in the "openhigis" schema is view_name."""
+    for layer in get_registry():
+        if layer.name.lower() == view_name.lower():
+            return layer
+    raise KeyError(view_name)
+
+
+def connect_model_signals():
+    for layer in get_registry():
+        pre_save.connect(_model_saving, sender=layer.model)
+        post_save.connect(_model_changed, sender=layer.model)
+        post_delete.connect(_model_changed, sender=layer.model)
+
+
+def _model_saving(sender, instance, **kwargs):
+    # Like the triggers of the views, we record where the feature was before it was
+    # changed as well as where it is now, so we need to read the old geometry.
+    instance._openhigis_old_envelope = None
+    if instance.pk is not None:
+        instance._openhigis_old_envelope = (
+            sender._base_manager.filter(pk=instance.pk)
+            .annotate(envelope=Envelope("geom2100"))
+            .values_list("envelope", flat=True)
+            .first()
+        )
+
+
+def _model_changed(sender, instance, **kwargs):
+    layer = get_registry().get_by_model(sender)
+
+    # On delete, there is no old envelope and instance.geom2100 is where the feature
+    # was.
+    old_envelope = vars(instance).pop("_openhigis_old_envelope", None)
+    for geometry in (old_envelope, instance.geom2100):
+        if geometry is not None:
+            DirtyRegion.objects.create(
+                layer=layer.name, envelope=Polygon.from_bbox(geometry.extent)
+            )
+
+    # Another process must not cache the old data under the new version token.
+    transaction.on_commit(lambda: layer_has_changed(layer.name))
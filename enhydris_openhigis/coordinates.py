@@ -0,0 +1,87 @@
+"""Transformation of coordinates between spatial reference systems.
+
+Transforming GEOS geometries one by one (e.g. with Point.transform()) creates a new
+coordinate transformation each time, and it crosses into GDAL once per geometry.
+Here the CoordTransform of each pair of SRIDs is created once and reused, and a
+whole array of coordinates is transformed with a single GDAL call (the coordinates
+are packed into the WKB of a multipoint with NumPy).
+"""
+
+import threading
+
+from django.contrib.gis.gdal import CoordTransform, OGRGeometry, SpatialReference
+
+import numpy as np
+
+_WKB_MULTIPOINT_HEADER = np.dtype([("order", "u1"), ("type", "<u4"), ("n", "<u4")])
+_WKB_POINT = np.dtype([("order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+_WKB_LITTLE_ENDIAN = 1
+_WKB_POINT_TYPE = 1
+_WKB_MULTIPOINT_TYPE = 4
+
+
+_local = threading.local()
+
+
+def get_coord_transform(source_srid, target_srid):
+    # GDAL transformation objects must not be used by several threads at once, so
+    # each thread has its own.
+    transforms = _local.__dict__.setdefault("transforms", {})
+    key = (source_srid, target_srid)
+    if key not in transforms:
+        transforms[key] = CoordTransform(
+            SpatialReference(source_srid), SpatialReference(target_srid)
+        )
+    return transforms[key]
+
+
+def transform_coordinates(coordinates, source_srid, target_srid):
+    """Transform coordinates and return them as an array of shape (n, 2).
+
+    "coordinates" is an array (or anything that NumPy can convert to one) of (x, y)
+    pairs.
+    """
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    if source_srid == target_srid or not len(coordinates):
+        return coordinates.copy()
+    geometry = OGRGeometry(
+        memoryview(_pack_multipoint(coordinates)), srs=SpatialReference(source_srid)
+    )
+    geometry.transform(get_coord_transform(source_srid, target_srid))
+    return _unpack_multipoint(bytes(geometry.wkb), len(coordinates))
+
+
+def transform_extent(extent, source_srid, target_srid):
+    """Transform the lower left and upper right corner of an extent.
+
+    Returns a list [x1, y1, x2, y2].
+    """
+    corners = transform_coordinates([extent[:2], extent[2:]], source_srid, target_srid)
+    return corners.ravel().tolist()
+
+
+def _pack_multipoint(coordinates):
+    header = np.zeros(1, dtype=_WKB_MULTIPOINT_HEADER)
+    header["order"] = _WKB_LITTLE_ENDIAN
+    header["type"] = _WKB_MULTIPOINT_TYPE
+    header["n"] = len(coordinates)
+    points = np.zeros(len(coordinates), dtype=_WKB_POINT)
+    points["order"] = _WKB_LITTLE_ENDIAN
+    points["type"] = _WKB_POINT_TYPE
+    points["x"] = coordinates[:, 0]
+    points["y"] = coordinates[:, 1]
+    return header.tobytes() + points.tobytes()
+
+
+def _unpack_multipoint(wkb, n):
+    header_size = _WKB_MULTIPOINT_HEADER.itemsize
+    header = np.frombuffer(wkb[:header_size], dtype=_WKB_MULTIPOINT_HEADER)[0]
+    points = np.frombuffer(wkb[header_size:], dtype=_WKB_POINT)
+    if (
+        header["order"] != _WKB_LITTLE_ENDIAN
+        or header["n"] != n
+        or len(points) != n
+        or np.any(points["type"] != _WKB_POINT_TYPE)
+    ):
+        raise ValueError("Unexpected WKB returned by GDAL")
+    return np.column_stack((points["x"], points["y"]))
@@ -0,0 +1,434 @@
+"""Delineation of station basins from a DEM.
+
+The DEM is a raster file readable by GDAL in EPSG:2100, like in dem.py; it should be
+hydrologically conditioned (i.e. with its pits filled), because flow is not routed
+across pits and flats. From it, the D8 flow direction (the neighbouring cell with the
+steepest descent) and the flow accumulation (the number of cells upstream of each
+cell, including itself) are calculated once and cached in .npy files, which are then
+used memory-mapped (see FlowGrid).
+
+Both are calculated in tiles of TILE_SIZE × TILE_SIZE cells, so the memory needed
+does not depend on the size of the DEM. The accumulation of a tile is calculated
+with a topological sweep from the cells that have nothing upstream, plus what flows
+into it from neighbouring tiles; since that depends on the other tiles, the tiles
+into which the inflow has changed are recalculated until nothing changes.
+
+To delineate the basin of a station, the station is snapped to the cell with the
+largest accumulation within snap_distance (stations are on rivers, but the DEM's
+river may be a few cells off), the cells upstream of it are traced through the
+flow directions, and the basin is the union of the cells. The cells are traced one
+tile at a time, in a boolean buffer of the size of a tile, and each tile's cells are
+sent to the database in batches of rectangles which are dissolved as they arrive,
+so the memory needed does not depend on the size of the basin either. Each basin is
+inserted into the StationBasin view in a transaction of its own.
+"""
+
+import json
+import os
+
+from django.contrib.gis.gdal import GDALRaster
+from django.db import connection, transaction
+
+import numpy as np
+
+from . import dem, models
+
+TILE_SIZE = 2048
+RECTANGLE_BATCH_SIZE = 10000
+SNAP_DISTANCE = 50
+NODATA = 255
+
+# The flow direction of a cell is 1 + the index of the neighbour in these arrays, or
+# 0 if the cell is a pit, or NODATA.
+ROW_OFFSETS = np.array([-1, -1, -1, 0, 0, 1, 1, 1])
+COL_OFFSETS = np.array([-1, 0, 1, -1, 1, -1, 0, 1])
+
+
+class FlowGrid:
+    """D8 flow directions and flow accumulation of a DEM.
+
+    They are calculated if the files in cache_dir are missing or were calculated
+    from a different version of the DEM.
+    """
+
+    def __init__(self, dem_path, cache_dir):
+        dem.check_dem(dem_path)
+        raster = GDALRaster(dem_path)
+        self.origin = (raster.origin.x, raster.origin.y)
+        self.scale = (raster.scale.x, raster.scale.y)
+        self.shape = (raster.height, raster.width)
+        directions_path = os.path.join(cache_dir, "flow_directions.npy")
+        accumulation_path = os.path.join(cache_dir, "flow_accumulation.npy")
+        metadata_path = os.path.join(cache_dir, "metadata.json")
+        stat = os.stat(dem_path)
+        metadata = {
+            "dem": os.path.abspath(dem_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
+        if _read_metadata(metadata_path) != metadata:
+            os.makedirs(cache_dir, exist_ok=True)
+            _calculate_directions(raster, directions_path)
+            _calculate_accumulation(directions_path, accumulation_path)
+            with open(metadata_path, "w") as f:
+                json.dump(metadata, f)
+        self.directions = np.load(directions_path, mmap_mode="r")
+        self.accumulation = np.load(accumulation_path, mmap_mode="r")
+
+    def get_cell(self, x, y):
+        """Return the (row, col) of the cell that contains a point, or None."""
+        row = int(np.floor((y - self.origin[1]) / self.scale[1]))
+        col = int(np.floor((x - self.origin[0]) / self.scale[0]))
+        if not (0 <= row < self.shape[0] and 0 <= col < self.shape[1]):
+            return None
+        return row, col
+
+    def snap(self, row, col, distance):
+        """Return the cell with the largest accumulation within distance (in m)."""
+        radius = int(np.ceil(distance / abs(self.scale[0])))
+        row1, col1 = max(row - radius, 0), max(col - radius, 0)
+        row2 = min(row + radius + 1, self.shape[0])
+        col2 = min(col + radius + 1, self.shape[1])
+        window = np.array(self.accumulation[row1:row2, col1:col2])
+        i, j = np.unravel_index(np.argmax(window), window.shape)
+        return row1 + i, col1 + j
+
+    def get_upstream_rectangles(self, row, col):
+        """Yield the rectangles that make up the cells upstream of a cell.
+
+        The cells are traced one tile at a time (see _trace_tile()), and the cells of
+        each tile are converted to rectangles of horizontally adjacent cells. The
+        rectangles are yielded in arrays of at most RECTANGLE_BATCH_SIZE rows, each
+        row being (xmin, ymin, xmax, ymax).
+        """
+        width = self.shape[1]
+        pending = {
+            _get_tile_index(row, col, self.shape): [np.array([row * width + col])]
+        }
+        mask = np.zeros((TILE_SIZE, TILE_SIZE), dtype=bool)
+        while pending:
+            tile_index, cells = pending.popitem()
+            tile = _get_tile(tile_index, self.shape)
+            mask[:] = False
+            deferred = self._trace_tile(tile, np.concatenate(cells), mask)
+            deferred_rows, deferred_cols = np.divmod(deferred, width)
+            deferred_tiles = _get_tile_index(deferred_rows, deferred_cols, self.shape)
+            for i in np.unique(deferred_tiles):
+                pending.setdefault(int(i), []).append(deferred[deferred_tiles == i])
+            yield from self._get_rectangles(tile, mask[: tile[2], : tile[3]])
+
+    def _trace_tile(self, tile, cells, mask):
+        """Mark in mask the cells of a tile upstream of cells (which are in the tile).
+
+        cells are global flat indices. Each cell flows into one cell at most, so no
+        cell can be reached twice. Returns the global flat indices of the cells of
+        other tiles that flow into the marked cells; they are traced when their tile
+        is processed.
+        """
+        row, col, height, width = tile
+        grid_width = self.shape[1]
+        directions = self.directions.reshape(-1)
+        frontier = cells
+        deferred = []
+        while len(frontier):
+            rows, cols = np.divmod(frontier, grid_width)
+            mask[rows - row, cols - col] = True
+            found = []
+            for k in range(8):
+                neighbour_rows = rows - ROW_OFFSETS[k]
+                neighbour_cols = cols - COL_OFFSETS[k]
+                inside = (
+                    (neighbour_rows >= 0)
+                    & (neighbour_rows < self.shape[0])
+                    & (neighbour_cols >= 0)
+                    & (neighbour_cols < grid_width)
+                )
+                neighbours = (
+                    neighbour_rows[inside] * grid_width + neighbour_cols[inside]
+                )
+                found.append(neighbours[directions[neighbours] == k + 1])
+            found = np.concatenate(found)
+            found_rows, found_cols = np.divmod(found, grid_width)
+            in_tile = (
+                (found_rows >= row)
+                & (found_rows < row + height)
+                & (found_cols >= col)
+                & (found_cols < col + width)
+            )
+            deferred.append(found[~in_tile])
+            frontier = found[in_tile]
+        return np.concatenate(deferred) if deferred else np.zeros(0, dtype=np.int64)
+
+    def _get_rectangles(self, tile, mask):
+        """Yield the rectangles of horizontally adjacent marked cells of a tile."""
+        row, col, height, width = tile
+        padded = np.zeros((height, width + 2), dtype=np.int8)
+        padded[:, 1:-1] = mask
+        changes = np.diff(padded, axis=1)
+        rows, starts = np.nonzero(changes == 1)
+        _, ends = np.nonzero(changes == -1)
+        x1 = self.origin[0] + (col + starts) * self.scale[0]
+        x2 = self.origin[0] + (col + ends) * self.scale[0]
+        y1 = self.origin[1] + (row + rows) * self.scale[1]
+        y2 = self.origin[1] + (row + rows + 1) * self.scale[1]
+        rectangles = np.column_stack(
+            [
+                np.minimum(x1, x2),
+                np.minimum(y1, y2),
+                np.maximum(x1, x2),
+                np.maximum(y1, y2),
+            ]
+        )
+        for start in range(0, len(rectangles), RECTANGLE_BATCH_SIZE):
+            yield rectangles[slice(start, start + RECTANGLE_BATCH_SIZE)]
+
+
+def delineate_station_basins(
+    dem_path,
+    cache_dir=None,
+    station_ids=None,
+    replace=False,
+    snap_distance=SNAP_DISTANCE,
+):
+    """Delineate the basins of stations and insert them into StationBasin.
+
+    cache_dir is where the flow directions and accumulation are cached (by default,
+    <dem_path>.flow). Only stations without a basin are processed, unless replace is
+    True, in which case their basins are replaced. station_ids limits the stations
+    processed. Each basin is inserted in a transaction of its own. Returns (number of
+    basins inserted, ids of the stations skipped because they are outside the DEM or
+    any river basin).
+    """
+    grid = FlowGrid(dem_path, cache_dir or dem_path + ".flow")
+    stations = models.Station.objects.all()
+    if station_ids is not None:
+        stations = stations.filter(id__in=station_ids)
+    if not replace:
+        stations = stations.filter(stationbasin__isnull=True)
+    inserted = 0
+    skipped = []
+    for station_id, point in stations.order_by("id").values_list("id", "geom2100"):
+        cell = grid.get_cell(point.x, point.y)
+        if cell is not None and _insert_basin(
+            station_id,
+            grid.get_upstream_rectangles(*grid.snap(*cell, snap_distance)),
+            replace,
+        ):
+            inserted += 1
+        else:
+            skipped.append(station_id)
+    return inserted, skipped
+
+
+def _insert_basin(station_id, rectangle_batches, replace):
+    """Insert the basin of a station, made of rectangles, into StationBasin.
+
+    Each batch of rectangles is dissolved into a polygon in a temporary table, and
+    the basin is the union of these. Returns False (and does nothing) if the station
+    is not in any river basin.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT rb.imported_id
+            FROM
+                enhydris_openhigis_basin rb
+                INNER JOIN enhydris_openhigis_riverbasin r
+                ON r.basin_ptr_id = rb.garea_ptr_id
+                INNER JOIN enhydris_openhigis_station s
+                ON ST_Intersects(rb.geom2100, s.geom2100)
+            WHERE s.station_ptr_id = %s
+            ORDER BY rb.area
+            LIMIT 1
+            """,
+            [station_id],
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        cursor.execute(
+            "CREATE TEMPORARY TABLE openhigis_basin_parts (geometry geometry)"
+        )
+        for rectangles in rectangle_batches:
+            cursor.execute(
+                """
+                INSERT INTO openhigis_basin_parts
+                SELECT ST_Union(ST_MakeEnvelope(u.x1, u.y1, u.x2, u.y2, 2100))
+                FROM
+                    unnest(
+                        %s::double precision[],
+                        %s::double precision[],
+                        %s::double precision[],
+                        %s::double precision[]
+                    ) AS u(x1, y1, x2, y2)
+                """,
+                [rectangles[:, i].tolist() for i in range(4)],
+            )
+        if replace:
+            cursor.execute(
+                "DELETE FROM openhigis.StationBasin WHERE id = %s", [station_id]
+            )
+        cursor.execute(
+            """
+            INSERT INTO openhigis.StationBasin (id, geometry, riverBasin, origin)
+            SELECT %s, ST_Multi(ST_Union(geometry)), %s, 'natural'
+            FROM openhigis_basin_parts
+            """,
+            [station_id, row[0]],
+        )
+        cursor.execute("DROP TABLE openhigis_basin_parts")
+    return True
+
+
+def _read_metadata(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _get_tiles(shape):
+    for row in range(0, shape[0], TILE_SIZE):
+        for col in range(0, shape[1], TILE_SIZE):
+            yield row, col, min(TILE_SIZE, shape[0] - row), min(
+                TILE_SIZE, shape[1] - col
+            )
+
+
+def _get_slices(tile):
+    row, col, height, width = tile
+    return slice(row, row + height), slice(col, col + width)
+
+
+def _calculate_directions(raster, path):
+    band = raster.bands[0]
+    directions = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.uint8, shape=(raster.height, raster.width)
+    )
+    distances = np.hypot(ROW_OFFSETS * raster.scale.y, COL_OFFSETS * raster.scale.x)
+    for row, col, height, width in _get_tiles(directions.shape):
+        window = dem.read_window(band, raster, row - 1, col - 1, (height, width))
+        centre = window[1:-1, 1:-1]
+        best_drop = np.zeros((height, width))
+        best = np.zeros((height, width), dtype=np.uint8)
+        for k in range(8):
+            top, left = 1 + ROW_OFFSETS[k], 1 + COL_OFFSETS[k]
+            bottom, right = top + height, left + width
+            drop = (centre - window[top:bottom, left:right]) / distances[k]
+            steeper = drop > best_drop  # False where drop is NaN
+            best_drop[steeper] = drop[steeper]
+            best[steeper] = k + 1
+        best[np.isnan(centre)] = NODATA
+        directions[_get_slices((row, col, height, width))] = best
+    directions.flush()
+
+
+def _calculate_accumulation(directions_path, path):
+    directions = np.load(directions_path, mmap_mode="r")
+    accumulation = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.uint32, shape=directions.shape
+    )
+
+    # First calculate each tile by itself, and find the cells that flow into another
+    # tile ("sources") and the cells into which they flow ("targets").
+    tiles = list(_get_tiles(directions.shape))
+    sources, targets = [], []
+    for tile in tiles:
+        tile_sources, tile_targets = _accumulate_tile(directions, accumulation, tile)
+        sources.append(tile_sources)
+        targets.append(tile_targets)
+    sources = np.concatenate(sources)
+    targets = np.concatenate(targets)
+    target_tiles = _get_tile_indices(targets, directions.shape)
+    values = np.zeros(len(sources), dtype=np.int64)
+
+    # Then recalculate the tiles whose inflow has changed until nothing changes
+    flat_accumulation = accumulation.reshape(-1)
+    while True:
+        new_values = flat_accumulation[sources].astype(np.int64)
+        changed = np.unique(target_tiles[new_values != values])
+        values = new_values
+        if not len(changed):
+            break
+        for i in changed:
+            inflow = target_tiles == i
+            _accumulate_tile(
+                directions, accumulation, tiles[i], targets[inflow], values[inflow]
+            )
+    accumulation.flush()
+
+
+def _get_tile_indices(cells, shape):
+    rows, cols = np.divmod(cells, shape[1])
+    return _get_tile_index(rows, cols, shape)
+
+
+def _get_tile_index(row, col, shape):
+    """Return the index (in _get_tiles()) of the tile of a cell (or cells)."""
+    tiles_per_row = -(-shape[1] // TILE_SIZE)
+    return row // TILE_SIZE * tiles_per_row + col // TILE_SIZE
+
+
+def _get_tile(index, shape):
+    tiles_per_row = -(-shape[1] // TILE_SIZE)
+    row = index // tiles_per_row * TILE_SIZE
+    col = index % tiles_per_row * TILE_SIZE
+    return row, col, min(TILE_SIZE, shape[0] - row), min(TILE_SIZE, shape[1] - col)
+
+
+def _accumulate_tile(directions, accumulation, tile, inflow_cells=(), inflows=()):
+    """Calculate the accumulation of a tile.
+
+    inflow_cells are (global flat) indices of cells of the tile into which flow
+    inflows from other tiles. Returns (sources, targets), the global flat indices
+    of the cells of the tile that flow into other tiles and of the cells into which
+    they flow.
+    """
+    row, col, height, width = tile
+    tile_directions = np.array(directions[_get_slices(tile)])
+    flat_directions = tile_directions.reshape(-1)
+    n = len(flat_directions)
+    rows, cols = np.divmod(np.arange(n), width)
+    flowing = np.flatnonzero((flat_directions > 0) & (flat_directions != NODATA))
+    k = flat_directions[flowing].astype(np.int64) - 1
+    target_rows = rows[flowing] + ROW_OFFSETS[k]
+    target_cols = cols[flowing] + COL_OFFSETS[k]
+    inside = (
+        (target_rows >= 0)
+        & (target_rows < height)
+        & (target_cols >= 0)
+        & (target_cols < width)
+    )
+    targets = np.full(n, -1)
+    targets[flowing[inside]] = target_rows[inside] * width + target_cols[inside]
+
+    result = (flat_directions != NODATA).astype(np.int64)
+    if len(inflow_cells):
+        inflow_rows, inflow_cols = np.divmod(inflow_cells, directions.shape[1])
+        local_cells = (inflow_rows - row) * width + inflow_cols - col
+        np.add.at(result, local_cells, inflows)
+    indegrees = np.bincount(targets[targets >= 0], minlength=n)
+    frontier = np.flatnonzero((indegrees == 0) & (targets >= 0))
+    while len(frontier):
+        frontier_targets = targets[frontier]
+        np.add.at(result, frontier_targets, result[frontier])
+        np.subtract.at(indegrees, frontier_targets, 1)
+        frontier_targets = np.unique(frontier_targets)
+        frontier = frontier_targets[
+            (indegrees[frontier_targets] == 0) & (targets[frontier_targets] >= 0)
+        ]
+    accumulation[_get_slices(tile)] = result.reshape(height, width)
+
+    outside = flowing[~inside]
+    global_rows = row + target_rows[~inside]
+    global_cols = col + target_cols[~inside]
+    in_grid = (
+        (global_rows >= 0)
+        & (global_rows < directions.shape[0])
+        & (global_cols >= 0)
+        & (global_cols < directions.shape[1])
+    )
+    sources = (row + rows[outside]) * directions.shape[1] + col + cols[outside]
+    targets = global_rows * directions.shape[1] + global_cols
+    return sources[in_grid], targets[in_grid]
@@ -0,0 +1,251 @@
+"""Calculation of the mean elevation and mean slope of basins from a DEM.
+
+The DEM is a raster file readable by GDAL (normally a GeoTIFF) in EPSG:2100. A
+national DEM at high resolution does not fit in memory, so each basin is processed in
+blocks of at most BLOCK_SIZE × BLOCK_SIZE pixels of its bounding box; for each block,
+only that window of the DEM (plus a pixel around it, for the slope) is read, and the
+pixels whose centre is in the basin are found by rasterizing the polygon with numpy
+(see rasterize()). The sums are accumulated, so the memory needed does not depend on
+the size of the DEM or of the basin.
+
+Slope is calculated with Horn's method and is in %, like meanSlope is shown in the
+MapServer popups. Pixels with no data are ignored (and so is the slope of the pixels
+next to them).
+
+Basins are independent of one another, so they are calculated in parallel, in a pool
+of processes; each process opens the DEM once. The results are written with a
+set-based UPDATE for each layer, which touches only the rows whose values change.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.gis.gdal import GDALRaster
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon, Polygon
+from django.db import connection, transaction
+
+import numpy as np
+
+from .changes import mark_features_changed
+from .registry import get_registry
+
+LAYERS = ("RiverBasin", "DrainageBasin", "StationBasin")
+BLOCK_SIZE = 1024
+
+_rasters = {}
+
+
+def update_dem_metrics(dem_path, processes=None):
+    """Calculate mean_elevation and mean_slope of all basins and store them.
+
+    processes is the number of processes to use (by default, the number of CPUs).
+    Returns a dict with the number of basins updated in each layer. Raises ValueError
+    if the DEM is not in EPSG:2100.
+    """
+    check_dem(dem_path)
+    basins = {layer_name: load_basins(layer_name) for layer_name in LAYERS}
+    ids = [id for layer_name in LAYERS for id, _ in basins[layer_name]]
+    geometries = [wkb for layer_name in LAYERS for _, wkb in basins[layer_name]]
+    if processes == 1 or len(ids) < 2:
+        results = [calculate_basin(dem_path, wkb) for wkb in geometries]
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(
+                executor.map(
+                    calculate_basin,
+                    [dem_path] * len(geometries),
+                    geometries,
+                    chunksize=16,
+                )
+            )
+    result = {}
+    start = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for layer_name in LAYERS:
+            stop = start + len(basins[layer_name])
+            changed = _update(cursor, layer_name, ids[start:stop], results[start:stop])
+            mark_features_changed(cursor, layer_name, changed)
+            result[layer_name] = len(changed)
+            start = stop
+    return result
+
+
+def load_basins(layer_name):
+    """Return a list of (id, geometry as WKB) for the basins of a layer."""
+    layer = get_registry()[layer_name]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT g.id, ST_AsBinary({geom}) FROM {from_clause} ORDER BY g.id".format(
+                geom=layer.geom, from_clause=layer.from_clause
+            )
+        )
+        return [(id, bytes(wkb)) for id, wkb in cursor.fetchall() if wkb is not None]
+
+
+def calculate_basin(dem_path, wkb):
+    """Return (mean elevation, mean slope) of a basin.
+
+    The values are None if the basin has no pixels with data.
+    """
+    raster = _get_raster(dem_path)
+    band = raster.bands[0]
+    rings = _get_rings(GEOSGeometry(memoryview(wkb), srid=2100))
+    if not rings:
+        return None, None
+    origin = (raster.origin.x, raster.origin.y)
+    scale = (raster.scale.x, raster.scale.y)
+    xs = np.concatenate([ring[:, 0] for ring in rings])
+    ys = np.concatenate([ring[:, 1] for ring in rings])
+    cols = sorted(
+        ((xs.min() - origin[0]) / scale[0], (xs.max() - origin[0]) / scale[0])
+    )
+    rows = sorted(
+        ((ys.min() - origin[1]) / scale[1], (ys.max() - origin[1]) / scale[1])
+    )
+    col1, col2 = max(int(cols[0]), 0), min(int(np.ceil(cols[1])), raster.width)
+    row1, row2 = max(int(rows[0]), 0), min(int(np.ceil(rows[1])), raster.height)
+
+    sums = np.zeros(4)  # elevation sum, elevation count, slope sum, slope count
+    for block_row in range(row1, row2, BLOCK_SIZE):
+        for block_col in range(col1, col2, BLOCK_SIZE):
+            shape = (
+                min(BLOCK_SIZE, row2 - block_row),
+                min(BLOCK_SIZE, col2 - block_col),
+            )
+            block_origin = (
+                origin[0] + block_col * scale[0],
+                origin[1] + block_row * scale[1],
+            )
+            mask = rasterize(rings, block_origin, scale, shape)
+            if not mask.any():
+                continue
+            window = read_window(band, raster, block_row - 1, block_col - 1, shape)
+            elevations = window[1:-1, 1:-1][mask]
+            slopes = get_slope(window, scale)[mask]
+            elevations = elevations[~np.isnan(elevations)]
+            slopes = slopes[~np.isnan(slopes)]
+            sums += (elevations.sum(), len(elevations), slopes.sum(), len(slopes))
+    return (
+        float(sums[0] / sums[1]) if sums[1] else None,
+        float(sums[2] / sums[3]) if sums[3] else None,
+    )
+
+
+def rasterize(rings, origin, scale, shape):
+    """Return a boolean array of the pixels whose centre is inside the polygon.
+
+    rings is a list of (n, 2) arrays of the (closed) rings of the polygon(s); origin
+    is the coordinates of the top left corner of the top left pixel and scale the
+    size of the pixel (negative in y); shape is (rows, columns). The even-odd rule is
+    used, so holes are excluded. The array is filled by scanlines: the points where
+    the edges cross each row of pixel centres are sorted and the spans between
+    successive pairs of them are filled, so the time needed is proportional to the
+    number of edges and pixels, and not their product.
+    """
+    rows, cols = shape
+    edges = np.concatenate([np.column_stack([ring[:-1], ring[1:]]) for ring in rings])
+    # Pixel coordinates, in which pixel centres are at integers
+    u1 = (edges[:, 0] - origin[0]) / scale[0] - 0.5
+    v1 = (edges[:, 1] - origin[1]) / scale[1] - 0.5
+    u2 = (edges[:, 2] - origin[0]) / scale[0] - 0.5
+    v2 = (edges[:, 3] - origin[1]) / scale[1] - 0.5
+
+    # An edge crosses the rows r for which min(v1, v2) <= r < max(v1, v2)
+    first = np.clip(np.ceil(np.minimum(v1, v2)), 0, rows).astype(np.int64)
+    last = np.clip(np.ceil(np.maximum(v1, v2)), 0, rows).astype(np.int64)
+    counts = last - first
+    e = np.repeat(np.arange(len(edges)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    crossing_rows = np.repeat(first, counts) + offsets
+    crossing_us = u1[e] + (crossing_rows - v1[e]) * (u2[e] - u1[e]) / (v2[e] - v1[e])
+
+    order = np.lexsort((crossing_us, crossing_rows))
+    spans = crossing_us[order].reshape(-1, 2)
+    span_rows = crossing_rows[order][::2]
+    starts = np.clip(np.ceil(spans[:, 0]), 0, cols).astype(np.int64)
+    ends = np.clip(np.ceil(spans[:, 1]), 0, cols).astype(np.int64)
+    changes = np.zeros((rows, cols + 1), dtype=np.int32)
+    np.add.at(changes, (span_rows, starts), 1)
+    np.add.at(changes, (span_rows, ends), -1)
+    return np.cumsum(changes, axis=1)[:, :cols] > 0
+
+
+def get_slope(window, scale):
+    """Return the slope (in %) of the inner pixels of a window of elevations.
+
+    The result has one pixel less on each side than window; it is NaN where any of
+    the neighbours of a pixel is NaN.
+    """
+    a, b, c = window[:-2, :-2], window[:-2, 1:-1], window[:-2, 2:]
+    d, f = window[1:-1, :-2], window[1:-1, 2:]
+    g, h, i = window[2:, :-2], window[2:, 1:-1], window[2:, 2:]
+    dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * abs(scale[0]))
+    dzdy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * abs(scale[1]))
+    return 100 * np.hypot(dzdx, dzdy)
+
+
+def check_dem(dem_path):
+    raster = GDALRaster(dem_path)
+    if raster.srs is None or raster.srs.srid != 2100:
+        raise ValueError("The DEM must be in EPSG:2100")
+    if raster.skew.x or raster.skew.y:
+        raise ValueError("Rotated DEMs are not supported")
+
+
+def _get_raster(dem_path):
+    if dem_path not in _rasters:
+        _rasters[dem_path] = GDALRaster(dem_path)
+    return _rasters[dem_path]
+
+
+def _get_rings(geometry):
+    if isinstance(geometry, Polygon):
+        polygons = [geometry]
+    elif isinstance(geometry, MultiPolygon):
+        polygons = list(geometry)
+    else:
+        return []
+    return [np.array(ring.coords) for polygon in polygons for ring in polygon]
+
+
+def read_window(band, raster, row, col, shape):
+    """Read a window of shape expanded by a pixel on each side, starting at row, col.
+
+    Parts of the window outside the raster and pixels with no data are NaN.
+    """
+    rows, cols = shape[0] + 2, shape[1] + 2
+    result = np.full((rows, cols), np.nan)
+    row1, col1 = max(row, 0), max(col, 0)
+    row2, col2 = min(row + rows, raster.height), min(col + cols, raster.width)
+    data = band.data(offset=(col1, row1), size=(col2 - col1, row2 - row1))
+    data = np.asarray(data, dtype=float)
+    if band.nodata_value is not None:
+        data[data == band.nodata_value] = np.nan
+    top, left = row1 - row, col1 - col
+    bottom, right = top + data.shape[0], left + data.shape[1]
+    result[top:bottom, left:right] = data
+    return result
+
+
+def _update(cursor, layer_name, ids, values):
+    """Set mean_elevation and mean_slope where they differ; return the changed ids."""
+    layer = get_registry()[layer_name]
+    cursor.execute(
+        """
+        UPDATE {table} t
+        SET mean_elevation = u.mean_elevation, mean_slope = u.mean_slope
+        FROM
+            unnest(%s::integer[], %s::double precision[], %s::double precision[])
+            AS u(id, mean_elevation, mean_slope)
+        WHERE
+            t.{pk} = u.id
+            AND (
+                t.mean_elevation IS DISTINCT FROM u.mean_elevation
+                OR t.mean_slope IS DISTINCT FROM u.mean_slope
+            )
+        RETURNING t.{pk}
+        """.format(
+            table=layer.geom_table, pk=layer.geom_pk_column
+        ),
+        [list(ids), [x[0] for x in values], [x[1] for x in values]],
+    )
+    return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,194 @@
+"""Export of the layers to FlatGeobuf, GeoPackage and GeoParquet files.
+
+The files are written by ogr2ogr (which must be installed, with GDAL 3.5 or later for
+GeoParquet) from the views of the "openhigis" schema, to the directory specified by
+the ENHYDRIS_OPENHIGIS_EXPORT_DIR setting. The features are sorted by river basin
+(for layers that have one), so that the row groups of GeoParquet files each contain
+few river basins and readers that filter on it can skip most of them; FlatGeobuf
+files have a packed Hilbert R-tree index and GeoPackages an R*-tree index.
+
+Each file is accompanied by a <file>.stamp, which contains the maximum
+last_modified and the number of features of the layer at the time of the export;
+export_layer() regenerates the file only if these have changed since. The file and
+its stamp are each written to a temporary name and renamed, so that neither readers
+nor a crash can see them partly written. While a file is being generated, an
+exclusive lock is held on <file>.lock, so that it is not generated by two processes
+at the same time.
+
+Exporting a large layer takes minutes, so the files are generated by the
+"openhigis_export" management command or by the tasks.export_layer() Celery task,
+never while serving a request; the view only serves files that are up to date (see
+get_status()).
+"""
+
+import fcntl
+import os
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection
+
+from .registry import get_registry
+
+
+@dataclass(frozen=True)
+class Format:
+    driver: str
+    extension: str
+    layer_creation_options: tuple
+
+
+FORMATS = {
+    "fgb": Format("FlatGeobuf", "fgb", ("SPATIAL_INDEX=YES",)),
+    "gpkg": Format("GPKG", "gpkg", ("SPATIAL_INDEX=YES",)),
+    "parquet": Format("Parquet", "parquet", ("ROW_GROUP_SIZE=10000",)),
+}
+
+# The columns by which the features are sorted, in order of preference
+SORT_COLUMNS = ("riverbasin", "drainsbasin", "id")
+
+
+MISSING = "missing"
+STALE = "stale"
+UP_TO_DATE = "up to date"
+
+
+def get_export_dir():
+    return getattr(settings, "ENHYDRIS_OPENHIGIS_EXPORT_DIR", None)
+
+
+def get_path(layer_name, format_name):
+    """Return the path of the exported file (which may not exist)."""
+    filename = "{}.{}".format(layer_name, FORMATS[format_name].extension)
+    return os.path.join(get_export_dir(), filename)
+
+
+def get_stamp(layer_name):
+    """Return a string that changes whenever the features of the layer change."""
+    layer = get_registry()[layer_name]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT MAX(g.last_modified), COUNT(*) FROM {}".format(layer.from_clause)
+        )
+        last_modified, count = cursor.fetchone()
+    return "{} {}".format(last_modified.isoformat() if last_modified else "-", count)
+
+
+def get_status(layer_name, format_name):
+    """Return (path, status) of the exported file of a layer.
+
+    status is MISSING, STALE or UP_TO_DATE. Raises KeyError if the layer or the
+    format does not exist, and ValueError if ENHYDRIS_OPENHIGIS_EXPORT_DIR is not set.
+    """
+    layer = _check_arguments(layer_name, format_name)
+    path = get_path(layer.name, format_name)
+    if not os.path.exists(path):
+        return path, MISSING
+    if _read_stamp(path) != get_stamp(layer.name):
+        return path, STALE
+    return path, UP_TO_DATE
+
+
+def export_layer(layer_name, format_name, force=False):
+    """Export a layer, unless the file is up to date.
+
+    Returns a tuple (path, whether the file has been regenerated). If the file is
+    being generated by another process, waits for it to finish (and then normally
+    finds it up to date). Raises KeyError if the layer or the format does not exist,
+    ValueError if ENHYDRIS_OPENHIGIS_EXPORT_DIR is not set, and
+    subprocess.CalledProcessError if ogr2ogr fails.
+    """
+    layer = _check_arguments(layer_name, format_name)
+    format = FORMATS[format_name]
+    path = get_path(layer.name, format_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _lock(path):
+        stamp = get_stamp(layer.name)
+        if not force and os.path.exists(path) and _read_stamp(path) == stamp:
+            return path, False
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            tmp_path = os.path.join(tmp_dir, os.path.basename(path))
+            _run_ogr2ogr(layer, format, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            for filename in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, filename))
+            os.rmdir(tmp_dir)
+        _write_stamp(path, stamp)
+    return path, True
+
+
+def _check_arguments(layer_name, format_name):
+    layer = get_registry()[layer_name]
+    if format_name not in FORMATS:
+        raise KeyError(format_name)
+    if not get_export_dir():
+        raise ValueError("ENHYDRIS_OPENHIGIS_EXPORT_DIR is not set")
+    return layer
+
+
+@contextmanager
+def _lock(path):
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_stamp(path, stamp):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(stamp)
+    os.replace(tmp_path, path + ".stamp")
+
+
+def _read_stamp(path):
+    try:
+        with open(path + ".stamp") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _get_sort_column(layer):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT * FROM {} LIMIT 0".format(layer.view))
+        columns = {column[0] for column in cursor.description}
+    return next(c for c in SORT_COLUMNS if c in columns)
+
+
+def _run_ogr2ogr(layer, format, path):
+    database = connection.settings_dict
+    env = dict(os.environ)
+    for variable, key in (
+        ("PGHOST", "HOST"),
+        ("PGPORT", "PORT"),
+        ("PGUSER", "USER"),
+        ("PGPASSWORD", "PASSWORD"),
+    ):
+        if database.get(key):
+            env[variable] = str(database[key])
+    command = [
+        "ogr2ogr",
+        "-f",
+        format.driver,
+        path,
+        "PG:dbname='{}'".format(database["NAME"]),
+        "-sql",
+        "SELECT * FROM {} ORDER BY {}".format(layer.view, _get_sort_column(layer)),
+        "-nln",
+        layer.name,
+        "-a_srs",
+        "EPSG:2100",
+    ]
+    for option in format.layer_creation_options:
+        command.extend(["-lco", option])
+    subprocess.run(
+        command, env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
@@ -0,0 +1,152 @@
+"""Features of the layers as GeoJSON (RFC 7946).
+
+Like WFS, this reads the materialized views, and each feature is formatted as JSON
+by PostgreSQL. It is used for the streaming export of whole layers and for the
+feature API, which returns pages of features.
+
+For the export, the features are read through a server-side cursor in batches of
+BATCH_SIZE, so the response is written as it is being read and the memory needed
+does not depend on the size of the layer. The rows are not sorted, so that the
+first batch arrives without the whole layer having to be read first. The pages of
+the API are sorted by id and paginated by keyset (the next page starts after the
+last id of the previous one), which uses the unique index of the materialized view,
+so the cost of a page doesn't depend on how many pages precede it.
+
+Coordinates are in WGS84 (as RFC 7946 requires) unless another SRID is requested,
+with 6 decimal digits at most. The bbox filter is transformed to EPSG:2100, so that
+the spatial index of the materialized view is used; features are included if their
+bounding box intersects it.
+"""
+
+from django.db import connection
+
+from .tiles import SIMPLIFIED_GEOMETRIES, get_attribute_columns, transform_box
+
+BATCH_SIZE = 1000
+DECIMAL_DIGITS = 6
+
+
+def get_query(
+    layer,
+    bbox=None,
+    filters=None,
+    fields=None,
+    geometry=True,
+    simplify=None,
+    srid=4326,
+    after=None,
+    limit=None,
+):
+    """Return the query and params that select (id, feature as GeoJSON text).
+
+    bbox is (xmin, ymin, xmax, ymax) in srid, which is also the SRID of the
+    geometries. filters is a dict that maps column names (as returned by
+    get_attribute_columns(), case-insensitively) to values, which are compared as
+    text; fields is a list of the column names to include in the properties (by
+    default all). If geometry is False, the geometry is null (and is not read at
+    all). simplify is a tolerance in metres (see _get_geometry()). If limit is
+    specified, the features are sorted by id, and at most limit features whose id is
+    greater than after are selected. Raises ValueError if a column or the srid does
+    not exist.
+    """
+    all_columns = get_attribute_columns(layer)
+    columns = all_columns
+    if fields is not None:
+        columns = [_get_column(all_columns, name) for name in fields]
+    conditions = []
+    params = []
+    if srid != 2100:
+        _check_srid(srid)
+    if bbox is not None:
+        conditions.append("t.geometry && ST_MakeEnvelope(%s, %s, %s, %s, 2100)")
+        params.extend(bbox if srid == 2100 else transform_box(bbox, srid, 2100))
+    for name, value in (filters or {}).items():
+        conditions.append("t.{}::text = %s".format(_get_column(all_columns, name)))
+        params.append(value)
+    if after is not None:
+        conditions.append("t.id > %s")
+        params.append(after)
+    query = """
+        SELECT t.id, json_build_object(
+            'type', 'Feature',
+            'id', t.id,
+            'geometry', {geometry},
+            'properties', {properties}
+        )::text
+        FROM {materialized_view} t
+        WHERE {conditions}
+    """.format(
+        geometry=_get_geometry(layer, simplify, srid) if geometry else "NULL",
+        properties=_get_properties(columns),
+        materialized_view=layer.materialized_view,
+        conditions=" AND ".join(conditions) or "TRUE",
+    )
+    if limit is not None:
+        query += " ORDER BY t.id LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+def get_features(query, params):
+    """Return the features as a list of (id, GeoJSON text)."""
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+
+def stream_features(query, params):
+    """Yield the GeoJSON FeatureCollection in pieces."""
+    yield '{"type": "FeatureCollection", "features": [\n'
+    separator = ""
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            yield separator + ",\n".join(row[1] for row in rows)
+            separator = ",\n"
+    yield "\n]}\n"
+
+
+def _get_geometry(layer, simplify, srid):
+    """Return the SQL expression of the geometry as GeoJSON.
+
+    If simplify is specified, the most simplified of the precomputed geometries
+    (see SimplifiedGeometryMixin) whose tolerance does not exceed it is used, and it
+    is simplified further only if its tolerance is smaller.
+    """
+    column, tolerance = "geometry", 0
+    if simplify and layer.simplified:
+        for column_tolerance, simplified_column in SIMPLIFIED_GEOMETRIES:
+            if column_tolerance <= simplify:
+                column, tolerance = simplified_column, column_tolerance
+                break
+    result = "t.{}".format(column)
+    if simplify and simplify > tolerance:
+        result = "ST_SimplifyPreserveTopology({}, {})".format(result, float(simplify))
+    if srid != 2100:
+        result = "ST_Transform({}, {})".format(result, int(srid))
+    return "ST_AsGeoJSON({}, {})::json".format(result, DECIMAL_DIGITS)
+
+
+def _get_properties(columns):
+    if not columns:
+        return "'{}'::json"
+    return "(SELECT row_to_json(p) FROM (SELECT {}) p)".format(
+        ", ".join("t.{}".format(c) for c in columns)
+    )
+
+
+def _check_srid(srid):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM spatial_ref_sys WHERE srid = %s", [srid])
+        if cursor.fetchone() is None:
+            raise ValueError("Unknown SRID {}".format(srid))
+
+
+def _get_column(columns, name):
+    for column in columns:
+        if column.strip('"').lower() == name.lower():
+            return column
+    raise ValueError("Unknown attribute {}".format(name))
@@ -0,0 +1,917 @@
+"""Bulk import of layers from files readable by GDAL (shapefiles, GeoPackages etc.).
+
+Inserting into the views (as QGIS does) executes the INSTEAD OF triggers for each
+row, each of which runs several INSERTs and imported_id lookups; this is far too slow
+for a whole national dataset. Here the features of each layer are streamed with COPY
+into a temporary table that has the columns of the view, and then they are inserted
+into the tables with a few set-based statements that do what the triggers do (see
+create_views.sql); the references to other layers (by imported_id) are resolved
+with joins. The layers are imported in an order such that the layers they refer to
+have already been imported.
+
+A layer can also be replaced as a whole (for when a new version of a dataset is
+published), or only the features that differ from the existing ones can be written;
+see import_layers(). The staging tables serve as the shadow tables of a replace, but
+they aren't swapped in (e.g. with ALTER TABLE ... RENAME): the rows of a layer are
+spread over tables that it shares with other layers and with the stations
+(enhydris_gentity, enhydris_garea etc.), so there is no table that contains only the
+layer and could be swapped. Instead, the rows are deleted and inserted with a few
+set-based statements in the same transaction, which only take row locks.
+MapServer and the tiles read the materialized views, which the import doesn't touch,
+so they aren't blocked at all (they show the new version after the refresh that
+follows, see tasks.py).
+
+The attributes of the source layers must be named like the columns of the views
+(case doesn't matter); other attributes are ignored.
+"""
+
+import struct
+
+from django.contrib.gis.gdal import CoordTransform, DataSource, SpatialReference
+from django.contrib.gis.gdal.field import OFTString
+from django.db import connection, transaction
+
+from .changes import CHANNEL
+
+IMPORT_ORDER = (
+    "RiverBasinDistrict",
+    "RiverBasin",
+    "DrainageBasin",
+    "HydroNode",
+    "Watercourse",
+    "StandingWater",
+)
+
+MODES = ("append", "replace", "diff")
+
+# In "replace" and "diff" mode, how long to wait for a lock (such as that of a row
+# being edited in QGIS) before giving up
+LOCK_TIMEOUT = "10s"
+
+_GENTITY = """
+    INSERT INTO enhydris_gentity (id, name, code, remarks, geom, last_modified)
+    SELECT
+        gentity_id,
+        COALESCE(geographicalName, ''),
+        COALESCE(hydroId, ''),
+        COALESCE(remarks, ''),
+        geom4326,
+        now()
+    FROM {table}
+"""
+
+_GAREA = """
+    INSERT INTO enhydris_garea (gentity_ptr_id, category_id)
+    SELECT gentity_id, {category} FROM {table}
+"""
+
+_BASIN = """
+    INSERT INTO enhydris_openhigis_basin
+        (garea_ptr_id, geom2100, man_made, mean_slope, mean_elevation,
+        max_river_length, imported_id, imported_hash, area, geom2100_10m,
+        geom2100_100m, geom2100_1km)
+    SELECT
+        gentity_id, geometry, origin = 'manMade', meanSlope, meanElevation,
+        maxRiverLength, id, imported_hash, calculated_area, geometry_10m,
+        geometry_100m, geometry_1km
+    FROM {table}
+"""
+
+_SURFACEWATER = """
+    INSERT INTO enhydris_openhigis_surfacewater
+        (gentity_ptr_id, geom2100, local_type, man_made, river_basin_id, imported_id,
+        imported_hash, area, length, geom2100_10m, geom2100_100m, geom2100_1km)
+    SELECT
+        t.gentity_id, t.geometry, t.localType, t.origin = 'manMade',
+        river_basin.garea_ptr_id, t.id, t.imported_hash, t.calculated_area,
+        t.calculated_length, t.geometry_10m, t.geometry_100m, t.geometry_1km
+    FROM
+        {table} t
+        LEFT JOIN enhydris_openhigis_basin river_basin
+        ON river_basin.imported_id = t.drainsBasin
+"""
+
+# The statements that insert the rows of the staging table {table} into the tables.
+# The staging table has the columns of the view plus those calculated by
+# load_staging_table().
+INSERT_STATEMENTS = {
+    "RiverBasinDistrict": [
+        _GENTITY,
+        _GAREA.replace("{category}", "2"),
+        """
+        INSERT INTO enhydris_openhigis_riverbasindistrict
+            (garea_ptr_id, geom2100, imported_id, imported_hash, area, perimeter,
+            geom2100_10m, geom2100_100m, geom2100_1km)
+        SELECT
+            gentity_id, geometry, id, imported_hash, calculated_area,
+            calculated_perimeter, geometry_10m, geometry_100m, geometry_1km
+        FROM {table}
+        """,
+    ],
+    "RiverBasin": [
+        _GENTITY,
+        _GAREA.replace("{category}", "3"),
+        _BASIN,
+        """
+        INSERT INTO enhydris_openhigis_riverbasin (basin_ptr_id)
+        SELECT gentity_id FROM {table}
+        """,
+    ],
+    "DrainageBasin": [
+        _GENTITY,
+        _GAREA.replace("{category}", "4"),
+        _BASIN,
+        """
+        INSERT INTO enhydris_openhigis_drainagebasin
+            (basin_ptr_id, river_basin_id, hydro_order, hydro_order_scheme,
+            hydro_order_scope, total_area)
+        SELECT
+            t.gentity_id, river_basin.garea_ptr_id, COALESCE(t.basinOrder, ''),
+            COALESCE(t.basinOrderScheme, ''), COALESCE(t.basinOrderScope, ''),
+            t.totalArea
+        FROM
+            {table} t
+            LEFT JOIN enhydris_openhigis_basin river_basin
+            ON river_basin.imported_id = t.riverBasin
+        """,
+    ],
+    "HydroNode": [
+        _GENTITY,
+        """
+        INSERT INTO enhydris_gpoint (gentity_ptr_id, altitude)
+        SELECT gentity_id, elevation FROM {table}
+        """,
+        """
+        INSERT INTO enhydris_openhigis_hydronode
+            (gpoint_ptr_id, geom2100, imported_id, imported_hash)
+        SELECT gentity_id, geometry, id, imported_hash FROM {table}
+        """,
+    ],
+    "Watercourse": [
+        _GENTITY,
+        _SURFACEWATER,
+        """
+        INSERT INTO enhydris_openhigis_watercourse
+            (surfacewater_ptr_id, hydro_order, hydro_order_scheme, hydro_order_scope,
+            min_width, max_width, start_node_id, end_node_id)
+        SELECT
+            t.gentity_id, COALESCE(t.streamOrder, ''),
+            COALESCE(t.streamOrderScheme, ''), COALESCE(t.streamOrderScope, ''),
+            t.lowerWidth, t.upperWidth, start_node.gpoint_ptr_id,
+            end_node.gpoint_ptr_id
+        FROM
+            {table} t
+            LEFT JOIN enhydris_openhigis_hydronode start_node
+            ON start_node.imported_id = t.startNode
+            LEFT JOIN enhydris_openhigis_hydronode end_node
+            ON end_node.imported_id = t.endNode
+        """,
+    ],
+    "StandingWater": [
+        _GENTITY,
+        _SURFACEWATER,
+        """
+        INSERT INTO enhydris_openhigis_standingwater
+            (surfacewater_ptr_id, elevation, mean_depth)
+        SELECT gentity_id, elevation, meanDepth FROM {table}
+        """,
+    ],
+}
+
+
+_UPDATE_GENTITY = """
+    UPDATE enhydris_gentity g
+    SET
+        name = COALESCE(t.geographicalName, ''),
+        code = COALESCE(t.hydroId, ''),
+        remarks = COALESCE(t.remarks, ''),
+        geom = t.geom4326,
+        last_modified = now()
+    FROM {table} t
+    WHERE g.id = t.gentity_id
+"""
+
+_UPDATE_BASIN = """
+    UPDATE enhydris_openhigis_basin b
+    SET
+        geom2100 = t.geometry,
+        man_made = t.origin = 'manMade',
+        mean_slope = t.meanSlope,
+        mean_elevation = t.meanElevation,
+        max_river_length = t.maxRiverLength,
+        imported_hash = t.imported_hash,
+        area = t.calculated_area,
+        geom2100_10m = t.geometry_10m,
+        geom2100_100m = t.geometry_100m,
+        geom2100_1km = t.geometry_1km
+    FROM {table} t
+    WHERE b.garea_ptr_id = t.gentity_id
+"""
+
+_UPDATE_SURFACEWATER = """
+    UPDATE enhydris_openhigis_surfacewater s
+    SET
+        geom2100 = t.geometry,
+        local_type = t.localType,
+        man_made = t.origin = 'manMade',
+        river_basin_id = river_basin.garea_ptr_id,
+        imported_hash = t.imported_hash,
+        area = t.calculated_area,
+        length = t.calculated_length,
+        geom2100_10m = t.geometry_10m,
+        geom2100_100m = t.geometry_100m,
+        geom2100_1km = t.geometry_1km
+    FROM
+        {table} t
+        LEFT JOIN enhydris_openhigis_basin river_basin
+        ON river_basin.imported_id = t.drainsBasin
+    WHERE s.gentity_ptr_id = t.gentity_id
+"""
+
+# The statements that update the existing rows from the staging table {table}, in
+# which gentity_id has been set to the id of the existing row.
+UPDATE_STATEMENTS = {
+    "RiverBasinDistrict": [
+        _UPDATE_GENTITY,
+        """
+        UPDATE enhydris_openhigis_riverbasindistrict rbd
+        SET
+            geom2100 = t.geometry,
+            imported_hash = t.imported_hash,
+            area = t.calculated_area,
+            perimeter = t.calculated_perimeter,
+            geom2100_10m = t.geometry_10m,
+            geom2100_100m = t.geometry_100m,
+            geom2100_1km = t.geometry_1km
+        FROM {table} t
+        WHERE rbd.garea_ptr_id = t.gentity_id
+        """,
+    ],
+    "RiverBasin": [_UPDATE_GENTITY, _UPDATE_BASIN],
+    "DrainageBasin": [
+        _UPDATE_GENTITY,
+        _UPDATE_BASIN,
+        """
+        UPDATE enhydris_openhigis_drainagebasin d
+        SET
+            river_basin_id = river_basin.garea_ptr_id,
+            hydro_order = COALESCE(t.basinOrder, ''),
+            hydro_order_scheme = COALESCE(t.basinOrderScheme, ''),
+            hydro_order_scope = COALESCE(t.basinOrderScope, ''),
+            total_area = t.totalArea
+        FROM
+            {table} t
+            LEFT JOIN enhydris_openhigis_basin river_basin
+            ON river_basin.imported_id = t.riverBasin
+        WHERE d.basin_ptr_id = t.gentity_id
+        """,
+    ],
+    "HydroNode": [
+        _UPDATE_GENTITY,
+        """
+        UPDATE enhydris_gpoint p
+        SET altitude = t.elevation
+        FROM {table} t
+        WHERE p.gentity_ptr_id = t.gentity_id
+        """,
+        """
+        UPDATE enhydris_openhigis_hydronode n
+        SET geom2100 = t.geometry, imported_hash = t.imported_hash
+        FROM {table} t
+        WHERE n.gpoint_ptr_id = t.gentity_id
+        """,
+    ],
+    "Watercourse": [
+        _UPDATE_GENTITY,
+        _UPDATE_SURFACEWATER,
+        """
+        UPDATE enhydris_openhigis_watercourse w
+        SET
+            hydro_order = COALESCE(t.streamOrder, ''),
+            hydro_order_scheme = COALESCE(t.streamOrderScheme, ''),
+            hydro_order_scope = COALESCE(t.streamOrderScope, ''),
+            min_width = t.lowerWidth,
+            max_width = t.upperWidth,
+            start_node_id = start_node.gpoint_ptr_id,
+            end_node_id = end_node.gpoint_ptr_id
+        FROM
+            {table} t
+            LEFT JOIN enhydris_openhigis_hydronode start_node
+            ON start_node.imported_id = t.startNode
+            LEFT JOIN enhydris_openhigis_hydronode end_node
+            ON end_node.imported_id = t.endNode
+        WHERE w.surfacewater_ptr_id = t.gentity_id
+        """,
+    ],
+    "StandingWater": [
+        _UPDATE_GENTITY,
+        _UPDATE_SURFACEWATER,
+        """
+        UPDATE enhydris_openhigis_standingwater s
+        SET elevation = t.elevation, mean_depth = t.meanDepth
+        FROM {table} t
+        WHERE s.surfacewater_ptr_id = t.gentity_id
+        """,
+    ],
+}
+
+_KEEP_BASIN = """
+    UPDATE {table} t
+    SET
+        meanSlope = COALESCE(t.meanSlope, b.mean_slope),
+        meanElevation = COALESCE(t.meanElevation, b.mean_elevation),
+        maxRiverLength = COALESCE(t.maxRiverLength, b.max_river_length)
+    FROM
+        {old_table} o
+        INNER JOIN enhydris_openhigis_basin b ON b.garea_ptr_id = o.old_id
+    WHERE t.id = o.imported_id
+"""
+
+# The attributes that are calculated by other commands (openhigis_dem_metrics,
+# openhigis_basin_metrics and openhigis_stream_order) rather than being part of the
+# datasets. In "replace" and "diff" mode, these statements copy them from the
+# existing rows (in {old_table}) with the same imported_id into the staging table
+# {table}, wherever the file doesn't have them, so that the import doesn't set them
+# to null.
+KEEP_STATEMENTS = {
+    "RiverBasinDistrict": [],
+    "RiverBasin": [_KEEP_BASIN],
+    "DrainageBasin": [
+        _KEEP_BASIN,
+        """
+        UPDATE {table} t
+        SET totalArea = COALESCE(t.totalArea, d.total_area)
+        FROM
+            {old_table} o
+            INNER JOIN enhydris_openhigis_drainagebasin d ON d.basin_ptr_id = o.old_id
+        WHERE t.id = o.imported_id
+        """,
+    ],
+    "HydroNode": [],
+    "Watercourse": [
+        """
+        UPDATE {table} t
+        SET
+            streamOrder = COALESCE(t.streamOrder, NULLIF(w.hydro_order, '')),
+            streamOrderScheme = COALESCE(
+                t.streamOrderScheme, NULLIF(w.hydro_order_scheme, '')
+            ),
+            streamOrderScope = COALESCE(
+                t.streamOrderScope, NULLIF(w.hydro_order_scope, '')
+            )
+        FROM
+            {old_table} o
+            INNER JOIN enhydris_openhigis_watercourse w
+            ON w.surfacewater_ptr_id = o.old_id
+        WHERE t.id = o.imported_id
+        """,
+    ],
+    "StandingWater": [],
+}
+
+_OLD_BASINS = """
+    SELECT
+        b.garea_ptr_id AS old_id, b.imported_id, b.imported_hash,
+        b.geom2100 AS geometry
+    FROM
+        enhydris_openhigis_basin b
+        INNER JOIN {table} t ON t.basin_ptr_id = b.garea_ptr_id
+"""
+
+_OLD_SURFACEWATERS = """
+    SELECT
+        s.gentity_ptr_id AS old_id, s.imported_id, s.imported_hash,
+        s.geom2100 AS geometry
+    FROM
+        enhydris_openhigis_surfacewater s
+        INNER JOIN {table} t ON t.surfacewater_ptr_id = s.gentity_ptr_id
+"""
+
+# The existing rows of each layer, as (old_id, imported_id, imported_hash, geometry)
+OLD_ROWS = {
+    "RiverBasinDistrict": """
+        SELECT
+            garea_ptr_id AS old_id, imported_id, imported_hash, geom2100 AS geometry
+        FROM enhydris_openhigis_riverbasindistrict
+        """,
+    "RiverBasin": _OLD_BASINS.replace("{table}", "enhydris_openhigis_riverbasin"),
+    "DrainageBasin": _OLD_BASINS.replace("{table}", "enhydris_openhigis_drainagebasin"),
+    "HydroNode": """
+        SELECT
+            gpoint_ptr_id AS old_id, imported_id, imported_hash, geom2100 AS geometry
+        FROM enhydris_openhigis_hydronode
+        """,
+    "Watercourse": _OLD_SURFACEWATERS.replace(
+        "{table}", "enhydris_openhigis_watercourse"
+    ),
+    "StandingWater": _OLD_SURFACEWATERS.replace(
+        "{table}", "enhydris_openhigis_standingwater"
+    ),
+}
+
+# The tables that contain the rows of each layer, as (table, primary key), in the
+# order in which the rows are deleted
+TABLES = {
+    "RiverBasinDistrict": [
+        ("enhydris_openhigis_riverbasindistrict", "garea_ptr_id"),
+        ("enhydris_garea", "gentity_ptr_id"),
+        ("enhydris_gentity", "id"),
+    ],
+    "RiverBasin": [
+        ("enhydris_openhigis_riverbasin", "basin_ptr_id"),
+        ("enhydris_openhigis_basin", "garea_ptr_id"),
+        ("enhydris_garea", "gentity_ptr_id"),
+        ("enhydris_gentity", "id"),
+    ],
+    "DrainageBasin": [
+        ("enhydris_openhigis_drainagebasin", "basin_ptr_id"),
+        ("enhydris_openhigis_basin", "garea_ptr_id"),
+        ("enhydris_garea", "gentity_ptr_id"),
+        ("enhydris_gentity", "id"),
+    ],
+    "HydroNode": [
+        ("enhydris_openhigis_hydronode", "gpoint_ptr_id"),
+        ("enhydris_gpoint", "gentity_ptr_id"),
+        ("enhydris_gentity", "id"),
+    ],
+    "Watercourse": [
+        ("enhydris_openhigis_watercourse", "surfacewater_ptr_id"),
+        ("enhydris_openhigis_surfacewater", "gentity_ptr_id"),
+        ("enhydris_gentity", "id"),
+    ],
+    "StandingWater": [
+        ("enhydris_openhigis_standingwater", "surfacewater_ptr_id"),
+        ("enhydris_openhigis_surfacewater", "gentity_ptr_id"),
+        ("enhydris_gentity", "id"),
+    ],
+}
+
+# The foreign keys that refer to the rows of each layer, as (table, column,
+# nullable, layer of the table). When a layer is replaced, they are remapped to the
+# new rows with the same imported_id, unless the layer of the table is also being
+# imported.
+REFERENCES = {
+    "RiverBasinDistrict": [],
+    "RiverBasin": [
+        ("enhydris_openhigis_drainagebasin", "river_basin_id", False, "DrainageBasin"),
+        ("enhydris_openhigis_stationbasin", "river_basin_id", False, None),
+        ("enhydris_openhigis_surfacewater", "river_basin_id", True, None),
+        ("enhydris_openhigis_station", "basin_id", True, None),
+    ],
+    "DrainageBasin": [("enhydris_openhigis_station", "basin_id", True, None)],
+    "HydroNode": [
+        ("enhydris_openhigis_watercourse", "start_node_id", True, "Watercourse"),
+        ("enhydris_openhigis_watercourse", "end_node_id", True, "Watercourse"),
+    ],
+    "Watercourse": [("enhydris_openhigis_station", "surface_water_id", True, None)],
+    "StandingWater": [("enhydris_openhigis_station", "surface_water_id", True, None)],
+}
+
+
+def get_sources(paths, layer_map=None):
+    """Return a dict that maps layer names to GDAL layers.
+
+    layer_map maps names of layers in the files to names of layers of the app; if
+    it isn't specified, the layers of the files must be named like the layers of the
+    app (case doesn't matter). Other layers of the files are ignored. Raises
+    ValueError if a layer is specified twice, or if layer_map contains unknown names.
+    """
+    layer_names = {name.lower(): name for name in IMPORT_ORDER}
+    if layer_map is not None:
+        for target in layer_map.values():
+            if target.lower() not in layer_names:
+                raise ValueError("Layer {} cannot be imported".format(target))
+    result = {}
+    for path in paths:
+        for gdal_layer in DataSource(path):
+            if layer_map is None:
+                target = gdal_layer.name
+            else:
+                target = layer_map.get(gdal_layer.name)
+            if target is None or target.lower() not in layer_names:
+                continue
+            target = layer_names[target.lower()]
+            if target in result:
+                raise ValueError("More than one source for layer {}".format(target))
+            result[target] = gdal_layer
+    if layer_map is not None:
+        missing = set(layer_map) - {layer.name for layer in result.values()}
+        if missing:
+            raise ValueError(
+                "Layer(s) not found: {}".format(", ".join(sorted(missing)))
+            )
+    return result
+
+
+def import_layers(sources, mode="append"):
+    """Import the layers and return a dict with the result for each.
+
+    "sources" is the result of get_sources(). The modes are:
+
+    append
+        The features are added to the existing ones. The result for each layer is
+        the number of features.
+    replace
+        The existing features of each imported layer are deleted (see
+        replace_from_staging_table()). The result is the number of features.
+    diff
+        Only the features that are new, have changed or are missing are written
+        (see diff_from_staging_table()). The result is a dict with the number of
+        "inserted", "updated", "deleted" and "unchanged" features.
+
+    The features are first loaded into staging tables, which is the slow part;
+    after that, all layers are written in a single, short, transaction. The staging
+    tables are dropped even if the import fails (otherwise a new import on the same
+    connection would fail because they exist).
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown mode {}".format(mode))
+    result = {}
+    tables = {}
+    with connection.cursor() as cursor:
+        try:
+            for layer_name in IMPORT_ORDER:
+                if layer_name not in sources:
+                    continue
+                # If loading fails, the rollback removes the half-made table and
+                # leaves the connection usable for dropping the others.
+                with transaction.atomic():
+                    tables[layer_name] = load_staging_table(
+                        cursor, sources[layer_name], layer_name
+                    )
+            with transaction.atomic():
+                if mode != "append":
+                    cursor.execute("SET LOCAL lock_timeout = %s", [LOCK_TIMEOUT])
+                for layer_name, table in tables.items():
+                    if mode == "replace":
+                        result[layer_name] = replace_from_staging_table(
+                            cursor, table, layer_name, tables.keys()
+                        )
+                    elif mode == "diff":
+                        result[layer_name] = diff_from_staging_table(
+                            cursor, table, layer_name, tables.keys()
+                        )
+                    else:
+                        result[layer_name] = insert_from_staging_table(
+                            cursor, table, layer_name
+                        )
+        finally:
+            for table in tables.values():
+                cursor.execute("DROP TABLE {}".format(table))
+    return result
+
+
+def load_staging_table(cursor, gdal_layer, layer_name):
+    """Create a temporary table with the features of a layer and return its name.
+
+    The table has the columns of the view of the layer plus those that are
+    calculated when inserting (gentity_id, which is allocated here, geom4326,
+    calculated_area etc.), so that inserting from it into the tables is cheap. It
+    also has imported_hash, an md5 of the attributes read from the file and the
+    normalized geometry, which is stored in the tables so that the next "diff"
+    import can tell which features have changed.
+    """
+    table = "openhigis_import_{}".format(layer_name.lower())
+    raw_table = table + "_raw"
+    cursor.execute(
+        """
+        CREATE TEMPORARY TABLE {} AS SELECT * FROM openhigis.{} WITH NO DATA
+        """.format(
+            raw_table, layer_name
+        )
+    )
+    cursor.execute("SELECT * FROM {} LIMIT 0".format(raw_table))
+    view_columns = {column[0] for column in cursor.description}
+    fields = [
+        (i, name, issubclass(field_type, OFTString))
+        for i, (name, field_type) in enumerate(
+            zip(gdal_layer.fields, gdal_layer.field_types)
+        )
+        if name.lower() in view_columns and name.lower() != "geometry"
+    ]
+    columns = [name.lower() for _, name, _ in fields] + ["geometry"]
+    cursor.copy_expert(
+        "COPY {} ({}) FROM STDIN".format(raw_table, ", ".join(columns)),
+        _LineReader(_get_copy_lines(gdal_layer, fields)),
+    )
+    attributes = ", ".join("r." + column for column in sorted(columns[:-1]))
+    cursor.execute(
+        """
+        CREATE TEMPORARY TABLE {table} AS
+        SELECT
+            r.*,
+            nextval(pg_get_serial_sequence('enhydris_gentity', 'id'))::integer
+                AS gentity_id,
+            md5(
+                ROW({attributes})::text
+                || encode(ST_AsEWKB(ST_Normalize(r.geometry)), 'hex')
+            ) AS imported_hash,
+            ST_Transform(r.geometry, 4326) AS geom4326,
+            ST_Area(r.geometry) / 1000000 AS calculated_area,
+            ST_Length(r.geometry) / 1000 AS calculated_length,
+            ST_Perimeter(r.geometry) / 1000 AS calculated_perimeter,
+            ST_SimplifyPreserveTopology(r.geometry, 10) AS geometry_10m,
+            ST_SimplifyPreserveTopology(r.geometry, 100) AS geometry_100m,
+            ST_SimplifyPreserveTopology(r.geometry, 1000) AS geometry_1km
+        FROM {raw_table} r
+        """.format(
+            table=table, raw_table=raw_table, attributes=attributes
+        )
+    )
+    cursor.execute("DROP TABLE {}".format(raw_table))
+    cursor.execute("CREATE INDEX ON {} (id)".format(table))
+    cursor.execute("ANALYZE {}".format(table))
+    return table
+
+
+def insert_from_staging_table(cursor, table, layer_name):
+    """Insert the rows of the staging table into the tables; return their number."""
+    for statement in INSERT_STATEMENTS[layer_name]:
+        cursor.execute(statement.format(table=table))
+    mark_changed(cursor, layer_name, table)
+    return _count(cursor, table)
+
+
+def replace_from_staging_table(cursor, table, layer_name, replaced_layer_names):
+    """Replace the rows of a layer with those of the staging table.
+
+    The existing rows are deleted and the new ones are inserted with a few
+    set-based statements, which take only row locks, so readers (such as MapServer)
+    aren't blocked (and they see the old rows until the transaction is committed).
+    The references to the deleted rows (e.g. Station.basin) are changed to refer to
+    the new rows with the same imported_id, or set to null if there is no such row;
+    ValueError is raised if a reference that cannot be null cannot be remapped.
+    The calculated attributes that the file doesn't have are copied from the
+    deleted rows (see KEEP_STATEMENTS). replaced_layer_names are the layers being
+    replaced in the same transaction; the references from them are not remapped.
+    Returns the number of new rows.
+    """
+    old_table = _create_table(cursor, table + "_old", OLD_ROWS[layer_name])
+    _keep_calculated_attributes(cursor, table, old_table, layer_name)
+    references = _get_references(layer_name, replaced_layer_names)
+    _check_references(cursor, table, old_table, references)
+    _delete_rows(cursor, layer_name, old_table)
+    for statement in INSERT_STATEMENTS[layer_name]:
+        cursor.execute(statement.format(table=table))
+    _remap_references(cursor, table, old_table, references)
+    mark_changed(cursor, layer_name, old_table, table)
+    cursor.execute("DROP TABLE {}".format(old_table))
+    return _count(cursor, table)
+
+
+def diff_from_staging_table(cursor, table, layer_name, imported_layer_names):
+    """Write only the differences between the staging table and the layer.
+
+    The features are matched by imported_id, and a feature has changed if its
+    imported_hash differs from that of the existing row (the hash of a row is
+    cleared when the row is modified in any other way than by an import). Changed
+    rows are updated in place (so their ids, and the references to them, stay the
+    same, and their last_modified is set, but the calculated attributes that the
+    file doesn't have are kept, see KEEP_STATEMENTS); rows missing from the staging
+    table are deleted, and the references to them are set to null as in
+    replace_from_staging_table(). If nothing has changed, the layer is not marked as
+    changed. Returns a dict with the number of "inserted", "updated", "deleted" and
+    "unchanged" features.
+    """
+    old_table = _create_table(cursor, table + "_old", OLD_ROWS[layer_name])
+    _keep_calculated_attributes(cursor, table, old_table, layer_name)
+    stale_table = _create_table(
+        cursor,
+        table + "_stale",
+        """
+        SELECT o.*
+        FROM {old_table} o LEFT JOIN {table} t ON t.id = o.imported_id
+        WHERE t.id IS NULL OR t.imported_hash IS DISTINCT FROM o.imported_hash
+        """.format(
+            old_table=old_table, table=table
+        ),
+    )
+    deleted_table = _create_table(
+        cursor,
+        table + "_deleted",
+        """
+        SELECT s.*
+        FROM {stale_table} s
+        WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.id = s.imported_id)
+        """.format(
+            stale_table=stale_table, table=table
+        ),
+    )
+    changed_table = _create_table(
+        cursor,
+        table + "_changed",
+        """
+        SELECT t.* FROM {table} t INNER JOIN {stale_table} s ON s.imported_id = t.id
+        """.format(
+            table=table, stale_table=stale_table
+        ),
+    )
+    cursor.execute(
+        """
+        UPDATE {changed_table} c SET gentity_id = s.old_id
+        FROM {stale_table} s WHERE s.imported_id = c.id
+        """.format(
+            changed_table=changed_table, stale_table=stale_table
+        )
+    )
+    new_table = _create_table(
+        cursor,
+        table + "_new",
+        """
+        SELECT t.*
+        FROM {table} t
+        WHERE NOT EXISTS (SELECT 1 FROM {old_table} o WHERE o.imported_id = t.id)
+        """.format(
+            table=table, old_table=old_table
+        ),
+    )
+
+    references = _get_references(layer_name, imported_layer_names)
+    _check_references(cursor, table, deleted_table, references)
+    _remap_references(cursor, table, deleted_table, references)
+    _delete_rows(cursor, layer_name, deleted_table)
+    for statement in UPDATE_STATEMENTS[layer_name]:
+        cursor.execute(statement.format(table=changed_table))
+    for statement in INSERT_STATEMENTS[layer_name]:
+        cursor.execute(statement.format(table=new_table))
+
+    result = {
+        "inserted": _count(cursor, new_table),
+        "updated": _count(cursor, changed_table),
+        "deleted": _count(cursor, deleted_table),
+    }
+    result["unchanged"] = _count(cursor, table) - result["inserted"] - result["updated"]
+    if result["inserted"] or result["updated"] or result["deleted"]:
+        mark_changed(cursor, layer_name, stale_table, changed_table, new_table)
+    for t in (old_table, stale_table, deleted_table, changed_table, new_table):
+        cursor.execute("DROP TABLE {}".format(t))
+    return result
+
+
+def _create_table(cursor, name, query):
+    cursor.execute("CREATE TEMPORARY TABLE {} AS {}".format(name, query))
+    cursor.execute("ANALYZE {}".format(name))
+    return name
+
+
+def _keep_calculated_attributes(cursor, table, old_table, layer_name):
+    # This doesn't change imported_hash, which was calculated from the file.
+    for statement in KEEP_STATEMENTS[layer_name]:
+        cursor.execute(statement.format(table=table, old_table=old_table))
+
+
+def _get_references(layer_name, imported_layer_names):
+    """Return the references to a layer that need to be remapped.
+
+    The result is a list of (table, column, nullable); references from the tables of
+    imported_layer_names are omitted.
+    """
+    return [
+        (ref_table, column, nullable)
+        for ref_table, column, nullable, ref_layer_name in REFERENCES[layer_name]
+        if ref_layer_name not in imported_layer_names
+    ]
+
+
+def _check_references(cursor, table, old_table, references):
+    """Raise ValueError if references that cannot be null cannot be remapped."""
+    for ref_table, column, nullable in references:
+        if nullable:
+            continue
+        cursor.execute(
+            """
+            SELECT COUNT(*)
+            FROM
+                {ref_table} r
+                INNER JOIN {old_table} o ON r.{column} = o.old_id
+                LEFT JOIN {table} t ON t.id = o.imported_id
+            WHERE t.id IS NULL
+            """.format(
+                ref_table=ref_table, column=column, old_table=old_table, table=table
+            )
+        )
+        (count,) = cursor.fetchone()
+        if count:
+            raise ValueError(
+                "{} rows of {} refer to features that are missing from the new "
+                "version".format(count, ref_table)
+            )
+
+
+def _remap_references(cursor, table, old_table, references):
+    """Make references to rows of old_table refer to the rows of table.
+
+    The rows are matched by imported_id; references to rows that have no match are
+    set to null. The foreign key constraints are deferred, so the references may be
+    invalid until the end of the transaction.
+    """
+    for ref_table, column, _ in references:
+        cursor.execute(
+            """
+            UPDATE {ref_table} r SET {column} = t.gentity_id
+            FROM {old_table} o LEFT JOIN {table} t ON t.id = o.imported_id
+            WHERE r.{column} = o.old_id
+            """.format(
+                ref_table=ref_table, column=column, old_table=old_table, table=table
+            )
+        )
+
+
+def _delete_rows(cursor, layer_name, old_table):
+    for model_table, primary_key in TABLES[layer_name]:
+        cursor.execute(
+            """
+            DELETE FROM {} WHERE {} IN (SELECT old_id FROM {})
+            """.format(
+                model_table, primary_key, old_table
+            )
+        )
+
+
+def _count(cursor, table):
+    cursor.execute("SELECT COUNT(*) FROM {}".format(table))
+    return cursor.fetchone()[0]
+
+
+def mark_changed(cursor, layer_name, *tables):
+    """Record the extents of the rows of tables as dirty and notify of the change.
+
+    The notification is the one sent by the triggers of the views (and it is
+    delivered on commit), so that the rest (cache invalidation, refreshing the
+    materialized views) happens in the same way as when the layer is edited with
+    QGIS.
+    """
+    for table in tables:
+        cursor.execute(
+            """
+            SELECT openhigis.mark_dirty(%s, NULL, ST_Extent(geometry)::geometry)
+            FROM {}
+            """.format(
+                table
+            ),
+            [layer_name],
+        )
+    cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, layer_name.lower()])
+
+
+def _get_copy_lines(gdal_layer, fields):
+    srs = gdal_layer.srs
+    transform = None
+    if srs is not None and srs.srid != 2100:
+        transform = CoordTransform(srs, SpatialReference(2100))
+    for feature in gdal_layer:
+        values = []
+        for i, _, is_string in fields:
+            value = feature[i].as_string()
+            if is_string:
+                values.append(_escape_copy_text(value))
+            else:
+                values.append(value if value != "" else r"\N")
+        geometry = feature.geom
+        if geometry.coord_dim != 2:
+            geometry.coord_dim = 2
+        if transform is not None:
+            geometry.transform(transform)
+        values.append(_get_ewkb_hex(bytes(geometry.wkb), 2100))
+        yield "\t".join(values) + "\n"
+
+
+def _escape_copy_text(value):
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _get_ewkb_hex(wkb, srid):
+    """Convert WKB to hex EWKB (i.e. add the SRID), which PostGIS reads fastest."""
+    byte_order = "<" if wkb[0] == 1 else ">"
+    (geometry_type,) = struct.unpack(byte_order + "I", wkb[1:5])
+    header = wkb[:1] + struct.pack(byte_order + "II", geometry_type | 0x20000000, srid)
+    return (header + wkb[5:]).hex()
+
+
+class _LineReader:
+    """A file-like object whose read() returns the lines yielded by an iterator.
+
+    It lets COPY read the features as they are being read from the file, so memory
+    use doesn't depend on the number of features.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer.extend(next(self.lines).encode("utf-8"))
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        result = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return result
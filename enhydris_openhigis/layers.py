@@ -0,0 +1,177 @@
+"""Read-only models of the views of the "openhigis" schema (see create_views.sql).
+
+The models of models.py use multi-table inheritance, so reading a watercourse joins
+enhydris_gentity, enhydris_openhigis_surfacewater and enhydris_openhigis_watercourse,
+and its river basin and nodes need more queries. The views have already joined
+these, so the models of this module, which are unmanaged models mapped onto the
+views, read a layer with its attributes in a single query. Foreign keys are on the
+ids of the views (i.e. the imported ids), so that select_related() also joins views.
+
+These models are for reading. The models are unmanaged, so migrations never touch
+the views, and none of the code of the app writes through them; to modify features,
+use the models of models.py or the views themselves (whose triggers write to the
+tables).
+"""
+
+from django.contrib.gis.db import models
+
+
+def _get_foreign_key(to, db_column, **kwargs):
+    return models.ForeignKey(
+        to,
+        on_delete=models.DO_NOTHING,
+        db_column=db_column,
+        db_constraint=False,
+        null=True,
+        **kwargs,
+    )
+
+
+class LayerModel(models.Model):
+    id = models.IntegerField(primary_key=True)
+    hydro_id = models.TextField(db_column="hydroid")
+    remarks = models.TextField()
+    geometry = models.GeometryField(srid=2100, spatial_index=False)
+
+    class Meta:
+        abstract = True
+        managed = False
+
+
+class HydroObjectMixin(models.Model):
+    geographical_name = models.TextField(db_column="geographicalname")
+    begin_lifespan_version = models.DateTimeField(
+        db_column="beginlifespanversion", null=True
+    )
+    origin = models.TextField()
+
+    class Meta:
+        abstract = True
+
+
+class BasinMixin(models.Model):
+    area = models.FloatField(null=True)
+    mean_slope = models.FloatField(db_column="meanslope", null=True)
+    mean_elevation = models.FloatField(db_column="meanelevation", null=True)
+    max_river_length = models.FloatField(db_column="maxriverlength", null=True)
+
+    class Meta:
+        abstract = True
+
+
+class SurfaceWaterMixin(models.Model):
+    length = models.FloatField(null=True)
+    local_type = models.TextField(db_column="localtype")
+
+    class Meta:
+        abstract = True
+
+
+class StationLayer(LayerModel):
+    """The Station view; "id" is the id of the station in Enhydris.
+
+    "basin" and "surface_water" are imported ids of a basin (either a river basin or
+    a drainage basin) and of a surface water (either a watercourse or a standing
+    water), so they aren't foreign keys.
+    """
+
+    name = models.TextField()
+    elevation = models.FloatField(null=True)
+    responsible_party = _get_foreign_key(
+        "enhydris.Lentity", "responsibleparty", related_name="+"
+    )
+    basin = models.IntegerField(null=True)
+    surface_water = models.IntegerField(db_column="surfacewater", null=True)
+
+    class Meta(LayerModel.Meta):
+        db_table = 'openhigis"."station'
+
+
+class RiverBasinDistrictLayer(LayerModel):
+    geographical_name = models.TextField(db_column="geographicalname")
+    length = models.FloatField(db_column="length_km", null=True)
+    area = models.FloatField(db_column="area_sqkm", null=True)
+
+    class Meta(LayerModel.Meta):
+        db_table = 'openhigis"."riverbasindistrict'
+
+
+class RiverBasinLayer(LayerModel, HydroObjectMixin, BasinMixin):
+    class Meta(LayerModel.Meta):
+        db_table = 'openhigis"."riverbasin'
+
+
+class DrainageBasinLayer(LayerModel, HydroObjectMixin, BasinMixin):
+    river_basin = _get_foreign_key(
+        RiverBasinLayer, "riverbasin", related_name="drainage_basins"
+    )
+    basin_order = models.TextField(db_column="basinorder")
+    basin_order_scheme = models.TextField(db_column="basinorderscheme")
+    basin_order_scope = models.TextField(db_column="basinorderscope")
+    total_area = models.FloatField(db_column="totalarea", null=True)
+
+    class Meta(LayerModel.Meta):
+        db_table = 'openhigis"."drainagebasin'
+
+
+class StationBasinLayer(LayerModel, HydroObjectMixin, BasinMixin):
+    """The StationBasin view; "id" is the id of the station."""
+
+    river_basin = _get_foreign_key(
+        RiverBasinLayer, "riverbasin", related_name="station_basins"
+    )
+
+    class Meta(LayerModel.Meta):
+        db_table = 'openhigis"."stationbasin'
+
+
+class HydroNodeLayer(LayerModel):
+    geographical_name = models.TextField(db_column="geographicalname")
+    elevation = models.FloatField(null=True)
+
+    class Meta(LayerModel.Meta):
+        db_table = 'openhigis"."hydronode'
+
+
+class WatercourseLayer(LayerModel, HydroObjectMixin, SurfaceWaterMixin):
+    drains_basin = _get_foreign_key(
+        RiverBasinLayer, "drainsbasin", related_name="watercourses"
+    )
+    stream_order = models.TextField(db_column="streamorder")
+    stream_order_scheme = models.TextField(db_column="streamorderscheme")
+    stream_order_scope = models.TextField(db_column="streamorderscope")
+    lower_width = models.FloatField(db_column="lowerwidth", null=True)
+    upper_width = models.FloatField(db_column="upperwidth", null=True)
+    start_node = _get_foreign_key(
+        HydroNodeLayer, "startnode", related_name="watercourses_starting"
+    )
+    end_node = _get_foreign_key(
+        HydroNodeLayer, "endnode", related_name="watercourses_ending"
+    )
+
+    class Meta(LayerModel.Meta):
+        db_table = 'openhigis"."watercourse'
+
+
+class StandingWaterLayer(LayerModel, HydroObjectMixin, SurfaceWaterMixin):
+    drains_basin = _get_foreign_key(
+        RiverBasinLayer, "drainsbasin", related_name="standing_waters"
+    )
+    elevation = models.FloatField(null=True)
+    mean_depth = models.FloatField(db_column="meandepth", null=True)
+    area = models.FloatField(null=True)
+
+    class Meta(LayerModel.Meta):
+        db_table = 'openhigis"."standingwater'
+
+
+LAYER_MODELS = {
+    "Station": StationLayer,
+    "RiverBasinDistrict": RiverBasinDistrictLayer,
+    "RiverBasin": RiverBasinLayer,
+    "DrainageBasin": DrainageBasinLayer,
+    "StationBasin": StationBasinLayer,
+    "HydroNode": HydroNodeLayer,
+    "Watercourse": WatercourseLayer,
+    "StandingWater": StandingWaterLayer,
+}
@@ -0,0 +1,204 @@
+"""Spatial linking of stations and surface waters to basins and surface waters.
+
+Each link fills in a foreign key from the geometries:
+
+- station_basin: Station.basin is the smallest basin that contains the station.
+- station_surface_water: Station.surface_water is the nearest surface water within
+  tolerance (found with the KNN operator <->, which uses the spatial index).
+- surface_water_river_basin: SurfaceWater.river_basin is the river basin that
+  contains most of the surface water (by length for watercourses, by area for
+  standing waters).
+- station_basin_river_basin: StationBasin.river_basin is the river basin that
+  contains most of the station basin.
+
+Each link is a single UPDATE whose candidates are found by a correlated subquery
+that uses the spatial indexes. Only empty foreign keys are filled in, unless
+overwrite is True; foreign keys are never emptied. The tables are updated directly,
+so the changes are marked and notified like the triggers of the views do.
+"""
+
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+
+from .changes import mark_features_changed
+
+SURFACE_WATER_TOLERANCE = 50
+
+
+@dataclass(frozen=True)
+class Link:
+    """A foreign key and the query that finds its value.
+
+    "candidates" selects (id, value) from "table" aliased "x"; it has a {condition}
+    placeholder for the WHERE clause. "layers" are the layers whose views show the
+    foreign key.
+    """
+
+    table: str
+    pk_column: str
+    column: str
+    candidates: str
+    layers: tuple
+    uses_tolerance: bool = False
+
+
+LINKS = {
+    "station_basin": Link(
+        table="enhydris_openhigis_station",
+        pk_column="station_ptr_id",
+        column="basin_id",
+        candidates="""
+            SELECT
+                x.station_ptr_id,
+                (
+                    SELECT b.garea_ptr_id
+                    FROM enhydris_openhigis_basin b
+                    WHERE ST_Intersects(b.geom2100, x.geom2100)
+                    ORDER BY b.area
+                    LIMIT 1
+                )
+            FROM enhydris_openhigis_station x
+            WHERE {condition}
+        """,
+        layers=("Station",),
+    ),
+    "station_surface_water": Link(
+        table="enhydris_openhigis_station",
+        pk_column="station_ptr_id",
+        column="surface_water_id",
+        candidates="""
+            SELECT
+                x.station_ptr_id,
+                (
+                    SELECT sw.gentity_ptr_id
+                    FROM enhydris_openhigis_surfacewater sw
+                    WHERE ST_DWithin(sw.geom2100, x.geom2100, %s)
+                    ORDER BY sw.geom2100 <-> x.geom2100
+                    LIMIT 1
+                )
+            FROM enhydris_openhigis_station x
+            WHERE {condition}
+        """,
+        layers=("Station",),
+        uses_tolerance=True,
+    ),
+    "surface_water_river_basin": Link(
+        table="enhydris_openhigis_surfacewater",
+        pk_column="gentity_ptr_id",
+        column="river_basin_id",
+        candidates="""
+            SELECT
+                x.gentity_ptr_id,
+                (
+                    SELECT r.basin_ptr_id
+                    FROM
+                        enhydris_openhigis_riverbasin r
+                        INNER JOIN enhydris_openhigis_basin b
+                        ON b.garea_ptr_id = r.basin_ptr_id
+                    WHERE ST_Intersects(b.geom2100, x.geom2100)
+                    ORDER BY
+                        CASE
+                            WHEN ST_Covers(b.geom2100, x.geom2100)
+                                THEN 'Infinity'::double precision
+                            WHEN ST_Dimension(x.geom2100) = 1
+                                THEN ST_Length(ST_Intersection(b.geom2100, x.geom2100))
+                            ELSE ST_Area(ST_Intersection(b.geom2100, x.geom2100))
+                        END DESC
+                    LIMIT 1
+                )
+            FROM enhydris_openhigis_surfacewater x
+            WHERE {condition}
+        """,
+        layers=("Watercourse", "StandingWater"),
+    ),
+    "station_basin_river_basin": Link(
+        table="enhydris_openhigis_stationbasin",
+        pk_column="garea_ptr_id",
+        column="river_basin_id",
+        candidates="""
+            SELECT
+                x.garea_ptr_id,
+                (
+                    SELECT r.basin_ptr_id
+                    FROM
+                        enhydris_openhigis_riverbasin r
+                        INNER JOIN enhydris_openhigis_basin b
+                        ON b.garea_ptr_id = r.basin_ptr_id
+                    WHERE ST_Intersects(b.geom2100, x.geom2100)
+                    ORDER BY
+                        CASE
+                            WHEN ST_Covers(b.geom2100, x.geom2100)
+                                THEN 'Infinity'::double precision
+                            ELSE ST_Area(ST_Intersection(b.geom2100, x.geom2100))
+                        END DESC
+                    LIMIT 1
+                )
+            FROM enhydris_openhigis_stationbasin x
+            WHERE {condition}
+        """,
+        layers=("StationBasin",),
+    ),
+}
+
+STATION_LINKS = ("station_basin", "station_surface_water")
+
+
+def link(
+    link_names=None,
+    overwrite=False,
+    dry_run=False,
+    station_ids=None,
+    tolerance=SURFACE_WATER_TOLERANCE,
+):
+    """Fill in the foreign keys of the links.
+
+    link_names are keys of LINKS (by default, all of them). station_ids limits the
+    station links to these stations (and the other links are then not run). If
+    dry_run is True, the changes are rolled back. Returns a dict that maps each link
+    name to the list of the ids of the rows changed.
+    """
+    if link_names is None:
+        link_names = STATION_LINKS if station_ids is not None else LINKS.keys()
+    result = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name in link_names:
+            result[name] = _link(cursor, LINKS[name], overwrite, station_ids, tolerance)
+        if dry_run:
+            transaction.set_rollback(True)
+    return result
+
+
+def link_station(station):
+    """Fill in the empty foreign keys of a station (and update the instance)."""
+    link(STATION_LINKS, station_ids=[station.id])
+    station.refresh_from_db(fields=["basin", "surface_water"])
+
+
+def _link(cursor, link, overwrite, station_ids, tolerance):
+    conditions = ["TRUE" if overwrite else "x.{} IS NULL".format(link.column)]
+    params = [tolerance] if link.uses_tolerance else []
+    if station_ids is not None:
+        conditions.append("x.{} = ANY(%s)".format(link.pk_column))
+        params.append(list(station_ids))
+    cursor.execute(
+        """
+        UPDATE {table} t SET {column} = c.value
+        FROM ({candidates}) AS c(id, value)
+        WHERE
+            t.{pk_column} = c.id
+            AND c.value IS NOT NULL
+            AND t.{column} IS DISTINCT FROM c.value
+        RETURNING t.{pk_column}
+        """.format(
+            table=link.table,
+            column=link.column,
+            pk_column=link.pk_column,
+            candidates=link.candidates.format(condition=" AND ".join(conditions)),
+        ),
+        params,
+    )
+    ids = sorted(row[0] for row in cursor.fetchall())
+    for layer_name in link.layers:
+        mark_features_changed(cursor, layer_name, ids)
+    return ids
@@ -0,0 +1,105 @@
+"""Finding the river basin district, river basin and drainage basin of a point.
+
+Asking the database (or MapServer, with GetFeatureInfo) on every map click is slow
+compared to what is needed, so the polygons of these layers are kept in memory as
+GEOS prepared geometries, which have an internal index of their edges and answer
+point-in-polygon queries in about logarithmic time. To avoid testing every polygon,
+their bounding boxes are kept in NumPy arrays, and only the polygons whose bounding
+box contains the point (normally one or two per layer) are tested. The polygons of
+each layer are sorted by area, so where polygons overlap the smallest one is found.
+
+The polygons are read from the views (through the models of layers.py), with a
+single query per layer. get_indexes() loads each layer once per process and reloads
+it whenever its version token changes (see changes.py), so a lookup doesn't touch
+the database.
+"""
+
+import threading
+
+from django.contrib.gis.geos import Point
+
+import numpy as np
+
+from .changes import get_layer_versions
+from .coordinates import transform_coordinates
+from .layers import LAYER_MODELS
+
+LOCATE_LAYERS = ("RiverBasinDistrict", "RiverBasin", "DrainageBasin")
+
+_lock = threading.Lock()
+_indexes = {}
+_index_versions = {}
+
+
+class PolygonIndex:
+    """The polygons of a layer, for finding the one that contains a point.
+
+    ids and names are sequences, and geometries is a sequence of GEOSGeometry
+    objects in EPSG:2100; they are sorted by area.
+    """
+
+    def __init__(self, ids, names, geometries):
+        order = sorted(range(len(geometries)), key=lambda i: geometries[i].area)
+        self.ids = [ids[i] for i in order]
+        self.names = [names[i] for i in order]
+        extents = np.array([geometries[i].extent for i in order], dtype=float)
+        self.extents = extents.reshape(-1, 4)
+        self.prepared = [geometries[i].prepared for i in order]
+        # GEOS builds the index of a prepared geometry on its first use, and this is
+        # not thread safe.
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find(self, x, y):
+        """Return (id, name) of the smallest polygon that covers x, y, or None."""
+        extents = self.extents
+        candidates = np.flatnonzero(
+            (extents[:, 0] <= x)
+            & (extents[:, 1] <= y)
+            & (extents[:, 2] >= x)
+            & (extents[:, 3] >= y)
+        )
+        if not len(candidates):
+            return None
+        point = Point(x, y, srid=2100)
+        with self._lock:
+            for i in candidates:
+                if self.prepared[i].covers(point):
+                    return self.ids[i], self.names[i]
+        return None
+
+
+def get_indexes():
+    """Return a dict with the index of each of LOCATE_LAYERS.
+
+    The layers that have changed since they were last loaded are reloaded.
+    """
+    # As in network.get_network(), the versions are read before loading.
+    versions = get_layer_versions(LOCATE_LAYERS)
+    with _lock:
+        for layer_name in LOCATE_LAYERS:
+            if _index_versions.get(layer_name) != versions[layer_name]:
+                _indexes[layer_name] = load_index(layer_name)
+                _index_versions[layer_name] = versions[layer_name]
+        return {layer_name: _indexes[layer_name] for layer_name in LOCATE_LAYERS}
+
+
+def load_index(layer_name):
+    rows = list(
+        LAYER_MODELS[layer_name]
+        .objects.filter(geometry__isnull=False)
+        .values_list("id", "geographical_name", "geometry")
+    )
+    ids, names, geometries = zip(*rows) if rows else ((), (), ())
+    return PolygonIndex(ids, names, geometries)
+
+
+def locate(lat, lon):
+    """Return a dict that maps each of LOCATE_LAYERS to (id, name) or None.
+
+    The ids are those of the views, i.e. the imported ids.
+    """
+    x, y = transform_coordinates([(lon, lat)], 4326, 2100)[0]
+    return {name: index.find(x, y) for name, index in get_indexes().items()}
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from enhydris_openhigis import basin_metrics
+
+
+class Command(BaseCommand):
+    help = (
+        "Calculate the max river length of the river basins and drainage basins and "
+        "the total area of the drainage basins from the network"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--river-basin",
+            type=int,
+            action="append",
+            dest="river_basins",
+            help=(
+                "The id of the river basin (as in the RiverBasin view) to calculate; "
+                "can be specified many times (default: all river basins)"
+            ),
+        )
+        parser.add_argument(
+            "--changed",
+            action="store_true",
+            help=(
+                "Calculate only the river basins that have changed since the last "
+                "run (all of them if there is no record of a last run)"
+            ),
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            help="The number of processes to use (default: the number of CPUs)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            result = basin_metrics.update_basin_metrics(
+                options["river_basins"], options["processes"], options["changed"]
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        for layer_name, updated in result.items():
+            self.stdout.write("{}: {} updated".format(layer_name, updated))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from enhydris_openhigis import search_cache
+
+
+class Command(BaseCommand):
+    help = "Show the hits and misses of the search result cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Reset the counters to zero"
+        )
+
+    def handle(self, *args, **options):
+        stats = search_cache.get_stats()
+        total = stats["hits"] + stats["misses"]
+        hit_ratio = "{:.1%}".format(stats["hits"] / total) if total else "-"
+        self.stdout.write(
+            "hits: {hits}, misses: {misses}, hit ratio: {hit_ratio}".format(
+                hit_ratio=hit_ratio, **stats
+            )
+        )
+        if options["reset"]:
+            search_cache.reset_stats()
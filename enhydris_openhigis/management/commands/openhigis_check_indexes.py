@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+CHECKS = (
+    (
+        "pg_trgm extension",
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'",
+    ),
+    (
+        "unaccent extension",
+        "SELECT 1 FROM pg_extension WHERE extname = 'unaccent'",
+    ),
+    (
+        "openhigis_normalize() function",
+        """
+        SELECT 1 FROM pg_proc p INNER JOIN pg_namespace n ON n.oid = p.pronamespace
+        WHERE n.nspname = 'public' AND p.proname = 'openhigis_normalize'
+            AND p.provolatile = 'i'
+        """,
+    ),
+    (
+        "enhydris_openhigis_gentity_name_trgm index",
+        """
+        SELECT 1 FROM pg_indexes
+        WHERE tablename = 'enhydris_gentity'
+            AND indexname = 'enhydris_openhigis_gentity_name_trgm'
+        """,
+    ),
+)
+
+
+class Command(BaseCommand):
+    help = "Verify that the database objects needed for fast name search exist"
+
+    def handle(self, *args, **options):
+        missing = []
+        with connection.cursor() as cursor:
+            for description, query in CHECKS:
+                cursor.execute(query)
+                found = cursor.fetchone() is not None
+                self.stdout.write(
+                    "{}: {}".format(description, "ok" if found else "MISSING")
+                )
+                if not found:
+                    missing.append(description)
+        if missing:
+            raise CommandError(
+                'Missing {}; run "manage.py migrate enhydris_openhigis"'.format(
+                    ", ".join(missing)
+                )
+            )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from enhydris_openhigis.registry import get_registry
+from enhydris_openhigis.tasks import get_stale_layers
+
+
+class Command(BaseCommand):
+    help = (
+        "Verify that the materialized views, from which MapServer and the tiles "
+        "read, are being refreshed after the layers change"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=float,
+            default=600,
+            help=(
+                "Seconds that a change may wait for the refresh, in addition to "
+                "ENHYDRIS_OPENHIGIS_REFRESH_DELAY"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        stale_layers = get_stale_layers(options["max_age"])
+        for layer in get_registry():
+            if layer.name in stale_layers:
+                status = "STALE since {:%Y-%m-%d %H:%M:%S %Z}".format(
+                    stale_layers[layer.name]
+                )
+            else:
+                status = "ok"
+            self.stdout.write("{}: {}".format(layer.name, status))
+        if stale_layers:
+            raise CommandError(
+                "The materialized views of {} have not been refreshed; is a Celery "
+                "worker running?".format(", ".join(sorted(stale_layers)))
+            )
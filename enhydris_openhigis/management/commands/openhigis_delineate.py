@@ -0,0 +1,66 @@
+from django.contrib.gis.gdal import GDALException
+from django.core.management.base import BaseCommand, CommandError
+
+from enhydris_openhigis import delineation
+
+
+class Command(BaseCommand):
+    help = (
+        "Delineate the basins of the stations from a DEM and insert them into "
+        "StationBasin"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "dem",
+            help=(
+                "A hydrologically conditioned (pit-filled) raster file readable by "
+                "GDAL (e.g. GeoTIFF) in EPSG:2100"
+            ),
+        )
+        parser.add_argument(
+            "--cache-dir",
+            help=(
+                "Where to cache the flow directions and accumulation "
+                "(default: <dem>.flow)"
+            ),
+        )
+        parser.add_argument(
+            "--station",
+            type=int,
+            action="append",
+            dest="stations",
+            help="The id of a station to process; can be specified many times",
+        )
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            help="Also process stations that have a basin, and replace it",
+        )
+        parser.add_argument(
+            "--snap-distance",
+            type=float,
+            default=delineation.SNAP_DISTANCE,
+            help=(
+                "The distance (in m) within which the station is moved to the cell "
+                "with the largest flow accumulation (default: %(default)s)"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        try:
+            inserted, skipped = delineation.delineate_station_basins(
+                options["dem"],
+                cache_dir=options["cache_dir"],
+                station_ids=options["stations"],
+                replace=options["replace"],
+                snap_distance=options["snap_distance"],
+            )
+        except (ValueError, GDALException) as e:
+            raise CommandError(str(e))
+        self.stdout.write("{} station basins inserted".format(inserted))
+        if skipped:
+            self.stdout.write(
+                "Stations skipped because they are outside the DEM or any river "
+                "basin: {}".format(", ".join(str(x) for x in skipped))
+            )
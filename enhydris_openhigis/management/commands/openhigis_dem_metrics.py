@@ -0,0 +1,29 @@
+from django.contrib.gis.gdal import GDALException
+from django.core.management.base import BaseCommand, CommandError
+
+from enhydris_openhigis import dem
+
+
+class Command(BaseCommand):
+    help = (
+        "Calculate the mean elevation and mean slope of the river basins, drainage "
+        "basins and station basins from a DEM"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "dem", help="A raster file readable by GDAL (e.g. GeoTIFF) in EPSG:2100"
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            help="The number of processes to use (default: the number of CPUs)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            result = dem.update_dem_metrics(options["dem"], options["processes"])
+        except (ValueError, GDALException) as e:
+            raise CommandError(str(e))
+        for layer_name, updated in result.items():
+            self.stdout.write("{}: {} updated".format(layer_name, updated))
@@ -0,0 +1,51 @@
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+
+from enhydris_openhigis import export
+from enhydris_openhigis.registry import get_registry
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the layers to FlatGeobuf, GeoPackage and GeoParquet files in "
+        "ENHYDRIS_OPENHIGIS_EXPORT_DIR; files that are up to date are not regenerated"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--layer",
+            action="append",
+            dest="layers",
+            help="The layer to export; can be specified many times (default: all)",
+        )
+        parser.add_argument(
+            "--format",
+            choices=export.FORMATS.keys(),
+            action="append",
+            dest="formats",
+            help="The format; can be specified many times (default: all)",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Regenerate the files even if they are up to date",
+        )
+
+    def handle(self, *args, **options):
+        layer_names = options["layers"] or [layer.name for layer in get_registry()]
+        for layer_name in layer_names:
+            for format_name in options["formats"] or export.FORMATS.keys():
+                try:
+                    path, regenerated = export.export_layer(
+                        layer_name, format_name, options["force"]
+                    )
+                except KeyError as e:
+                    raise CommandError("Unknown layer {}".format(e))
+                except ValueError as e:
+                    raise CommandError(str(e))
+                except subprocess.CalledProcessError as e:
+                    raise CommandError(e.stderr.decode(errors="replace"))
+                self.stdout.write(
+                    "{}: {}".format(path, "exported" if regenerated else "up to date")
+                )
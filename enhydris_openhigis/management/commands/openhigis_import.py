@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from enhydris_openhigis import importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Import layers from files readable by GDAL; the attributes must be named like "
+        "the columns of the openhigis views"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", metavar="FILE")
+        parser.add_argument(
+            "--layer",
+            action="append",
+            metavar="SOURCE=TARGET",
+            help=(
+                "Import layer SOURCE of the files into layer TARGET (e.g. "
+                "rivers=Watercourse); may be repeated. By default, the layers of the "
+                "files that are named like the openhigis layers are imported."
+            ),
+        )
+        parser.add_argument(
+            "--mode",
+            choices=importer.MODES,
+            default="append",
+            help=(
+                "append: add the features to the existing ones; replace: replace all "
+                "features of the imported layers (stations referring to them are "
+                "changed to refer to the new features with the same id); diff: "
+                "write only the features that are new, have changed or are missing"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sources = importer.get_sources(
+                options["files"], self.get_layer_map(options["layer"])
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not sources:
+            raise CommandError("No layers to import")
+        try:
+            counts = importer.import_layers(sources, options["mode"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        for layer_name, count in counts.items():
+            if options["mode"] == "diff":
+                self.stdout.write(
+                    "{}: {inserted} inserted, {updated} updated, {deleted} deleted, "
+                    "{unchanged} unchanged".format(layer_name, **count)
+                )
+            else:
+                self.stdout.write("{}: {} features".format(layer_name, count))
+
+    def get_layer_map(self, layer_options):
+        if not layer_options:
+            return None
+        result = {}
+        for layer_option in layer_options:
+            source, sep, target = layer_option.partition("=")
+            if not sep or not source or not target:
+                raise CommandError("Invalid --layer {}".format(layer_option))
+            result[source] = target
+        return result
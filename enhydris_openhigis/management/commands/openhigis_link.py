@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from enhydris_openhigis import linking
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in the basins and surface waters of stations and the river basins of "
+        "surface waters and station basins from their geometries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--link",
+            choices=linking.LINKS.keys(),
+            action="append",
+            dest="links",
+            help="The link to make; can be specified many times (default: all)",
+        )
+        parser.add_argument(
+            "--overwrite",
+            action="store_true",
+            help="Also change foreign keys that are already set",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=linking.SURFACE_WATER_TOLERANCE,
+            help=(
+                "The maximum distance (in m) of a station from its surface water "
+                "(default: %(default)s)"
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be changed without changing anything",
+        )
+
+    def handle(self, *args, **options):
+        result = linking.link(
+            options["links"],
+            overwrite=options["overwrite"],
+            dry_run=options["dry_run"],
+            tolerance=options["tolerance"],
+        )
+        for name, ids in result.items():
+            self.stdout.write("{}: {} changed".format(name, len(ids)))
+            if ids and options["verbosity"] >= 2:
+                self.stdout.write("    {}".format(", ".join(str(x) for x in ids)))
+        if options["dry_run"]:
+            self.stdout.write("Dry run; nothing has been changed")
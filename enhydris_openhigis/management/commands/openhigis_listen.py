@@ -0,0 +1,55 @@
+import select
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from enhydris_openhigis.changes import (
+    CHANNEL,
+    get_layer_by_view_name,
+    layer_has_changed,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Listen for changes made through the openhigis views (e.g. with QGIS) and "
+        "invalidate caches accordingly; runs until interrupted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=60,
+            help="Seconds to wait for a notification before checking the connection",
+        )
+
+    def handle(self, *args, **options):
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute("LISTEN {}".format(CHANNEL))
+        pg_connection = connection.connection
+        while True:
+            if select.select([pg_connection], [], [], options["timeout"])[0]:
+                pg_connection.poll()
+                self.process_notifications(pg_connection)
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+
+    def process_notifications(self, pg_connection):
+        # Several notifications may have been queued by a bulk edit; each layer is
+        # only processed once.
+        view_names = set()
+        while pg_connection.notifies:
+            view_names.add(pg_connection.notifies.pop(0).payload)
+        for view_name in sorted(view_names):
+            try:
+                layer = get_layer_by_view_name(view_name)
+            except KeyError:
+                self.stderr.write(
+                    "Ignoring change of unknown layer {}".format(view_name)
+                )
+                continue
+            layer_has_changed(layer.name)
+            self.stdout.write("{} has changed".format(layer.name))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from enhydris_openhigis import network
+
+
+class Command(BaseCommand):
+    help = (
+        "Calculate the stream order of the watercourses from the network and store "
+        "it in their hydro_order"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scheme", choices=network.STREAM_ORDER_SCHEMES, default="strahler"
+        )
+        parser.add_argument(
+            "--scope",
+            default="national",
+            help="The value to store in hydro_order_scope (default: national)",
+        )
+
+    def handle(self, *args, **options):
+        updated, undetermined = network.update_stream_orders(
+            options["scheme"], options["scope"]
+        )
+        self.stdout.write("{} watercourses updated".format(updated))
+        if undetermined:
+            self.stdout.write(
+                "{} watercourses are in or downstream of a cycle; their order has "
+                "not been determined".format(undetermined)
+            )
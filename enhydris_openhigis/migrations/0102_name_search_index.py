@@ -0,0 +1,38 @@
+from django.contrib.postgres.operations import TrigramExtension, UnaccentExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris_openhigis", "0101_squashed"),
+    ]
+
+    # unaccent() is only STABLE (its result depends on the search_path, through
+    # which the dictionary is found), so it can't be used in an index expression. We
+    # wrap it in an IMMUTABLE function that specifies the dictionary explicitly and
+    # index the result with pg_trgm, which makes LIKE '%term%' searches on names use
+    # the index instead of scanning enhydris_gentity.
+
+    operations = [
+        TrigramExtension(),
+        UnaccentExtension(),
+        migrations.RunSQL(
+            sql="""
+                CREATE OR REPLACE FUNCTION public.openhigis_normalize(text)
+                RETURNS text
+                AS $$
+                    SELECT UPPER(public.unaccent('public.unaccent'::regdictionary, $1))
+                $$
+                LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+                CREATE INDEX enhydris_openhigis_gentity_name_trgm
+                    ON enhydris_gentity
+                    USING gin (public.openhigis_normalize(name) gin_trgm_ops);
+            """,
+            reverse_sql="""
+                DROP INDEX IF EXISTS enhydris_openhigis_gentity_name_trgm;
+                DROP FUNCTION IF EXISTS public.openhigis_normalize(text);
+            """,
+        ),
+    ]
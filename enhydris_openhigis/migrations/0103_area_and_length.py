@@ -0,0 +1,66 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris_openhigis", "0102_name_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="basin",
+            name="area",
+            field=models.FloatField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="riverbasindistrict",
+            name="area",
+            field=models.FloatField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="riverbasindistrict",
+            name="perimeter",
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="stationbasin",
+            name="area",
+            field=models.FloatField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="surfacewater",
+            name="area",
+            field=models.FloatField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="surfacewater",
+            name="length",
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE enhydris_openhigis_basin
+                    SET area = ST_Area(geom2100) / 1000000;
+                UPDATE enhydris_openhigis_riverbasindistrict
+                    SET
+                        area = ST_Area(geom2100) / 1000000,
+                        perimeter = ST_Perimeter(geom2100) / 1000;
+                UPDATE enhydris_openhigis_stationbasin
+                    SET area = ST_Area(geom2100) / 1000000;
+                UPDATE enhydris_openhigis_surfacewater
+                    SET
+                        area = ST_Area(geom2100) / 1000000,
+                        length = ST_Length(geom2100) / 1000;
+            """,
+            reverse_sql="",
+        ),
+    ]
@@ -0,0 +1,121 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris_openhigis", "0103_area_and_length"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="basin",
+            name="geom2100_10m",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="basin",
+            name="geom2100_100m",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="basin",
+            name="geom2100_1km",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="riverbasindistrict",
+            name="geom2100_10m",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="riverbasindistrict",
+            name="geom2100_100m",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="riverbasindistrict",
+            name="geom2100_1km",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="stationbasin",
+            name="geom2100_10m",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="stationbasin",
+            name="geom2100_100m",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="stationbasin",
+            name="geom2100_1km",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="surfacewater",
+            name="geom2100_10m",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="surfacewater",
+            name="geom2100_100m",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.AddField(
+            model_name="surfacewater",
+            name="geom2100_1km",
+            field=django.contrib.gis.db.models.fields.GeometryField(
+                blank=True, editable=False, null=True, spatial_index=False, srid=2100
+            ),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE enhydris_openhigis_basin
+                    SET
+                        geom2100_10m = ST_SimplifyPreserveTopology(geom2100, 10),
+                        geom2100_100m = ST_SimplifyPreserveTopology(geom2100, 100),
+                        geom2100_1km = ST_SimplifyPreserveTopology(geom2100, 1000);
+                UPDATE enhydris_openhigis_riverbasindistrict
+                    SET
+                        geom2100_10m = ST_SimplifyPreserveTopology(geom2100, 10),
+                        geom2100_100m = ST_SimplifyPreserveTopology(geom2100, 100),
+                        geom2100_1km = ST_SimplifyPreserveTopology(geom2100, 1000);
+                UPDATE enhydris_openhigis_stationbasin
+                    SET
+                        geom2100_10m = ST_SimplifyPreserveTopology(geom2100, 10),
+                        geom2100_100m = ST_SimplifyPreserveTopology(geom2100, 100),
+                        geom2100_1km = ST_SimplifyPreserveTopology(geom2100, 1000);
+                UPDATE enhydris_openhigis_surfacewater
+                    SET
+                        geom2100_10m = ST_SimplifyPreserveTopology(geom2100, 10),
+                        geom2100_100m = ST_SimplifyPreserveTopology(geom2100, 100),
+                        geom2100_1km = ST_SimplifyPreserveTopology(geom2100, 1000);
+            """,
+            reverse_sql="",
+        ),
+    ]
@@ -0,0 +1,38 @@
+import django.contrib.gis.db.models.fields
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris_openhigis", "0104_simplified_geometries"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DirtyRegion",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("layer", models.CharField(max_length=50)),
+                (
+                    "envelope",
+                    django.contrib.gis.db.models.fields.PolygonField(
+                        null=True, spatial_index=False, srid=2100
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+    ]
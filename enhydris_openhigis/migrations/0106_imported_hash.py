@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris_openhigis", "0105_dirtyregion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="basin",
+            name="imported_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=32, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="hydronode",
+            name="imported_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=32, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="riverbasindistrict",
+            name="imported_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=32, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="surfacewater",
+            name="imported_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=32, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,302 @@
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("enhydris", "0025_gentity_geom"),
+        ("enhydris_openhigis", "0106_imported_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StationLayer",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("hydro_id", models.TextField(db_column="hydroid")),
+                ("remarks", models.TextField()),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.GeometryField(
+                        spatial_index=False, srid=2100
+                    ),
+                ),
+                ("name", models.TextField()),
+                ("elevation", models.FloatField(null=True)),
+                (
+                    "responsible_party",
+                    models.ForeignKey(
+                        db_column="responsibleparty",
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="enhydris.Lentity",
+                    ),
+                ),
+                ("basin", models.IntegerField(null=True)),
+                (
+                    "surface_water",
+                    models.IntegerField(db_column="surfacewater", null=True),
+                ),
+            ],
+            options={"db_table": 'openhigis"."station', "managed": False},
+        ),
+        migrations.CreateModel(
+            name="RiverBasinDistrictLayer",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("hydro_id", models.TextField(db_column="hydroid")),
+                ("remarks", models.TextField()),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.GeometryField(
+                        spatial_index=False, srid=2100
+                    ),
+                ),
+                ("geographical_name", models.TextField(db_column="geographicalname")),
+                ("length", models.FloatField(db_column="length_km", null=True)),
+                ("area", models.FloatField(db_column="area_sqkm", null=True)),
+            ],
+            options={"db_table": 'openhigis"."riverbasindistrict', "managed": False},
+        ),
+        migrations.CreateModel(
+            name="RiverBasinLayer",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("hydro_id", models.TextField(db_column="hydroid")),
+                ("remarks", models.TextField()),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.GeometryField(
+                        spatial_index=False, srid=2100
+                    ),
+                ),
+                ("geographical_name", models.TextField(db_column="geographicalname")),
+                (
+                    "begin_lifespan_version",
+                    models.DateTimeField(db_column="beginlifespanversion", null=True),
+                ),
+                ("origin", models.TextField()),
+                ("area", models.FloatField(null=True)),
+                ("mean_slope", models.FloatField(db_column="meanslope", null=True)),
+                (
+                    "mean_elevation",
+                    models.FloatField(db_column="meanelevation", null=True),
+                ),
+                (
+                    "max_river_length",
+                    models.FloatField(db_column="maxriverlength", null=True),
+                ),
+            ],
+            options={"db_table": 'openhigis"."riverbasin', "managed": False},
+        ),
+        migrations.CreateModel(
+            name="DrainageBasinLayer",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("hydro_id", models.TextField(db_column="hydroid")),
+                ("remarks", models.TextField()),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.GeometryField(
+                        spatial_index=False, srid=2100
+                    ),
+                ),
+                ("geographical_name", models.TextField(db_column="geographicalname")),
+                (
+                    "begin_lifespan_version",
+                    models.DateTimeField(db_column="beginlifespanversion", null=True),
+                ),
+                ("origin", models.TextField()),
+                ("area", models.FloatField(null=True)),
+                ("mean_slope", models.FloatField(db_column="meanslope", null=True)),
+                (
+                    "mean_elevation",
+                    models.FloatField(db_column="meanelevation", null=True),
+                ),
+                (
+                    "max_river_length",
+                    models.FloatField(db_column="maxriverlength", null=True),
+                ),
+                (
+                    "river_basin",
+                    models.ForeignKey(
+                        db_column="riverbasin",
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="drainage_basins",
+                        to="enhydris_openhigis.RiverBasinLayer",
+                    ),
+                ),
+                ("basin_order", models.TextField(db_column="basinorder")),
+                ("basin_order_scheme", models.TextField(db_column="basinorderscheme")),
+                ("basin_order_scope", models.TextField(db_column="basinorderscope")),
+                ("total_area", models.FloatField(db_column="totalarea", null=True)),
+            ],
+            options={"db_table": 'openhigis"."drainagebasin', "managed": False},
+        ),
+        migrations.CreateModel(
+            name="StationBasinLayer",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("hydro_id", models.TextField(db_column="hydroid")),
+                ("remarks", models.TextField()),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.GeometryField(
+                        spatial_index=False, srid=2100
+                    ),
+                ),
+                ("geographical_name", models.TextField(db_column="geographicalname")),
+                (
+                    "begin_lifespan_version",
+                    models.DateTimeField(db_column="beginlifespanversion", null=True),
+                ),
+                ("origin", models.TextField()),
+                ("area", models.FloatField(null=True)),
+                ("mean_slope", models.FloatField(db_column="meanslope", null=True)),
+                (
+                    "mean_elevation",
+                    models.FloatField(db_column="meanelevation", null=True),
+                ),
+                (
+                    "max_river_length",
+                    models.FloatField(db_column="maxriverlength", null=True),
+                ),
+                (
+                    "river_basin",
+                    models.ForeignKey(
+                        db_column="riverbasin",
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="station_basins",
+                        to="enhydris_openhigis.RiverBasinLayer",
+                    ),
+                ),
+            ],
+            options={"db_table": 'openhigis"."stationbasin', "managed": False},
+        ),
+        migrations.CreateModel(
+            name="HydroNodeLayer",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("hydro_id", models.TextField(db_column="hydroid")),
+                ("remarks", models.TextField()),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.GeometryField(
+                        spatial_index=False, srid=2100
+                    ),
+                ),
+                ("geographical_name", models.TextField(db_column="geographicalname")),
+                ("elevation", models.FloatField(null=True)),
+            ],
+            options={"db_table": 'openhigis"."hydronode', "managed": False},
+        ),
+        migrations.CreateModel(
+            name="WatercourseLayer",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("hydro_id", models.TextField(db_column="hydroid")),
+                ("remarks", models.TextField()),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.GeometryField(
+                        spatial_index=False, srid=2100
+                    ),
+                ),
+                ("geographical_name", models.TextField(db_column="geographicalname")),
+                (
+                    "begin_lifespan_version",
+                    models.DateTimeField(db_column="beginlifespanversion", null=True),
+                ),
+                ("origin", models.TextField()),
+                ("length", models.FloatField(null=True)),
+                ("local_type", models.TextField(db_column="localtype")),
+                (
+                    "drains_basin",
+                    models.ForeignKey(
+                        db_column="drainsbasin",
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="watercourses",
+                        to="enhydris_openhigis.RiverBasinLayer",
+                    ),
+                ),
+                ("stream_order", models.TextField(db_column="streamorder")),
+                (
+                    "stream_order_scheme",
+                    models.TextField(db_column="streamorderscheme"),
+                ),
+                ("stream_order_scope", models.TextField(db_column="streamorderscope")),
+                ("lower_width", models.FloatField(db_column="lowerwidth", null=True)),
+                ("upper_width", models.FloatField(db_column="upperwidth", null=True)),
+                (
+                    "start_node",
+                    models.ForeignKey(
+                        db_column="startnode",
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="watercourses_starting",
+                        to="enhydris_openhigis.HydroNodeLayer",
+                    ),
+                ),
+                (
+                    "end_node",
+                    models.ForeignKey(
+                        db_column="endnode",
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="watercourses_ending",
+                        to="enhydris_openhigis.HydroNodeLayer",
+                    ),
+                ),
+            ],
+            options={"db_table": 'openhigis"."watercourse', "managed": False},
+        ),
+        migrations.CreateModel(
+            name="StandingWaterLayer",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("hydro_id", models.TextField(db_column="hydroid")),
+                ("remarks", models.TextField()),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.GeometryField(
+                        spatial_index=False, srid=2100
+                    ),
+                ),
+                ("geographical_name", models.TextField(db_column="geographicalname")),
+                (
+                    "begin_lifespan_version",
+                    models.DateTimeField(db_column="beginlifespanversion", null=True),
+                ),
+                ("origin", models.TextField()),
+                ("length", models.FloatField(null=True)),
+                ("local_type", models.TextField(db_column="localtype")),
+                (
+                    "drains_basin",
+                    models.ForeignKey(
+                        db_column="drainsbasin",
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="standing_waters",
+                        to="enhydris_openhigis.RiverBasinLayer",
+                    ),
+                ),
+                ("elevation", models.FloatField(null=True)),
+                ("mean_depth", models.FloatField(db_column="meandepth", null=True)),
+                ("area", models.FloatField(null=True)),
+            ],
+            options={"db_table": 'openhigis"."standingwater', "managed": False},
+        ),
+    ]
@@ -2,6 +2,51 @@ CREATE SCHEMA IF NOT EXISTS openhigis;
 
 SET search_path TO openhigis, public;
 
+/* The materialized views (created at the end) depend on the views, which can't be
+ * dropped while the materialized views exist.
+ */
+
+DROP MATERIALIZED VIEW IF EXISTS Station_mv;
+DROP MATERIALIZED VIEW IF EXISTS RiverBasinDistrict_mv;
+DROP MATERIALIZED VIEW IF EXISTS DrainageBasin_mv;
+DROP MATERIALIZED VIEW IF EXISTS RiverBasin_mv;
+DROP MATERIALIZED VIEW IF EXISTS StationBasin_mv;
+DROP MATERIALIZED VIEW IF EXISTS Watercourse_mv;
+DROP MATERIALIZED VIEW IF EXISTS StandingWater_mv;
+DROP MATERIALIZED VIEW IF EXISTS HydroNode_mv;
+
+/* Change notifications (see changes.py). Each view has a statement-level trigger
+ * that executes this after INSERT, UPDATE or DELETE; the payload is the view name.
+ */
+
+CREATE OR REPLACE FUNCTION notify_layer_changed() RETURNS TRIGGER
+AS $$
+BEGIN
+    PERFORM pg_notify('openhigis_layer_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+/* Dirty regions (see tile_cache.py). The INSTEAD OF triggers of the views execute
+ * this with the old and new geometry of each row (either may be NULL), in order to
+ * record the areas where cached tiles of the layer have become stale.
+ */
+
+CREATE OR REPLACE FUNCTION mark_dirty(
+    layer_name TEXT, old_geometry GEOMETRY, new_geometry GEOMETRY
+) RETURNS VOID
+AS $$
+BEGIN
+    INSERT INTO enhydris_openhigis_dirtyregion (layer, envelope, created)
+        SELECT
+            layer_name,
+            ST_MakeEnvelope(ST_XMin(g), ST_YMin(g), ST_XMax(g), ST_YMax(g), 2100),
+            now()
+        FROM (VALUES (old_geometry), (new_geometry)) geometries(g)
+        WHERE g IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
 /* Stations */
 
 DROP VIEW IF EXISTS station;
@@ -40,6 +85,7 @@ BEGIN
     INSERT INTO enhydris_openhigis_station
         (station_ptr_id, geom2100, basin_id, surface_water_id)
         VALUES (NEW.id, NEW.geometry, new_basin_id, new_surface_water_id);
+    PERFORM openhigis.mark_dirty('Station', NULL, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -65,6 +111,8 @@ BEGIN
             basin_id=new_basin_id,
             surface_water_id=new_surface_water_id
         WHERE station_ptr_id=OLD.id;
+    UPDATE enhydris_gentity SET last_modified=now() WHERE id=OLD.id;
+    PERFORM openhigis.mark_dirty('Station', OLD.geometry, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -79,6 +127,7 @@ LANGUAGE plpgsql
 AS $$
 BEGIN
     DELETE FROM enhydris_openhigis_station WHERE station_ptr_id=OLD.id;
+    PERFORM openhigis.mark_dirty('Station', OLD.geometry, NULL);
     RETURN OLD;
 END;
 $$;
@@ -87,18 +136,23 @@ CREATE TRIGGER Station_delete
     INSTEAD OF DELETE ON Station
     FOR EACH ROW EXECUTE PROCEDURE delete_Station();
 
+CREATE TRIGGER Station_notify
+    AFTER INSERT OR UPDATE OR DELETE ON Station
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_layer_changed();
+
 /* Functions common to all tables */
 
 CREATE OR REPLACE FUNCTION insert_into_gentity(NEW ANYELEMENT) RETURNS integer
 AS $$
 DECLARE gentity_id INTEGER;
 BEGIN
-    INSERT INTO enhydris_gentity (name, code, remarks, geom)
+    INSERT INTO enhydris_gentity (name, code, remarks, geom, last_modified)
         VALUES (
             COALESCE(NEW.geographicalName, ''),
             COALESCE(NEW.hydroId, ''),
             COALESCE(NEW.remarks, ''),
-            ST_Transform(NEW.geometry, 4326)
+            ST_Transform(NEW.geometry, 4326),
+            now()
         )
         RETURNING id INTO gentity_id;
     RETURN gentity_id;
@@ -136,7 +190,8 @@ BEGIN
             name=NEW.geographicalName,
             code=COALESCE(NEW.hydroId, ''),
             remarks=COALESCE(NEW.remarks, ''),
-            geom=ST_Transform(NEW.geometry, 4326)
+            geom=ST_Transform(NEW.geometry, 4326),
+            last_modified=now()
         WHERE id=gentity_id;
 END;
 $$ LANGUAGE plpgsql;
@@ -147,9 +202,13 @@ AS $$
 BEGIN
     INSERT INTO enhydris_openhigis_basin
         (garea_ptr_id, geom2100, man_made, mean_slope, mean_elevation, max_river_length,
-        imported_id)
+        imported_id, area, geom2100_10m, geom2100_100m, geom2100_1km)
     VALUES (gentity_id, NEW.geometry, NEW.origin = 'manMade',
-        NEW.meanSlope, NEW.meanElevation, NEW.maxRiverLength, NEW.id);
+        NEW.meanSlope, NEW.meanElevation, NEW.maxRiverLength, NEW.id,
+        ST_Area(NEW.geometry) / 1000000,
+        ST_SimplifyPreserveTopology(NEW.geometry, 10),
+        ST_SimplifyPreserveTopology(NEW.geometry, 100),
+        ST_SimplifyPreserveTopology(NEW.geometry, 1000));
 END;
 $$ LANGUAGE plpgsql;
 
@@ -163,7 +222,12 @@ BEGIN
             man_made=(NEW.origin = 'manMade'),
             mean_slope=NEW.meanSlope,
             mean_elevation=NEW.meanElevation,
-            max_river_length=NEW.maxRiverLength
+            max_river_length=NEW.maxRiverLength,
+            imported_hash=NULL,
+            area=ST_Area(NEW.geometry) / 1000000,
+            geom2100_10m=ST_SimplifyPreserveTopology(NEW.geometry, 10),
+            geom2100_100m=ST_SimplifyPreserveTopology(NEW.geometry, 100),
+            geom2100_1km=ST_SimplifyPreserveTopology(NEW.geometry, 1000)
         WHERE garea_ptr_id=gentity_id;
 END;
 $$ LANGUAGE plpgsql;
@@ -176,10 +240,15 @@ BEGIN
     SELECT garea_ptr_id INTO new_river_basin_id FROM enhydris_openhigis_basin
         WHERE imported_id=NEW.drainsBasin;
     INSERT INTO enhydris_openhigis_surfacewater
-        (gentity_ptr_id, geom2100, local_type, man_made, river_basin_id, imported_id)
+        (gentity_ptr_id, geom2100, local_type, man_made, river_basin_id, imported_id,
+         area, length, geom2100_10m, geom2100_100m, geom2100_1km)
     VALUES
         (gentity_id, NEW.geometry, NEW.localType, NEW.origin = 'manMade',
-         new_river_basin_id, NEW.id);
+         new_river_basin_id, NEW.id, ST_Area(NEW.geometry) / 1000000,
+         ST_Length(NEW.geometry) / 1000,
+         ST_SimplifyPreserveTopology(NEW.geometry, 10),
+         ST_SimplifyPreserveTopology(NEW.geometry, 100),
+         ST_SimplifyPreserveTopology(NEW.geometry, 1000));
 END;
 $$ LANGUAGE plpgsql;
 
@@ -195,7 +264,13 @@ BEGIN
             geom2100=NEW.geometry,
             local_type=NEW.localType,
             man_made=(NEW.origin = 'manMade'),
-            river_basin_id=new_river_basin_id
+            river_basin_id=new_river_basin_id,
+            imported_hash=NULL,
+            area=ST_Area(NEW.geometry) / 1000000,
+            length=ST_Length(NEW.geometry) / 1000,
+            geom2100_10m=ST_SimplifyPreserveTopology(NEW.geometry, 10),
+            geom2100_100m=ST_SimplifyPreserveTopology(NEW.geometry, 100),
+            geom2100_1km=ST_SimplifyPreserveTopology(NEW.geometry, 1000)
         WHERE gentity_ptr_id=gentity_id;
 END;
 $$ LANGUAGE plpgsql;
@@ -211,8 +286,8 @@ CREATE VIEW RiverBasinDistrict
         g.code AS hydroId,
         g.remarks,
         rbd.geom2100 AS geometry,
-        ST_Perimeter(rbd.geom2100) / 1000 AS length_km,
-        ST_Area(rbd.geom2100) / 1000000 AS area_sqkm
+        rbd.perimeter AS length_km,
+        rbd.area AS area_sqkm
     FROM
         enhydris_gentity g
         INNER JOIN enhydris_openhigis_riverbasindistrict rbd
@@ -224,8 +299,14 @@ DECLARE gentity_id INTEGER;
 BEGIN
     gentity_id = openhigis.insert_into_garea(NEW, 2);
     INSERT INTO enhydris_openhigis_riverbasindistrict
-        (garea_ptr_id, geom2100, imported_id)
-        VALUES (gentity_id, NEW.geometry, NEW.id);
+        (garea_ptr_id, geom2100, imported_id, area, perimeter, geom2100_10m,
+            geom2100_100m, geom2100_1km)
+        VALUES (gentity_id, NEW.geometry, NEW.id, ST_Area(NEW.geometry) / 1000000,
+            ST_Perimeter(NEW.geometry) / 1000,
+            ST_SimplifyPreserveTopology(NEW.geometry, 10),
+            ST_SimplifyPreserveTopology(NEW.geometry, 100),
+            ST_SimplifyPreserveTopology(NEW.geometry, 1000));
+    PERFORM openhigis.mark_dirty('RiverBasinDistrict', NULL, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -242,8 +323,16 @@ BEGIN
         WHERE imported_id=OLD.id;
     PERFORM openhigis.update_gentity(gentity_id, OLD, NEW);
     UPDATE enhydris_openhigis_riverbasindistrict
-    SET geom2100=NEW.geometry
+    SET
+        geom2100=NEW.geometry,
+        imported_hash=NULL,
+        area=ST_Area(NEW.geometry) / 1000000,
+        perimeter=ST_Perimeter(NEW.geometry) / 1000,
+        geom2100_10m=ST_SimplifyPreserveTopology(NEW.geometry, 10),
+        geom2100_100m=ST_SimplifyPreserveTopology(NEW.geometry, 100),
+        geom2100_1km=ST_SimplifyPreserveTopology(NEW.geometry, 1000)
     WHERE imported_id=OLD.id;
+    PERFORM openhigis.mark_dirty('RiverBasinDistrict', OLD.geometry, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -263,6 +352,7 @@ BEGIN
     DELETE FROM enhydris_openhigis_riverbasindistrict WHERE garea_ptr_id=gentity_id;
     DELETE FROM enhydris_garea WHERE gentity_ptr_id=gentity_id;
     DELETE FROM enhydris_gentity WHERE id=gentity_id;
+    PERFORM openhigis.mark_dirty('RiverBasinDistrict', OLD.geometry, NULL);
     RETURN OLD;
 END;
 $$;
@@ -271,6 +361,10 @@ CREATE TRIGGER RiverBasinDistrict_delete
     INSTEAD OF DELETE ON RiverBasinDistrict
     FOR EACH ROW EXECUTE PROCEDURE delete_RiverBasinDistrict();
 
+CREATE TRIGGER RiverBasinDistrict_notify
+    AFTER INSERT OR UPDATE OR DELETE ON RiverBasinDistrict
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_layer_changed();
+
 /* Drainage basins */
 
 DROP VIEW IF EXISTS DrainageBasin;
@@ -291,7 +385,7 @@ CREATE VIEW DrainageBasin
         drb.hydro_order AS basinOrder,
         drb.hydro_order_scheme AS basinOrderScheme,
         drb.hydro_order_scope AS basinOrderScope,
-        ST_Area(basin.geom2100) / 1000000 AS area,
+        basin.area,
         drb.total_area AS totalArea,
         basin.mean_slope AS meanSlope,
         basin.mean_elevation AS meanElevation,
@@ -325,6 +419,7 @@ BEGIN
             COALESCE(NEW.basinOrderScheme, ''),
             COALESCE(NEW.basinOrderScope, ''), NEW.totalArea
         );
+    PERFORM openhigis.mark_dirty('DrainageBasin', NULL, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -354,6 +449,7 @@ BEGIN
         hydro_order_scope=COALESCE(NEW.basinOrderScope, ''),
         total_area=NEW.totalArea
         WHERE basin_ptr_id=gentity_id;
+    PERFORM openhigis.mark_dirty('DrainageBasin', OLD.geometry, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -374,6 +470,7 @@ BEGIN
     DELETE FROM enhydris_openhigis_basin WHERE garea_ptr_id=gentity_id;
     DELETE FROM enhydris_garea WHERE gentity_ptr_id=gentity_id;
     DELETE FROM enhydris_gentity WHERE id=gentity_id;
+    PERFORM openhigis.mark_dirty('DrainageBasin', OLD.geometry, NULL);
     RETURN OLD;
 END;
 $$;
@@ -382,6 +479,10 @@ CREATE TRIGGER DrainageBasin_delete
     INSTEAD OF DELETE ON DrainageBasin
     FOR EACH ROW EXECUTE PROCEDURE delete_DrainageBasin();
 
+CREATE TRIGGER DrainageBasin_notify
+    AFTER INSERT OR UPDATE OR DELETE ON DrainageBasin
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_layer_changed();
+
 /* River basins */
 
 DROP VIEW IF EXISTS RiverBasin;
@@ -398,7 +499,7 @@ CREATE VIEW RiverBasin
              WHEN basin.man_made THEN 'manMade'
              ELSE 'natural'
              END AS origin,
-        ST_Area(basin.geom2100) / 1000000 AS area,
+        basin.area,
         basin.mean_slope AS meanSlope,
         basin.mean_elevation AS meanElevation,
         basin.max_river_length AS maxRiverLength
@@ -417,6 +518,7 @@ BEGIN
     PERFORM openhigis.insert_into_basin(NEW, gentity_id);
     INSERT INTO enhydris_openhigis_riverbasin (basin_ptr_id)
         VALUES (gentity_id);
+    PERFORM openhigis.mark_dirty('RiverBasin', NULL, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -433,6 +535,7 @@ BEGIN
         WHERE imported_id=OLD.id;
     PERFORM openhigis.update_gentity(gentity_id, OLD, NEW);
     PERFORM openhigis.update_basin(gentity_id, OLD, NEW);
+    PERFORM openhigis.mark_dirty('RiverBasin', OLD.geometry, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -453,6 +556,7 @@ BEGIN
     DELETE FROM enhydris_openhigis_basin WHERE garea_ptr_id=gentity_id;
     DELETE FROM enhydris_garea WHERE gentity_ptr_id=gentity_id;
     DELETE FROM enhydris_gentity WHERE id=gentity_id;
+    PERFORM openhigis.mark_dirty('RiverBasin', OLD.geometry, NULL);
     RETURN OLD;
 END;
 $$;
@@ -461,6 +565,10 @@ CREATE TRIGGER RiverBasin_delete
     INSTEAD OF DELETE ON RiverBasin
     FOR EACH ROW EXECUTE PROCEDURE delete_RiverBasin();
 
+CREATE TRIGGER RiverBasin_notify
+    AFTER INSERT OR UPDATE OR DELETE ON RiverBasin
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_layer_changed();
+
 /* Station basins */
 
 DROP VIEW IF EXISTS StationBasin;
@@ -478,7 +586,7 @@ CREATE VIEW StationBasin
              WHEN sb.man_made THEN 'manMade'
              ELSE 'natural'
              END AS origin,
-        ST_Area(sb.geom2100) / 1000000 AS area,
+        sb.area,
         sb.mean_slope AS meanSlope,
         sb.mean_elevation AS meanElevation,
         sb.max_river_length AS maxRiverLength
@@ -505,10 +613,15 @@ BEGIN
         WHERE imported_id = NEW.riverBasin;
     INSERT INTO enhydris_openhigis_stationbasin
         (garea_ptr_id, geom2100, man_made, mean_slope, mean_elevation,
-            max_river_length, river_basin_id, station_id)
+            max_river_length, river_basin_id, station_id, area, geom2100_10m,
+            geom2100_100m, geom2100_1km)
         VALUES (gentity_id, NEW.geometry, NEW.origin = 'manMade',
             NEW.meanSlope, NEW.meanElevation, NEW.maxRiverLength,
-            new_river_basin_id, NEW.id);
+            new_river_basin_id, NEW.id, ST_Area(NEW.geometry) / 1000000,
+            ST_SimplifyPreserveTopology(NEW.geometry, 10),
+            ST_SimplifyPreserveTopology(NEW.geometry, 100),
+            ST_SimplifyPreserveTopology(NEW.geometry, 1000));
+    PERFORM openhigis.mark_dirty('StationBasin', NULL, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -536,8 +649,13 @@ BEGIN
         mean_slope=NEW.meanSlope,
         mean_elevation=NEW.meanElevation,
         max_river_length=NEW.maxRiverLength,
-        river_basin_id=new_river_basin_id
+        river_basin_id=new_river_basin_id,
+        area=ST_Area(NEW.geometry) / 1000000,
+        geom2100_10m=ST_SimplifyPreserveTopology(NEW.geometry, 10),
+        geom2100_100m=ST_SimplifyPreserveTopology(NEW.geometry, 100),
+        geom2100_1km=ST_SimplifyPreserveTopology(NEW.geometry, 1000)
         WHERE station_id=OLD.id;
+    PERFORM openhigis.mark_dirty('StationBasin', OLD.geometry, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -557,6 +675,7 @@ BEGIN
     DELETE FROM enhydris_openhigis_stationbasin WHERE garea_ptr_id=gentity_id;
     DELETE FROM enhydris_garea WHERE gentity_ptr_id=gentity_id;
     DELETE FROM enhydris_gentity WHERE id=gentity_id;
+    PERFORM openhigis.mark_dirty('StationBasin', OLD.geometry, NULL);
     RETURN OLD;
 END;
 $$;
@@ -565,6 +684,10 @@ CREATE TRIGGER StationBasin_delete
     INSTEAD OF DELETE ON StationBasin
     FOR EACH ROW EXECUTE PROCEDURE delete_StationBasin();
 
+CREATE TRIGGER StationBasin_notify
+    AFTER INSERT OR UPDATE OR DELETE ON StationBasin
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_layer_changed();
+
 /* Watercourses */
 
 DROP VIEW IF EXISTS Watercourse;
@@ -585,7 +708,7 @@ CREATE VIEW Watercourse
         watercourse.hydro_order AS streamOrder,
         watercourse.hydro_order_scheme AS streamOrderScheme,
         watercourse.hydro_order_scope AS streamOrderScope,
-        ST_LENGTH(surfacewater.geom2100) / 1000 AS length,
+        surfacewater.length,
         surfacewater.local_type AS localType,
         watercourse.min_width AS lowerWidth,
         watercourse.max_width AS upperWidth,
@@ -602,9 +725,9 @@ CREATE VIEW Watercourse
         LEFT JOIN enhydris_openhigis_basin riverbasin_basin
             ON riverbasin_basin.garea_ptr_id = riverbasin.basin_ptr_id
         LEFT JOIN enhydris_openhigis_hydronode start_node
-            ON watercourse.start_node_id = start_node.imported_id
+            ON watercourse.start_node_id = start_node.gpoint_ptr_id
         LEFT JOIN enhydris_openhigis_hydronode end_node
-            ON watercourse.start_node_id = end_node.imported_id;
+            ON watercourse.end_node_id = end_node.gpoint_ptr_id;
 
 
 CREATE OR REPLACE FUNCTION insert_into_Watercourse() RETURNS TRIGGER
@@ -628,6 +751,7 @@ BEGIN
             COALESCE(NEW.streamOrderScheme, ''),
             COALESCE(NEW.streamOrderScope, ''),
             NEW.lowerWidth, NEW.upperWidth, new_start_node_id, new_end_node_id);
+    PERFORM openhigis.mark_dirty('Watercourse', NULL, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -661,6 +785,7 @@ BEGIN
         start_node_id=new_start_node_id,
         end_node_id=new_end_node_id
         WHERE surfacewater_ptr_id=gentity_id;
+    PERFORM openhigis.mark_dirty('Watercourse', OLD.geometry, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -680,6 +805,7 @@ BEGIN
     DELETE FROM enhydris_openhigis_watercourse WHERE surfacewater_ptr_id=gentity_id;
     DELETE FROM enhydris_openhigis_surfacewater WHERE gentity_ptr_id=gentity_id;
     DELETE FROM enhydris_gentity WHERE id=gentity_id;
+    PERFORM openhigis.mark_dirty('Watercourse', OLD.geometry, NULL);
     RETURN OLD;
 END;
 $$;
@@ -688,6 +814,10 @@ CREATE TRIGGER Watercourse_delete
     INSTEAD OF DELETE ON Watercourse
     FOR EACH ROW EXECUTE PROCEDURE delete_Watercourse();
 
+CREATE TRIGGER Watercourse_notify
+    AFTER INSERT OR UPDATE OR DELETE ON Watercourse
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_layer_changed();
+
 /* StandingWater */
 
 DROP VIEW IF EXISTS StandingWater;
@@ -705,11 +835,11 @@ CREATE VIEW StandingWater
              WHEN surfacewater.man_made THEN 'manMade'
              ELSE 'natural'
              END AS origin,
-        ST_LENGTH(surfacewater.geom2100) / 1000 AS length,
+        surfacewater.length,
         surfacewater.local_type AS localType,
         standingwater.elevation AS elevation,
         standingwater.mean_depth AS meanDepth,
-        ST_Area(surfacewater.geom2100) / 1000000 AS area
+        surfacewater.area
     FROM
         enhydris_gentity g
         INNER JOIN enhydris_openhigis_surfacewater surfacewater
@@ -730,6 +860,7 @@ BEGIN
     INSERT INTO enhydris_openhigis_standingwater
         (surfacewater_ptr_id, elevation, mean_depth)
         VALUES (gentity_id, NEW.elevation, NEW.meanDepth);
+    PERFORM openhigis.mark_dirty('StandingWater', NULL, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -751,6 +882,7 @@ BEGIN
         elevation=NEW.elevation,
         mean_depth=NEW.meanDepth
         WHERE surfacewater_ptr_id=gentity_id;
+    PERFORM openhigis.mark_dirty('StandingWater', OLD.geometry, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -770,6 +902,7 @@ BEGIN
     DELETE FROM enhydris_openhigis_standingwater WHERE surfacewater_ptr_id=gentity_id;
     DELETE FROM enhydris_openhigis_surfacewater WHERE gentity_ptr_id=gentity_id;
     DELETE FROM enhydris_gentity WHERE id=gentity_id;
+    PERFORM openhigis.mark_dirty('StandingWater', OLD.geometry, NULL);
     RETURN OLD;
 END;
 $$;
@@ -778,6 +911,10 @@ CREATE TRIGGER StandingWater_delete
     INSTEAD OF DELETE ON StandingWater
     FOR EACH ROW EXECUTE PROCEDURE delete_StandingWater();
 
+CREATE TRIGGER StandingWater_notify
+    AFTER INSERT OR UPDATE OR DELETE ON StandingWater
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_layer_changed();
+
 /* Nodes */
 
 DROP VIEW IF EXISTS HydroNode;
@@ -803,6 +940,7 @@ BEGIN
     INSERT INTO enhydris_openhigis_hydronode
         (gpoint_ptr_id, geom2100, imported_id)
         VALUES (gentity_id, NEW.geometry, NEW.id);
+    PERFORM openhigis.mark_dirty('HydroNode', NULL, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -822,8 +960,9 @@ BEGIN
         SET altitude=NEW.elevation
         WHERE gentity_ptr_id=gentity_id;
     UPDATE enhydris_openhigis_hydronode
-        SET geom2100=NEW.geometry
+        SET geom2100=NEW.geometry, imported_hash=NULL
         WHERE imported_id=OLD.id;
+    PERFORM openhigis.mark_dirty('HydroNode', OLD.geometry, NEW.geometry);
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -843,6 +982,7 @@ BEGIN
     DELETE FROM enhydris_openhigis_hydronode WHERE gpoint_ptr_id=gentity_id;
     DELETE FROM enhydris_gpoint WHERE gentity_ptr_id=gentity_id;
     DELETE FROM enhydris_gentity WHERE id=gentity_id;
+    PERFORM openhigis.mark_dirty('HydroNode', OLD.geometry, NULL);
     RETURN OLD;
 END;
 $$;
@@ -851,6 +991,108 @@ CREATE TRIGGER HydroNode_delete
     INSTEAD OF DELETE ON HydroNode
     FOR EACH ROW EXECUTE PROCEDURE delete_HydroNode();
 
+CREATE TRIGGER HydroNode_notify
+    AFTER INSERT OR UPDATE OR DELETE ON HydroNode
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_layer_changed();
+
+/* Materialized views
+ *
+ * These are read-only copies of the views, used by MapServer, so that rendering
+ * doesn't need to join the underlying tables and calculate areas and lengths. They
+ * are refreshed (concurrently, which requires the unique index) by
+ * tasks.refresh_materialized_views() whenever a layer changes.
+ *
+ * Except for stations and nodes, they also contain the simplified geometries
+ * (geometry_10m etc.), which MapServer uses at small scales. These are not in the
+ * editable views, so that they don't confuse people editing them with QGIS.
+ */
+
+CREATE MATERIALIZED VIEW Station_mv AS SELECT * FROM Station;
+CREATE UNIQUE INDEX Station_mv_id ON Station_mv (id);
+CREATE INDEX Station_mv_geometry ON Station_mv USING gist (geometry);
+
+CREATE MATERIALIZED VIEW RiverBasinDistrict_mv
+    AS SELECT
+        v.*,
+        t.geom2100_10m AS geometry_10m,
+        t.geom2100_100m AS geometry_100m,
+        t.geom2100_1km AS geometry_1km
+    FROM RiverBasinDistrict v INNER JOIN enhydris_openhigis_riverbasindistrict t ON t.imported_id = v.id;
+CREATE UNIQUE INDEX RiverBasinDistrict_mv_id ON RiverBasinDistrict_mv (id);
+CREATE INDEX RiverBasinDistrict_mv_geometry ON RiverBasinDistrict_mv USING gist (geometry);
+CREATE INDEX RiverBasinDistrict_mv_geometry_10m ON RiverBasinDistrict_mv USING gist (geometry_10m);
+CREATE INDEX RiverBasinDistrict_mv_geometry_100m ON RiverBasinDistrict_mv USING gist (geometry_100m);
+CREATE INDEX RiverBasinDistrict_mv_geometry_1km ON RiverBasinDistrict_mv USING gist (geometry_1km);
+
+CREATE MATERIALIZED VIEW DrainageBasin_mv
+    AS SELECT
+        v.*,
+        t.geom2100_10m AS geometry_10m,
+        t.geom2100_100m AS geometry_100m,
+        t.geom2100_1km AS geometry_1km
+    FROM DrainageBasin v INNER JOIN enhydris_openhigis_basin t ON t.imported_id = v.id;
+CREATE UNIQUE INDEX DrainageBasin_mv_id ON DrainageBasin_mv (id);
+CREATE INDEX DrainageBasin_mv_geometry ON DrainageBasin_mv USING gist (geometry);
+CREATE INDEX DrainageBasin_mv_geometry_10m ON DrainageBasin_mv USING gist (geometry_10m);
+CREATE INDEX DrainageBasin_mv_geometry_100m ON DrainageBasin_mv USING gist (geometry_100m);
+CREATE INDEX DrainageBasin_mv_geometry_1km ON DrainageBasin_mv USING gist (geometry_1km);
+
+CREATE MATERIALIZED VIEW RiverBasin_mv
+    AS SELECT
+        v.*,
+        t.geom2100_10m AS geometry_10m,
+        t.geom2100_100m AS geometry_100m,
+        t.geom2100_1km AS geometry_1km
+    FROM RiverBasin v INNER JOIN enhydris_openhigis_basin t ON t.imported_id = v.id;
+CREATE UNIQUE INDEX RiverBasin_mv_id ON RiverBasin_mv (id);
+CREATE INDEX RiverBasin_mv_geometry ON RiverBasin_mv USING gist (geometry);
+CREATE INDEX RiverBasin_mv_geometry_10m ON RiverBasin_mv USING gist (geometry_10m);
+CREATE INDEX RiverBasin_mv_geometry_100m ON RiverBasin_mv USING gist (geometry_100m);
+CREATE INDEX RiverBasin_mv_geometry_1km ON RiverBasin_mv USING gist (geometry_1km);
+
+CREATE MATERIALIZED VIEW StationBasin_mv
+    AS SELECT
+        v.*,
+        t.geom2100_10m AS geometry_10m,
+        t.geom2100_100m AS geometry_100m,
+        t.geom2100_1km AS geometry_1km
+    FROM StationBasin v INNER JOIN enhydris_openhigis_stationbasin t ON t.station_id = v.id;
+CREATE UNIQUE INDEX StationBasin_mv_id ON StationBasin_mv (id);
+CREATE INDEX StationBasin_mv_geometry ON StationBasin_mv USING gist (geometry);
+CREATE INDEX StationBasin_mv_geometry_10m ON StationBasin_mv USING gist (geometry_10m);
+CREATE INDEX StationBasin_mv_geometry_100m ON StationBasin_mv USING gist (geometry_100m);
+CREATE INDEX StationBasin_mv_geometry_1km ON StationBasin_mv USING gist (geometry_1km);
+
+CREATE MATERIALIZED VIEW Watercourse_mv
+    AS SELECT
+        v.*,
+        t.geom2100_10m AS geometry_10m,
+        t.geom2100_100m AS geometry_100m,
+        t.geom2100_1km AS geometry_1km
+    FROM Watercourse v INNER JOIN enhydris_openhigis_surfacewater t ON t.imported_id = v.id;
+CREATE UNIQUE INDEX Watercourse_mv_id ON Watercourse_mv (id);
+CREATE INDEX Watercourse_mv_geometry ON Watercourse_mv USING gist (geometry);
+CREATE INDEX Watercourse_mv_geometry_10m ON Watercourse_mv USING gist (geometry_10m);
+CREATE INDEX Watercourse_mv_geometry_100m ON Watercourse_mv USING gist (geometry_100m);
+CREATE INDEX Watercourse_mv_geometry_1km ON Watercourse_mv USING gist (geometry_1km);
+
+CREATE MATERIALIZED VIEW StandingWater_mv
+    AS SELECT
+        v.*,
+        t.geom2100_10m AS geometry_10m,
+        t.geom2100_100m AS geometry_100m,
+        t.geom2100_1km AS geometry_1km
+    FROM StandingWater v INNER JOIN enhydris_openhigis_surfacewater t ON t.imported_id = v.id;
+CREATE UNIQUE INDEX StandingWater_mv_id ON StandingWater_mv (id);
+CREATE INDEX StandingWater_mv_geometry ON StandingWater_mv USING gist (geometry);
+CREATE INDEX StandingWater_mv_geometry_10m ON StandingWater_mv USING gist (geometry_10m);
+CREATE INDEX StandingWater_mv_geometry_100m ON StandingWater_mv USING gist (geometry_100m);
+CREATE INDEX StandingWater_mv_geometry_1km ON StandingWater_mv USING gist (geometry_1km);
+
+CREATE MATERIALIZED VIEW HydroNode_mv AS SELECT * FROM HydroNode;
+CREATE UNIQUE INDEX HydroNode_mv_id ON HydroNode_mv (id);
+CREATE INDEX HydroNode_mv_geometry ON HydroNode_mv USING gist (geometry);
+
 /* Give permissions */
 
 GRANT USAGE ON SCHEMA openhigis TO mapserver, anton;
@@ -870,5 +1112,7 @@ GRANT SELECT, INSERT, UPDATE, DELETE
     enhydris_openhigis_hydronode,
     enhydris_garea,
     enhydris_gpoint,
-    enhydris_gentity
+    enhydris_gentity,
+    enhydris_openhigis_dirtyregion
     TO anton;
+GRANT USAGE ON SEQUENCE enhydris_openhigis_dirtyregion_id_seq TO anton;
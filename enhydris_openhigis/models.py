@@ -1,4 +1,5 @@
 from django.contrib.gis.db import models
+from django.utils import timezone
 
 from enhydris.models import Garea, Gentity, Gpoint
 from enhydris.models import Station as EnhydrisStation
@@ -14,13 +15,25 @@ class ImportedIdMixin(models.Model):
     keep it.
 
     However, after the import is complete, this id is generally not necessary.
+
+    imported_hash is a hash of the feature as it was imported (see importer.py); it is
+    used to import only the features that have changed in a new version of a
+    dataset. It is cleared whenever the row is modified otherwise (the triggers of the
+    views clear it, too), so that the next import overwrites the modification.
     """
 
     imported_id = models.IntegerField(unique=True)
+    imported_hash = models.CharField(
+        max_length=32, blank=True, null=True, editable=False
+    )
 
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        self.imported_hash = None
+        super().save(*args, **kwargs)
+
 
 class GGRS87Mixin(models.Model):
     """Geometry field in GGRS87.
@@ -41,6 +54,11 @@ class GGRS87Mixin(models.Model):
     however, we must use 2100. Gentity.geom is mandatory, so what we do is transform
     geom2100 to 4326 on the fly on save in order to also store it in Gentity.geom. This
     is done at the SQL view level (defined in create_views.sql).
+
+    Since all models of this app have this mixin, its save() also sets
+    last_modified, which Gentity only sets on creation (the triggers of the views set
+    it on every change). The exports and the basin metrics use it to find out what
+    has changed.
     """
 
     geom2100 = models.GeometryField(srid=2100)
@@ -48,6 +66,10 @@ class GGRS87Mixin(models.Model):
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        self.last_modified = timezone.now()
+        super().save(*args, **kwargs)
+
 
 class HydroOrderCodeMixin(models.Model):
     """INSPIRE data specification on hydrography, 5.5.2.2.1 (p. 57)."""
@@ -60,6 +82,65 @@ class HydroOrderCodeMixin(models.Model):
         abstract = True
 
 
+class AreaMixin(models.Model):
+    """Area of geom2100, in km².
+
+    It could be calculated whenever needed, but this is slow if done for every row of
+    a view whenever it is read (e.g. by MapServer), so we store it. It is maintained
+    by the triggers of the views (see create_views.sql) and, for rows saved through
+    Django, by save().
+    """
+
+    area = models.FloatField(blank=True, null=True, editable=False, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.area = self.geom2100.area / 1000000 if self.geom2100 else None
+        super().save(*args, **kwargs)
+
+
+class SimplifiedGeometryMixin(models.Model):
+    """Simplified versions of geom2100, for rendering at small scales.
+
+    At country zoom, a river basin polygon with thousands of vertices covers a few
+    pixels; rendering it from the full resolution geometry is a waste of time and of
+    bytes transferred from PostGIS to MapServer. So we store versions simplified with
+    tolerances of 10 m, 100 m and 1 km, and the mapfile selects the right one
+    depending on the scale. They are maintained by the triggers of the views (see
+    create_views.sql) and, for rows saved through Django, by save() (GEOS simplify()
+    with preserve_topology is what ST_SimplifyPreserveTopology uses). The
+    materialized views from which MapServer reads have spatial indexes on them, so
+    they don't need one here.
+    """
+
+    geom2100_10m = models.GeometryField(
+        srid=2100, blank=True, null=True, editable=False, spatial_index=False
+    )
+    geom2100_100m = models.GeometryField(
+        srid=2100, blank=True, null=True, editable=False, spatial_index=False
+    )
+    geom2100_1km = models.GeometryField(
+        srid=2100, blank=True, null=True, editable=False, spatial_index=False
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        for field_name, tolerance in (
+            ("geom2100_10m", 10),
+            ("geom2100_100m", 100),
+            ("geom2100_1km", 1000),
+        ):
+            simplified = None
+            if self.geom2100:
+                simplified = self.geom2100.simplify(tolerance, preserve_topology=True)
+            setattr(self, field_name, simplified)
+        super().save(*args, **kwargs)
+
+
 class Station(EnhydrisStation, GGRS87Mixin):
     basin = models.ForeignKey("Basin", on_delete=models.CASCADE, null=True, blank=True)
     surface_water = models.ForeignKey(
@@ -67,8 +148,14 @@ class Station(EnhydrisStation, GGRS87Mixin):
     )
 
 
-class RiverBasinDistrict(Garea, GGRS87Mixin, ImportedIdMixin):
-    pass
+class RiverBasinDistrict(
+    Garea, GGRS87Mixin, ImportedIdMixin, AreaMixin, SimplifiedGeometryMixin
+):
+    perimeter = models.FloatField(blank=True, null=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.perimeter = self.geom2100.length / 1000 if self.geom2100 else None
+        super().save(*args, **kwargs)
 
 
 class BasinMixin(models.Model):
@@ -93,7 +180,14 @@ class BasinMixin(models.Model):
         abstract = True
 
 
-class Basin(Garea, GGRS87Mixin, ImportedIdMixin, BasinMixin):
+class Basin(
+    Garea,
+    GGRS87Mixin,
+    ImportedIdMixin,
+    BasinMixin,
+    AreaMixin,
+    SimplifiedGeometryMixin,
+):
     pass
 
 
@@ -112,22 +206,35 @@ class DrainageBasin(Basin, HydroOrderCodeMixin):
     river_basin = models.ForeignKey(RiverBasin, on_delete=models.CASCADE)
 
 
-class StationBasin(Garea, GGRS87Mixin, BasinMixin):
+class StationBasin(Garea, GGRS87Mixin, BasinMixin, AreaMixin, SimplifiedGeometryMixin):
     """A subbasin defined by a measuring station."""
 
     river_basin = models.ForeignKey(RiverBasin, on_delete=models.CASCADE)
     station = models.OneToOneField(Station, on_delete=models.CASCADE)
 
 
-class SurfaceWater(Gentity, GGRS87Mixin, ImportedIdMixin):
+class SurfaceWater(
+    Gentity, GGRS87Mixin, ImportedIdMixin, AreaMixin, SimplifiedGeometryMixin
+):
     """Base class for rivers (Watercourse) and lakes (StandingWater)."""
 
+    length = models.FloatField(blank=True, null=True, editable=False)
     local_type = models.CharField(max_length=50)
     man_made = models.BooleanField(blank=True, null=True)
     river_basin = models.ForeignKey(
         RiverBasin, on_delete=models.CASCADE, null=True, blank=True
     )
 
+    def save(self, *args, **kwargs):
+        # Like ST_Length(), which is zero for polygons (GEOS gives their perimeter)
+        if not self.geom2100:
+            self.length = None
+        elif self.geom2100.dims == 1:
+            self.length = self.geom2100.length / 1000
+        else:
+            self.length = 0
+        super().save(*args, **kwargs)
+
 
 class HydroNode(Gpoint, GGRS87Mixin, ImportedIdMixin):
     pass
@@ -155,3 +262,16 @@ class Watercourse(SurfaceWater, HydroOrderCodeMixin):
 class StandingWater(SurfaceWater):
     elevation = models.FloatField(blank=True, null=True)
     mean_depth = models.FloatField(blank=True, null=True)
+
+
+class DirtyRegion(models.Model):
+    """An area where the cached tiles of a layer are stale (see tile_cache.py).
+
+    Regions are recorded by the triggers of the views (and, for rows saved through
+    Django, by the model signals), and deleted when the tiles have been purged. A
+    null envelope means the whole layer.
+    """
+
+    layer = models.CharField(max_length=50)
+    envelope = models.PolygonField(srid=2100, null=True, spatial_index=False)
+    created = models.DateTimeField(default=timezone.now)
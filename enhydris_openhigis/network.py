@@ -0,0 +1,371 @@
+"""The hydrographic network, for tracing upstream and downstream.
+
+Watercourses are the edges of a directed graph whose vertices are the hydro nodes
+(from start_node to end_node, i.e. downstream). Tracing it with recursive CTEs is
+far too slow for the national network, so the graph is kept in memory as NumPy
+arrays: the nodes are numbered by their position in the sorted array of their ids,
+and for each node the incoming and outgoing watercourses are stored in compressed
+sparse row (CSR) form. A traversal is a breadth-first search in which each step
+processes the whole frontier with a few vectorized operations. Stream orders and
+longest flow paths are calculated in a similar way, in topological order (see
+Network._sweep()).
+
+get_network() loads the graph once per process and reloads it whenever the version
+token of Watercourse or HydroNode changes (see changes.py), but no more often than
+every get_reload_interval() seconds, so that a bulk edit doesn't cause a reload
+per feature. Loading reads only the ids and the two foreign keys of the
+watercourses, so it is fast enough that it isn't worth patching the arrays instead;
+the edges would have to be inserted into the CSR arrays anyway, which means
+rebuilding them.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+import numpy as np
+
+from .changes import get_layer_versions, mark_features_changed
+
+NETWORK_LAYERS = ("Watercourse", "HydroNode")
+STREAM_ORDER_SCHEMES = ("strahler", "shreve")
+
+_lock = threading.Lock()
+_network = None
+_network_versions = None
+_network_load_time = None
+
+
+class Network:
+    """A directed graph of watercourses and hydro nodes.
+
+    All arguments are sequences of ids; a start or end node id that isn't in
+    node_ids (e.g. -1 for null) means that the watercourse isn't connected at that
+    end. The methods that trace the network return arrays of watercourse ids, sorted,
+    and raise KeyError if the specified node or watercourse does not exist.
+    """
+
+    def __init__(
+        self,
+        watercourse_ids,
+        watercourse_imported_ids,
+        start_node_ids,
+        end_node_ids,
+        node_ids,
+        node_imported_ids,
+    ):
+        watercourse_ids = np.asarray(watercourse_ids, dtype=np.int64)
+        order = np.argsort(watercourse_ids)
+        self.watercourse_ids = watercourse_ids[order]
+        self.watercourse_imported_ids = np.asarray(
+            watercourse_imported_ids, dtype=np.int64
+        )[order]
+        start_node_ids = np.asarray(start_node_ids, dtype=np.int64)[order]
+        end_node_ids = np.asarray(end_node_ids, dtype=np.int64)[order]
+
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        order = np.argsort(node_ids)
+        self.node_ids = node_ids[order]
+        self.node_imported_ids = np.asarray(node_imported_ids, dtype=np.int64)[order]
+        self._node_imported_id_order = np.argsort(self.node_imported_ids)
+
+        # Node numbers of the ends of each watercourse (-1 if not connected)
+        self.start = get_indices(self.node_ids, start_node_ids)
+        self.end = get_indices(self.node_ids, end_node_ids)
+
+        self.incoming = _make_csr(self.end, len(self.node_ids))
+        self.outgoing = _make_csr(self.start, len(self.node_ids))
+
+    def get_node_id(self, imported_id):
+        """Return the id of the node with the specified imported_id."""
+        order = self._node_imported_id_order
+        i = get_indices(self.node_imported_ids[order], [imported_id])[0]
+        if i < 0:
+            raise KeyError(imported_id)
+        return int(self.node_ids[order[i]])
+
+    def get_imported_ids(self, watercourse_ids):
+        """Return the imported_ids of watercourses."""
+        return self.watercourse_imported_ids[
+            get_indices(self.watercourse_ids, watercourse_ids)
+        ]
+
+    def upstream_of_node(self, node_id):
+        """Return the watercourses upstream of a node."""
+        return self._trace([], [self._get_node_index(node_id)], upstream=True)
+
+    def downstream_of_node(self, node_id):
+        """Return the watercourses downstream of a node."""
+        return self._trace([], [self._get_node_index(node_id)], upstream=False)
+
+    def upstream_of_watercourse(self, watercourse_id):
+        """Return a watercourse and the watercourses upstream of it."""
+        i = self._get_watercourse_index(watercourse_id)
+        return self._trace([i], [self.start[i]], upstream=True)
+
+    def downstream_of_watercourse(self, watercourse_id):
+        """Return a watercourse and the watercourses downstream of it."""
+        i = self._get_watercourse_index(watercourse_id)
+        return self._trace([i], [self.end[i]], upstream=False)
+
+    def get_stream_orders(self, scheme="strahler"):
+        """Return the stream orders of the watercourses (as in watercourse_ids).
+
+        scheme is "strahler" or "shreve". Watercourses that start at a node that no
+        watercourse ends at (or that aren't connected at their start) have order 1.
+        Otherwise, with Strahler, the order is the maximum order of the
+        watercourses that end at its start node, plus one if there are more than one
+        with that maximum; with Shreve, it is their sum. Watercourses whose order
+        can't be determined because they are in or downstream of a cycle have order
+        0.
+        """
+        if scheme not in STREAM_ORDER_SCHEMES:
+            raise ValueError("Unknown stream order scheme {}".format(scheme))
+        reduce = _add_reduce if scheme == "shreve" else _strahler_reduce
+        orders = self._sweep(1, reduce, lambda edges, start_values: start_values)
+        return np.nan_to_num(orders).astype(np.int64)
+
+    def get_longest_paths(self, lengths):
+        """Return the length of the longest path that ends with each watercourse.
+
+        lengths are the lengths of the watercourses (as in watercourse_ids). The
+        result is NaN for watercourses in or downstream of a cycle.
+        """
+        lengths = np.asarray(lengths, dtype=float)
+        return self._sweep(
+            0,
+            _max_reduce,
+            lambda edges, start_values: start_values + lengths[edges],
+        )
+
+    def get_connections(self):
+        """Return the pairs of watercourses that flow one into the other.
+
+        The result is (upstream, downstream), two arrays of indices to
+        watercourse_ids; watercourse upstream[i] ends where downstream[i] starts.
+        """
+        indptr, csr_edges = self.outgoing
+        upstream = np.flatnonzero(self.end >= 0)
+        starts, stops = indptr[self.end[upstream]], indptr[self.end[upstream] + 1]
+        downstream = csr_edges[_concatenate_ranges(starts, stops)]
+        return np.repeat(upstream, stops - starts), downstream
+
+    def _sweep(self, source_value, reduce, calculate):
+        """Calculate a value for each watercourse, in topological order.
+
+        The watercourses are processed one generation at a time: when all
+        watercourses that end at a node have been processed, the value at the node
+        is calculated with reduce(values, lengths, positions), which reduces the
+        values of the watercourses that end at each node (values[positions[i]:
+        positions[i] + lengths[i]] are those of node i). The value at nodes where no
+        watercourse ends is source_value. Then calculate(edges, start_values) gives
+        the values of the watercourses that start from the nodes, which are
+        processed in the next generation. Watercourses that are never processed
+        (because they are in or downstream of a cycle) have NaN.
+        """
+        indptr, csr_edges = self.incoming
+        values = np.full(len(self.watercourse_ids), np.nan)
+        node_values = np.full(len(self.node_ids), float(source_value))
+        remaining = np.diff(indptr)
+        complete_nodes = np.flatnonzero(remaining == 0)
+        ready = np.concatenate(
+            [np.flatnonzero(self.start < 0), self._get_outgoing(complete_nodes)]
+        )
+        while len(ready):
+            # Indexing node_values only with the connected starts, since it may be
+            # empty (a network without nodes)
+            starts = self.start[ready]
+            connected = starts >= 0
+            start_values = np.full(len(ready), float(source_value))
+            start_values[connected] = node_values[starts[connected]]
+            values[ready] = calculate(ready, start_values)
+            ends = self.end[ready]
+            ends = ends[ends >= 0]
+            remaining -= np.bincount(ends, minlength=len(self.node_ids))
+            ends = np.unique(ends)
+            complete_nodes = ends[remaining[ends] == 0]
+            if len(complete_nodes):
+                starts = indptr[complete_nodes]
+                stops = indptr[complete_nodes + 1]
+                lengths = stops - starts
+                node_values[complete_nodes] = reduce(
+                    values[csr_edges[_concatenate_ranges(starts, stops)]],
+                    lengths,
+                    np.cumsum(lengths) - lengths,
+                )
+            ready = self._get_outgoing(complete_nodes)
+        return values
+
+    def _get_outgoing(self, nodes):
+        indptr, csr_edges = self.outgoing
+        return csr_edges[_concatenate_ranges(indptr[nodes], indptr[nodes + 1])]
+
+    def _get_node_index(self, node_id):
+        i = get_indices(self.node_ids, [node_id])[0]
+        if i < 0:
+            raise KeyError(node_id)
+        return i
+
+    def _get_watercourse_index(self, watercourse_id):
+        i = get_indices(self.watercourse_ids, [watercourse_id])[0]
+        if i < 0:
+            raise KeyError(watercourse_id)
+        return i
+
+    def _trace(self, edges, nodes, upstream):
+        """Return the watercourses reachable from nodes, plus edges.
+
+        edges and nodes are indices. Upstream, the watercourses that end at a node
+        are followed to their start node; downstream, the reverse.
+        """
+        indptr, csr_edges = self.incoming if upstream else self.outgoing
+        next_nodes = self.start if upstream else self.end
+        visited_edges = np.zeros(len(self.watercourse_ids), dtype=bool)
+        visited_edges[edges] = True
+        visited_nodes = np.zeros(len(self.node_ids), dtype=bool)
+        frontier = np.asarray(nodes, dtype=np.int64)
+        frontier = frontier[frontier >= 0]
+        visited_nodes[frontier] = True
+        while len(frontier):
+            ranges = _concatenate_ranges(indptr[frontier], indptr[frontier + 1])
+            new_edges = csr_edges[ranges]
+            new_edges = new_edges[~visited_edges[new_edges]]
+            visited_edges[new_edges] = True
+            frontier = np.unique(next_nodes[new_edges])
+            frontier = frontier[frontier >= 0]
+            frontier = frontier[~visited_nodes[frontier]]
+            visited_nodes[frontier] = True
+        return self.watercourse_ids[visited_edges]
+
+
+def get_reload_interval():
+    """Return the minimum seconds between two reloads of the network."""
+    return getattr(settings, "ENHYDRIS_OPENHIGIS_NETWORK_RELOAD_INTERVAL", 10)
+
+
+def get_network():
+    """Return the network, loading it if it has changed since it was last loaded.
+
+    If it was last loaded less than get_reload_interval() seconds ago, the old
+    network is returned even if it has changed.
+    """
+    global _network, _network_versions, _network_load_time
+    # The versions are read before loading, so if the network changes while it is
+    # being loaded, it will be loaded again the next time.
+    versions = get_layer_versions(NETWORK_LAYERS)
+    with _lock:
+        now = time.monotonic()
+        if _network is None or (
+            versions != _network_versions
+            and now - _network_load_time >= get_reload_interval()
+        ):
+            _network = load_network()
+            _network_versions = versions
+            _network_load_time = now
+        return _network
+
+
+def load_network():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT
+                s.gentity_ptr_id,
+                s.imported_id,
+                COALESCE(w.start_node_id, -1),
+                COALESCE(w.end_node_id, -1)
+            FROM
+                enhydris_openhigis_watercourse w
+                INNER JOIN enhydris_openhigis_surfacewater s
+                ON s.gentity_ptr_id = w.surfacewater_ptr_id
+            """
+        )
+        watercourses = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 4)
+        cursor.execute(
+            "SELECT gpoint_ptr_id, imported_id FROM enhydris_openhigis_hydronode"
+        )
+        nodes = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    return Network(*watercourses.T, *nodes.T)
+
+
+def update_stream_orders(scheme="strahler", scope="national"):
+    """Calculate the stream orders and store them in the watercourses.
+
+    Only the watercourses whose hydro_order, hydro_order_scheme or
+    hydro_order_scope changes are updated (with a single statement). Returns a
+    tuple (number of watercourses updated, number whose order can't be determined).
+    """
+    network = load_network()
+    orders = network.get_stream_orders(scheme)
+    determined = orders > 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE enhydris_openhigis_watercourse w
+            SET
+                hydro_order = u.hydro_order,
+                hydro_order_scheme = %(scheme)s,
+                hydro_order_scope = %(scope)s
+            FROM unnest(%(ids)s::integer[], %(orders)s::text[])
+                AS u(id, hydro_order)
+            WHERE
+                w.surfacewater_ptr_id = u.id
+                AND (w.hydro_order, w.hydro_order_scheme, w.hydro_order_scope)
+                    IS DISTINCT FROM (u.hydro_order, %(scheme)s, %(scope)s)
+            RETURNING w.surfacewater_ptr_id
+            """,
+            {
+                "scheme": scheme,
+                "scope": scope,
+                "ids": network.watercourse_ids[determined].tolist(),
+                "orders": [str(x) for x in orders[determined]],
+            },
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        mark_features_changed(cursor, "Watercourse", ids)
+    return len(ids), int((~determined).sum())
+
+
+def _add_reduce(values, lengths, positions):
+    return np.add.reduceat(values, positions)
+
+
+def _max_reduce(values, lengths, positions):
+    return np.maximum.reduceat(values, positions)
+
+
+def _strahler_reduce(values, lengths, positions):
+    maxima = np.maximum.reduceat(values, positions)
+    n_at_maximum = np.add.reduceat(values == np.repeat(maxima, lengths), positions)
+    return maxima + (n_at_maximum > 1)
+
+
+def get_indices(sorted_ids, ids):
+    """Return the indices of ids in sorted_ids (-1 for those that aren't there)."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(sorted_ids):
+        return np.full(len(ids), -1, dtype=np.int64)
+    indices = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[indices] == ids, indices, -1)
+
+
+def _make_csr(edge_nodes, n_nodes):
+    """Return the edges grouped by node, in CSR form.
+
+    The result is (indptr, edges), where edges[indptr[i]:indptr[i + 1]] are the
+    indices of the edges whose edge_nodes is i.
+    """
+    edges = np.flatnonzero(edge_nodes >= 0)
+    edges = edges[np.argsort(edge_nodes[edges], kind="stable")]
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edge_nodes[edges], minlength=n_nodes), out=indptr[1:])
+    return indptr, edges
+
+
+def _concatenate_ranges(starts, stops):
+    """Return the concatenation of range(start, stop) for all starts and stops."""
+    lengths = stops - starts
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return offsets + np.arange(lengths.sum())
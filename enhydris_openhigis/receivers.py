@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import linking, models, tasks
+from .changes import layer_changed
+
+
+@receiver(layer_changed)
+def refresh_materialized_views(sender, layer, **kwargs):
+    transaction.on_commit(lambda: tasks.schedule_refresh(layer.name))
+
+
+@receiver(post_save, sender=models.Station)
+def link_new_station(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        linking.link_station(instance)
@@ -0,0 +1,171 @@
+"""The layers of the app, i.e. the leaf models that have a geom2100 field.
+
+Finding the layers requires introspecting all models of the app, which is too slow
+to do on every request. The registry is therefore built once, when the app is ready
+(see apps.py), and it also keeps the table and column names that are needed to
+query each layer with raw SQL.
+"""
+
+from dataclasses import dataclass
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+
+from enhydris.models import Gentity
+
+from .models import SimplifiedGeometryMixin
+
+
+@dataclass(frozen=True)
+class Layer:
+    """A leaf geomodel and the SQL needed to query it.
+
+    In "from_clause", the table that holds geom2100 is aliased "gt" and
+    enhydris_gentity is aliased "g"; all tables of a multi-table inheritance chain
+    share the primary key values, so they are joined on them. "geom" and
+    "imported_id" are the (qualified) columns; "imported_id" is "NULL" for models that
+    don't have one.
+
+    "view" and "materialized_view" are the (qualified) names of the layer's SQL views
+    (see create_views.sql). "simplified" is whether the layer has simplified
+    geometries (see SimplifiedGeometryMixin).
+    """
+
+    name: str
+    model: type
+    table: str
+    pk_column: str
+    geom_table: str
+    geom_pk_column: str
+    geom_column: str
+    from_clause: str
+    geom: str
+    imported_id: str
+    view: str
+    materialized_view: str
+    simplified: bool
+
+
+@dataclass(frozen=True)
+class LayerRegistry:
+    layers: tuple
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, name):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return any(layer.name == name for layer in self.layers)
+
+    @property
+    def models(self):
+        return frozenset(layer.model for layer in self.layers)
+
+    def get_by_model(self, model):
+        for layer in self.layers:
+            if layer.model is model:
+                return layer
+        raise KeyError(model)
+
+
+_registry = None
+
+
+def get_registry():
+    if _registry is None:
+        load()
+    return _registry
+
+
+def load():
+    global _registry
+    _registry = build_registry()
+
+
+def build_registry():
+    layers = (_make_layer(model) for model in compute_geomodels())
+    return LayerRegistry(layers=tuple(sorted(layers, key=lambda x: x.name)))
+
+
+def compute_geomodels():
+    result = {
+        model
+        for model in apps.get_app_config("enhydris_openhigis").get_models()
+        if _model_has_field(model, "geom2100")
+    }
+    result = _get_leaf_classes(result)
+    return result
+
+
+def _model_has_field(model, fieldname):
+    fieldnames = {f.name for f in model._meta.get_fields()}
+    return fieldname in fieldnames
+
+
+def _get_leaf_classes(class_list):
+    """Return a subset of class_list that only contains classes without subclasses.
+
+    Returns a subset of class_list that does not contain classes that are inherited by
+    other classes of class_list.
+    """
+    return {
+        klass for klass in class_list if _class_has_no_subclasses(klass, class_list)
+    }
+
+
+def _class_has_no_subclasses(klass, class_list):
+    return not any({issubclass(k, klass) for k in class_list if k != klass})
+
+
+def _make_layer(model):
+    qn = connection.ops.quote_name
+    geom_field = model._meta.get_field("geom2100")
+    geom_model = geom_field.model
+    leaf_pk = qn(model._meta.pk.column)
+    gentity_join = "INNER JOIN {} g ON g.id = {{}}.{}".format(
+        qn(Gentity._meta.db_table), leaf_pk
+    )
+    if geom_model is model:
+        from_clause = "{} gt {}".format(
+            qn(model._meta.db_table), gentity_join.format("gt")
+        )
+    else:
+        from_clause = "{} leaf INNER JOIN {} gt ON gt.{} = leaf.{} {}".format(
+            qn(model._meta.db_table),
+            qn(geom_model._meta.db_table),
+            qn(geom_model._meta.pk.column),
+            leaf_pk,
+            gentity_join.format("leaf"),
+        )
+    try:
+        imported_id_field = model._meta.get_field("imported_id")
+        imported_id = "{}.{}".format(
+            "gt" if imported_id_field.model is geom_model else "leaf",
+            qn(imported_id_field.column),
+        )
+    except FieldDoesNotExist:
+        imported_id = "NULL"
+    return Layer(
+        name=model.__name__,
+        model=model,
+        table=model._meta.db_table,
+        pk_column=model._meta.pk.column,
+        geom_table=geom_model._meta.db_table,
+        geom_pk_column=geom_model._meta.pk.column,
+        geom_column=geom_field.column,
+        from_clause=from_clause,
+        geom="gt.{}".format(qn(geom_field.column)),
+        imported_id=imported_id,
+        view="openhigis.{}".format(model.__name__),
+        materialized_view="openhigis.{}_mv".format(model.__name__),
+        simplified=issubclass(model, SimplifiedGeometryMixin),
+    )
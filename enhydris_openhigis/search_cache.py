@@ -0,0 +1,67 @@
+"""Cache of the results of SearchView.
+
+Results are keyed on the normalized search term (unaccented and uppercase, like
+openhigis_normalize() does in the database, so that terms that give the same
+results share an entry) and on the version tokens of all layers (see changes.py),
+so any change to any layer makes all cached results stale.
+
+The cache is the one specified by the ENHYDRIS_OPENHIGIS_CACHE setting; its
+TIMEOUT and MAX_ENTRIES options are the time-to-live and the size bound of the
+search cache. Hits and misses are counted in the cache too, so that they are shared
+by all processes; "manage.py openhigis_cache_stats" shows them.
+"""
+
+import hashlib
+import unicodedata
+
+from .changes import get_cache, get_layer_versions
+from .registry import get_registry
+
+HITS_KEY = "openhigis:search:hits"
+MISSES_KEY = "openhigis:search:misses"
+
+
+def normalize_search_term(search_term):
+    decomposed = unicodedata.normalize("NFD", search_term)
+    unaccented = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return unaccented.upper()
+
+
+def get_key(search_term):
+    versions = get_layer_versions(layer.name for layer in get_registry())
+    key_material = "\n".join(
+        [normalize_search_term(search_term)]
+        + ["{}={}".format(name, versions[name]) for name in sorted(versions)]
+    )
+    return "openhigis:search:{}".format(
+        hashlib.md5(key_material.encode("utf-8")).hexdigest()
+    )
+
+
+def get_result(key):
+    result = get_cache().get(key)
+    _increment(HITS_KEY if result is not None else MISSES_KEY)
+    return result
+
+
+def set_result(key, result):
+    get_cache().set(key, result)
+
+
+def get_stats():
+    cache = get_cache()
+    return {"hits": cache.get(HITS_KEY, 0), "misses": cache.get(MISSES_KEY, 0)}
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
+
+
+def _increment(key):
+    cache = get_cache()
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.add(key, 1, None)
@@ -71,13 +71,11 @@ Object.assign(enhydris.map, {
       return;
     }
     const xhr = new XMLHttpRequest();
-    let searchResult = [];
     xhr.onload = function () {
       if (xhr.status < 200 || xhr.status > 299) {
         return;
       }
-      searchResult = xhr.responseText.split(' ').map((x) => parseFloat(x));
-      enhydris.map.zoomTo(searchResult);
+      enhydris.map.zoomTo(JSON.parse(xhr.responseText).bbox);
     };
     xhr.open('GET', enhydris.openhigis.search_url.replace('SEARCH_TERM', searchText));
     xhr.send();
@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Min
+from django.utils import timezone
+
+from celery import shared_task
+
+from . import export, tile_cache
+from .changes import get_cache
+from .models import DirtyRegion
+
+# The views of some layers show attributes of other layers (e.g. Watercourse has the
+# imported_id of its river basin and of its nodes), so when a layer changes, the
+# materialized views of the layers that reference it must also be refreshed.
+REFERENCED_LAYERS = {
+    "DrainageBasin": ("RiverBasin",),
+    "HydroNode": (),
+    "RiverBasin": (),
+    "RiverBasinDistrict": (),
+    "StandingWater": ("RiverBasin",),
+    "Station": ("RiverBasin", "DrainageBasin", "Watercourse", "StandingWater"),
+    "StationBasin": ("RiverBasin", "Station"),
+    "Watercourse": ("RiverBasin", "HydroNode"),
+}
+
+
+def get_layers_affected_by(layer_name):
+    return [layer_name] + sorted(
+        name
+        for name, referenced in REFERENCED_LAYERS.items()
+        if layer_name in referenced
+    )
+
+
+def get_refresh_delay():
+    """Return the seconds that a refresh waits for more changes to the layer."""
+    return getattr(settings, "ENHYDRIS_OPENHIGIS_REFRESH_DELAY", 60)
+
+
+def _get_pending_key(layer_name):
+    return "openhigis:refresh_pending:{}".format(layer_name)
+
+
+def schedule_refresh(layer_name):
+    """Queue refresh_materialized_views(layer_name), unless it's already queued.
+
+    The task runs after get_refresh_delay() seconds, so that a bulk edit, which
+    changes the layer many times in a few seconds, causes a single refresh. The
+    pending mark expires anyway after ten times the delay (but no less than ten
+    minutes), so that a lost task (e.g. after a restart of the broker) doesn't stop
+    refreshes forever.
+    """
+    delay = get_refresh_delay()
+    if get_cache().add(_get_pending_key(layer_name), True, max(10 * delay, 600)):
+        refresh_materialized_views.apply_async((layer_name,), countdown=delay)
+
+
+@shared_task
+def refresh_materialized_views(layer_name):
+    # Changes made from now on need another refresh, so they must queue one.
+    get_cache().delete(_get_pending_key(layer_name))
+    layer_names = get_layers_affected_by(layer_name)
+    last_region_id = tile_cache.get_last_dirty_region_id(layer_name)
+    with connection.cursor() as cursor:
+        for name in layer_names:
+            cursor.execute(
+                "REFRESH MATERIALIZED VIEW CONCURRENTLY openhigis.{}_mv".format(name)
+            )
+    tile_cache.purge_dirty_tiles(layer_name, layer_names, last_region_id)
+
+
+def get_stale_layers(max_age):
+    """Return a dict with the layers whose materialized views are stale.
+
+    The dirty regions of a layer are deleted when its materialized views are
+    refreshed, so a region older than max_age seconds (plus the refresh delay)
+    means that the refresh hasn't run, typically because no Celery worker is
+    running. The dict maps each such layer name to the time of its oldest region.
+    """
+    threshold = timezone.now() - timedelta(seconds=max_age + get_refresh_delay())
+    regions = DirtyRegion.objects.filter(created__lt=threshold)
+    oldest = regions.values("layer").annotate(oldest=Min("created"))
+    return {row["layer"]: row["oldest"] for row in oldest}
+
+
+def _get_export_pending_key(layer_name, format_name):
+    return "openhigis:export_pending:{}:{}".format(layer_name, format_name)
+
+
+def schedule_export(layer_name, format_name):
+    """Queue export_layer(layer_name, format_name), unless it's already queued."""
+    key = _get_export_pending_key(layer_name, format_name)
+    if get_cache().add(key, True, 3600):
+        export_layer.delay(layer_name, format_name)
+
+
+@shared_task
+def export_layer(layer_name, format_name):
+    try:
+        export.export_layer(layer_name, format_name)
+    finally:
+        get_cache().delete(_get_export_pending_key(layer_name, format_name))
@@ -0,0 +1,180 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.gis.geos import LineString, Polygon
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+import numpy as np
+from model_mommy import mommy
+
+from enhydris_openhigis import models
+from enhydris_openhigis.basin_metrics import (
+    LAST_RUN_KEY,
+    calculate_river_basin,
+    get_changed_river_basins,
+    update_basin_metrics,
+)
+from enhydris_openhigis.changes import get_cache
+
+
+class CalculateRiverBasinTestCase(SimpleTestCase):
+    # Watercourses 10 (in drainage basin 100) and 11 (in 101) join at node 3 and flow
+    # through 12 (in 102) to node 4.
+    def setUp(self):
+        watercourses = np.array(
+            [
+                [10, 1, 3, 2, 100],
+                [11, 2, 3, 5, 101],
+                [12, 3, 4, 1, 102],
+            ],
+            dtype=float,
+        )
+        drainage_basins = np.array([[100, 10], [101, 20], [102, 30]], dtype=float)
+        self.result = calculate_river_basin(1, watercourses, drainage_basins)
+
+    def test_river_basin_max_river_length(self):
+        self.assertEqual(self.result[0], 6)
+
+    def test_drainage_basin_max_river_lengths(self):
+        self.assertEqual(self.result[1].tolist(), [2, 5, 1])
+
+    def test_total_areas(self):
+        self.assertEqual(self.result[2].tolist(), [10, 20, 60])
+
+    def test_empty_river_basin(self):
+        result = calculate_river_basin(1, np.zeros((0, 5)), np.zeros((0, 2)))
+        self.assertTrue(np.isnan(result[0]))
+
+    def test_watercourses_without_nodes(self):
+        watercourses = np.array([[10, -1, -1, 2, 100], [11, -1, -1, 5, 100]])
+        drainage_basins = np.array([[100, 10]], dtype=float)
+        result = calculate_river_basin(1, watercourses, drainage_basins)
+        self.assertEqual(result[0], 5)
+        self.assertEqual(result[1].tolist(), [5])
+        self.assertEqual(result[2].tolist(), [10])
+
+
+class BasinDataMixin:
+    # Drainage basin 1861 (1 km²) is upstream of 1862 (2 km²); watercourse 1951 (3 km,
+    # in 1861) flows into 1952 (4 km, in 1862).
+    def setUp(self):
+        super().setUp()
+        self.river_basin = mommy.make(
+            models.RiverBasin,
+            imported_id=1851,
+            geom2100=Polygon.from_bbox((500000, 4000000, 503000, 4001000)),
+        )
+        self.drainage_basin1 = self._make_drainage_basin(1861, 500000, 1)
+        self.drainage_basin2 = self._make_drainage_basin(1862, 501000, 2)
+        nodes = [mommy.make(models.HydroNode, imported_id=i) for i in (1, 2, 3)]
+        self._make_watercourse(1951, 500100, nodes[0], nodes[1], 3)
+        self.watercourse2 = self._make_watercourse(1952, 501100, nodes[1], nodes[2], 4)
+
+    def _make_drainage_basin(self, imported_id, xmin, area):
+        # The basin is 1 km high, so its width in km is its area in km²
+        return mommy.make(
+            models.DrainageBasin,
+            imported_id=imported_id,
+            river_basin=self.river_basin,
+            geom2100=Polygon.from_bbox((xmin, 4000000, xmin + area * 1000, 4001000)),
+        )
+
+    def _make_watercourse(self, imported_id, x, start_node, end_node, length):
+        # The watercourse goes north, so that it is length km long
+        return mommy.make(
+            models.Watercourse,
+            imported_id=imported_id,
+            river_basin=self.river_basin,
+            start_node=start_node,
+            end_node=end_node,
+            geom2100=LineString((x, 4000500), (x, 4000500 + length * 1000), srid=2100),
+        )
+
+
+class BasinMetricsCommandTestCase(BasinDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        models.DirtyRegion.objects.all().delete()
+        self.out = StringIO()
+        call_command("openhigis_basin_metrics", processes=1, stdout=self.out)
+        for basin in (self.river_basin, self.drainage_basin1, self.drainage_basin2):
+            basin.refresh_from_db()
+
+    def test_output(self):
+        self.assertIn("RiverBasin: 1 updated", self.out.getvalue())
+
+    def test_river_basin_max_river_length(self):
+        self.assertAlmostEqual(self.river_basin.max_river_length, 7)
+
+    def test_drainage_basin_max_river_length(self):
+        self.assertAlmostEqual(self.drainage_basin2.max_river_length, 4)
+
+    def test_upstream_total_area(self):
+        self.assertAlmostEqual(self.drainage_basin1.total_area, 1)
+
+    def test_downstream_total_area(self):
+        self.assertAlmostEqual(self.drainage_basin2.total_area, 3)
+
+    def test_unchanged_basins_are_not_updated(self):
+        out = StringIO()
+        call_command("openhigis_basin_metrics", processes=1, stdout=out)
+        self.assertIn("DrainageBasin: 0 updated", out.getvalue())
+
+    def test_dirty_region(self):
+        self.assertTrue(
+            models.DirtyRegion.objects.filter(layer="DrainageBasin").exists()
+        )
+
+    def test_nothing_changed_since_last_run(self):
+        self.assertEqual(get_changed_river_basins(), [])
+
+    def test_changed_watercourse(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE enhydris_gentity
+                SET last_modified = now() + interval '1 hour'
+                WHERE id = %s
+                """,
+                [self.watercourse2.id],
+            )
+        self.assertEqual(get_changed_river_basins(), [1851])
+
+    def test_no_record_of_last_run(self):
+        get_cache().delete(LAST_RUN_KEY)
+        self.assertIsNone(get_changed_river_basins())
+
+    def test_changed_option(self):
+        out = StringIO()
+        call_command("openhigis_basin_metrics", processes=1, changed=True, stdout=out)
+        self.assertIn("RiverBasin: 0 updated", out.getvalue())
+
+    def test_unknown_river_basin(self):
+        with self.assertRaises(CommandError):
+            call_command("openhigis_basin_metrics", river_basins=[1852])
+
+
+class ChangedSinceLastRunTestCase(BasinDataMixin, TransactionTestCase):
+    # In a TestCase, now() is the same throughout the test
+    serialized_rollback = True
+
+    def setUp(self):
+        # Committing queues a refresh, but there is no Celery broker
+        patcher = mock.patch("enhydris_openhigis.tasks.schedule_refresh")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+        get_cache().delete(LAST_RUN_KEY)
+
+    def test_changes_made_by_the_run_are_not_changes(self):
+        result = update_basin_metrics(processes=1)
+        self.assertEqual(result["RiverBasin"], 1)
+        self.assertEqual(get_changed_river_basins(), [])
+
+    def test_changes_made_after_the_run(self):
+        update_basin_metrics(processes=1)
+        self.watercourse2.save()
+        self.assertEqual(get_changed_river_basins(), [1851])
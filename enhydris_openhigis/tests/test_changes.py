@@ -0,0 +1,74 @@
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+
+from model_mommy import mommy
+
+from enhydris_openhigis import models
+from enhydris_openhigis.changes import (
+    get_layer_by_view_name,
+    get_layer_versions,
+    layer_changed,
+    layer_has_changed,
+)
+
+
+class LayerHasChangedTestCase(TestCase):
+    def setUp(self):
+        self.receiver = mock.MagicMock()
+        layer_changed.connect(self.receiver)
+        self.addCleanup(layer_changed.disconnect, self.receiver)
+        self.version = get_layer_versions(["RiverBasin"])["RiverBasin"]
+        layer_has_changed("RiverBasin")
+
+    def test_version_changed(self):
+        self.assertNotEqual(
+            get_layer_versions(["RiverBasin"])["RiverBasin"], self.version
+        )
+
+    def test_signal_sent(self):
+        self.assertEqual(self.receiver.call_count, 1)
+
+    def test_signal_sender(self):
+        self.assertIs(self.receiver.call_args[1]["sender"], models.RiverBasin)
+
+
+class VersionStableTestCase(TestCase):
+    def test_version_stable_when_nothing_changes(self):
+        self.assertEqual(
+            get_layer_versions(["Watercourse"]), get_layer_versions(["Watercourse"])
+        )
+
+
+class ModelSignalsTestCase(TransactionTestCase):
+    # The version changes on commit, which TestCase never does
+    serialized_rollback = True
+
+    def setUp(self):
+        # Committing queues a refresh, but there is no Celery broker
+        patcher = mock.patch("enhydris_openhigis.tasks.schedule_refresh")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def test_saving_a_model_changes_its_layer_version(self):
+        version = get_layer_versions(["HydroNode"])["HydroNode"]
+        mommy.make(models.HydroNode, imported_id=42)
+        self.assertNotEqual(get_layer_versions(["HydroNode"])["HydroNode"], version)
+
+    def test_version_changes_only_after_commit(self):
+        version = get_layer_versions(["HydroNode"])["HydroNode"]
+        with transaction.atomic():
+            mommy.make(models.HydroNode, imported_id=42)
+            self.assertEqual(get_layer_versions(["HydroNode"])["HydroNode"], version)
+        self.assertNotEqual(get_layer_versions(["HydroNode"])["HydroNode"], version)
+
+
+class GetLayerByViewNameTestCase(TestCase):
+    def test_case_insensitive(self):
+        self.assertEqual(get_layer_by_view_name("stationbasin").name, "StationBasin")
+
+    def test_unknown(self):
+        with self.assertRaises(KeyError):
+            get_layer_by_view_name("basin")
@@ -0,0 +1,38 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from enhydris_openhigis import models
+
+
+class CheckIndexesTestCase(TestCase):
+    def setUp(self):
+        self.out = StringIO()
+        call_command("openhigis_check_indexes", stdout=self.out)
+
+    def test_index_found(self):
+        self.assertIn(
+            "enhydris_openhigis_gentity_name_trgm index: ok", self.out.getvalue()
+        )
+
+    def test_nothing_missing(self):
+        self.assertNotIn("MISSING", self.out.getvalue())
+
+
+class CheckRefreshTestCase(TestCase):
+    def test_ok(self):
+        out = StringIO()
+        call_command("openhigis_check_refresh", stdout=out)
+        self.assertIn("Watercourse: ok", out.getvalue())
+
+    def test_stale(self):
+        models.DirtyRegion.objects.create(
+            layer="Watercourse", created=timezone.now() - timedelta(hours=1)
+        )
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("openhigis_check_refresh", stdout=out)
+        self.assertIn("Watercourse: STALE", out.getvalue())
@@ -0,0 +1,60 @@
+from django.contrib.gis.geos import Point
+from django.test import SimpleTestCase
+
+from enhydris_openhigis.coordinates import (
+    get_coord_transform,
+    transform_coordinates,
+    transform_extent,
+)
+
+
+class TransformCoordinatesTestCase(SimpleTestCase):
+    coordinates = [(500000, 4000000), (300000, 4100000), (600000, 3800000)]
+
+    def test_same_as_geos(self):
+        result = transform_coordinates(self.coordinates, 2100, 4326)
+        for (x, y), (lon, lat) in zip(self.coordinates, result):
+            point = Point(x, y, srid=2100)
+            point.transform(4326)
+            self.assertAlmostEqual(lon, point.x)
+            self.assertAlmostEqual(lat, point.y)
+
+    def test_known_value(self):
+        ((lon, lat),) = transform_coordinates([(500000, 4000000)], 2100, 4326)
+        self.assertAlmostEqual(lon, 24.0016625)
+        self.assertAlmostEqual(lat, 36.1473217)
+
+    def test_round_trip(self):
+        wgs84 = transform_coordinates(self.coordinates, 2100, 4326)
+        result = transform_coordinates(wgs84, 4326, 2100)
+        for expected, actual in zip(self.coordinates, result):
+            self.assertAlmostEqual(actual[0], expected[0], places=3)
+            self.assertAlmostEqual(actual[1], expected[1], places=3)
+
+    def test_shape(self):
+        self.assertEqual(
+            transform_coordinates(self.coordinates, 2100, 4326).shape, (3, 2)
+        )
+
+    def test_empty(self):
+        self.assertEqual(transform_coordinates([], 2100, 4326).shape, (0, 2))
+
+    def test_same_srid(self):
+        result = transform_coordinates(self.coordinates, 2100, 2100)
+        self.assertEqual(result.tolist(), [list(c) for c in self.coordinates])
+
+
+class TransformExtentTestCase(SimpleTestCase):
+    def test_transform_extent(self):
+        x1, y1, x2, y2 = transform_extent(
+            [400000, 3900000, 500000, 4000000], 2100, 4326
+        )
+        self.assertAlmostEqual(x1, 22.9025706)
+        self.assertAlmostEqual(y1, 35.2407093)
+        self.assertAlmostEqual(x2, 24.0016625)
+        self.assertAlmostEqual(y2, 36.1473217)
+
+
+class GetCoordTransformTestCase(SimpleTestCase):
+    def test_reused(self):
+        self.assertIs(get_coord_transform(2100, 4326), get_coord_transform(2100, 4326))
@@ -1,3 +1,4 @@
+from django.contrib.gis.geos import LineString, Polygon
 from django.db import connection
 from django.test import TestCase
 
@@ -953,3 +954,178 @@ class StationSridTestCase(SridMixin, StationSetupInitialRowMixin, TestCase):
     model = models.Station
     view_name = "Station"
     condition = "remarks = 'Hello world'"
+
+
+class AreaTestCase(TestCase):
+    def setUp(self):
+        self._execute(
+            """
+            INSERT INTO openhigis.RiverBasin (geographicalName, geometry, id)
+            VALUES (
+                'Attica',
+                'SRID=2100;POLYGON((500000 4000000, 501000 4000000, 501000 4001000,
+                    500000 4001000, 500000 4000000))',
+                1851
+            )
+            """
+        )
+
+    def _execute(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            if cursor.description:
+                return cursor.fetchone()
+
+    def test_area_is_stored(self):
+        self.assertAlmostEqual(models.RiverBasin.objects.first().area, 1)
+
+    def test_area_in_view(self):
+        (area,) = self._execute("SELECT area FROM openhigis.RiverBasin")
+        self.assertAlmostEqual(area, 1)
+
+    def test_area_is_recalculated_on_update(self):
+        self._execute(
+            """
+            UPDATE openhigis.RiverBasin
+            SET geometry='SRID=2100;POLYGON((500000 4000000, 502000 4000000,
+                502000 4002000, 500000 4002000, 500000 4000000))'
+            WHERE id=1851
+            """
+        )
+        self.assertAlmostEqual(models.RiverBasin.objects.first().area, 4)
+
+
+class LengthTestCase(TestCase):
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO openhigis.Watercourse
+                (geographicalName, geometry, id, localType)
+                VALUES
+                ('Kifisos', 'SRID=2100;LINESTRING(500000 4000000, 503000 4004000)',
+                1852, 'river')
+                """
+            )
+            cursor.execute("SELECT length FROM openhigis.Watercourse")
+            (self.view_length,) = cursor.fetchone()
+
+    def test_length_is_stored(self):
+        self.assertAlmostEqual(models.Watercourse.objects.first().length, 5)
+
+    def test_length_in_view(self):
+        self.assertAlmostEqual(self.view_length, 5)
+
+
+class AreaAndLengthOnSaveTestCase(TestCase):
+    # Rows created or modified through Django rather than the views
+    def test_area(self):
+        river_basin = mommy.make(
+            models.RiverBasin,
+            geom2100=Polygon.from_bbox((500000, 4000000, 501000, 4001000)),
+        )
+        river_basin.refresh_from_db()
+        self.assertAlmostEqual(river_basin.area, 1)
+
+    def test_area_is_recalculated(self):
+        river_basin = mommy.make(
+            models.RiverBasin,
+            geom2100=Polygon.from_bbox((500000, 4000000, 501000, 4001000)),
+        )
+        river_basin.geom2100 = Polygon.from_bbox((500000, 4000000, 502000, 4002000))
+        river_basin.save()
+        river_basin.refresh_from_db()
+        self.assertAlmostEqual(river_basin.area, 4)
+
+    def test_perimeter(self):
+        district = mommy.make(
+            models.RiverBasinDistrict,
+            geom2100=Polygon.from_bbox((500000, 4000000, 501000, 4001000)),
+        )
+        district.refresh_from_db()
+        self.assertAlmostEqual(district.perimeter, 4)
+
+    def test_length(self):
+        watercourse = mommy.make(
+            models.Watercourse,
+            geom2100=LineString((500000, 4000000), (503000, 4004000), srid=2100),
+        )
+        watercourse.refresh_from_db()
+        self.assertAlmostEqual(watercourse.length, 5)
+        self.assertAlmostEqual(watercourse.area, 0)
+
+    def test_length_of_standing_water(self):
+        standing_water = mommy.make(
+            models.StandingWater,
+            geom2100=Polygon.from_bbox((500000, 4000000, 501000, 4001000)),
+        )
+        standing_water.refresh_from_db()
+        self.assertAlmostEqual(standing_water.length, 0)
+        self.assertAlmostEqual(standing_water.area, 1)
+
+    def test_simplified_geometries(self):
+        # The bottom side has a vertex 1 m off the straight line
+        river_basin = mommy.make(
+            models.RiverBasin,
+            geom2100=Polygon(
+                (
+                    (500000, 4000000),
+                    (500500, 4000001),
+                    (501000, 4000000),
+                    (501000, 4001000),
+                    (500000, 4001000),
+                    (500000, 4000000),
+                ),
+                srid=2100,
+            ),
+        )
+        river_basin.refresh_from_db()
+        self.assertEqual(river_basin.geom2100_10m.num_points, 5)
+        self.assertEqual(river_basin.geom2100_100m.num_points, 5)
+
+    def test_simplified_geometries_are_recalculated(self):
+        river_basin = mommy.make(
+            models.RiverBasin,
+            geom2100=Polygon.from_bbox((500000, 4000000, 501000, 4001000)),
+        )
+        river_basin.geom2100 = Polygon.from_bbox((500000, 4000000, 502000, 4002000))
+        river_basin.save()
+        river_basin.refresh_from_db()
+        self.assertEqual(
+            river_basin.geom2100_100m.extent, (500000, 4000000, 502000, 4002000)
+        )
+
+
+class SimplifiedGeometryTestCase(TestCase):
+    # The square's bottom side has a vertex 1 m off the straight line, which is
+    # removed by the simplification.
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO openhigis.RiverBasin (geographicalName, geometry, id)
+                VALUES (
+                    'Attica',
+                    'SRID=2100;POLYGON((500000 4000000, 500500 4000001,
+                        501000 4000000, 501000 4001000, 500000 4001000,
+                        500000 4000000))',
+                    1851
+                )
+                """
+            )
+        self.river_basin = models.RiverBasin.objects.first()
+
+    def test_full_geometry(self):
+        self.assertEqual(self.river_basin.geom2100.num_points, 6)
+
+    def test_simplified_geometries(self):
+        self.assertEqual(self.river_basin.geom2100_10m.num_points, 5)
+        self.assertEqual(self.river_basin.geom2100_100m.num_points, 5)
+
+    def test_materialized_view(self):
+        with connection.cursor() as cursor:
+            cursor.execute("REFRESH MATERIALIZED VIEW openhigis.RiverBasin_mv")
+            cursor.execute(
+                "SELECT ST_NPoints(geometry_10m) FROM openhigis.RiverBasin_mv"
+            )
+            self.assertEqual(cursor.fetchone()[0], 5)
@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.gis.gdal import GDALRaster
+from django.contrib.gis.geos import Point, Polygon
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+import numpy as np
+from model_mommy import mommy
+
+from enhydris_openhigis import delineation, models
+
+
+class DemMixin:
+    # The DEM has 12×11 cells of 10 m. It is a valley along column 5 that slopes
+    # down towards row 0, so everything flows to column 5 and then to cell (0, 5).
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.dem_path = os.path.join(self.tempdir, "dem.tif")
+        elevations = np.abs(np.arange(11) - 5)[None, :] * 10.0 + np.arange(12)[:, None]
+        GDALRaster(
+            {
+                "driver": "GTiff",
+                "name": self.dem_path,
+                "srid": 2100,
+                "width": 11,
+                "height": 12,
+                "origin": (500000, 4000120),
+                "scale": (10, -10),
+                "bands": [{"data": elevations, "nodata_value": -9999}],
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        super().tearDown()
+
+
+class FlowGridTestCase(DemMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.grid = delineation.FlowGrid(self.dem_path, self.tempdir)
+
+    def test_outlet_accumulation(self):
+        self.assertEqual(self.grid.accumulation[0, 5], 132)
+
+    def test_source_accumulation(self):
+        self.assertEqual(self.grid.accumulation[11, 0], 1)
+
+    @mock.patch("enhydris_openhigis.delineation.TILE_SIZE", 3)
+    def test_accumulation_with_tiles(self):
+        os.remove(os.path.join(self.tempdir, "metadata.json"))
+        grid = delineation.FlowGrid(self.dem_path, self.tempdir)
+        self.assertEqual(grid.accumulation[0, 5], 132)
+
+    def test_get_cell(self):
+        self.assertEqual(self.grid.get_cell(500055, 4000085), (3, 5))
+
+    def test_get_cell_outside(self):
+        self.assertIsNone(self.grid.get_cell(499995, 4000085))
+
+    def test_snap(self):
+        self.assertEqual(self.grid.snap(3, 7, 20), (1, 5))
+
+    def _get_upstream_area(self, row, col):
+        rectangles = np.concatenate(list(self.grid.get_upstream_rectangles(row, col)))
+        widths = rectangles[:, 2] - rectangles[:, 0]
+        heights = rectangles[:, 3] - rectangles[:, 1]
+        return (widths * heights).sum()
+
+    def test_upstream_area(self):
+        self.assertEqual(self._get_upstream_area(3, 5), 99 * 100)
+
+    def test_upstream_area_of_source(self):
+        self.assertEqual(self._get_upstream_area(11, 0), 100)
+
+    def test_rectangles(self):
+        rectangles = next(self.grid.get_upstream_rectangles(3, 5))
+        self.assertEqual(rectangles[0].tolist(), [500000, 4000080, 500110, 4000090])
+
+    @mock.patch("enhydris_openhigis.delineation.TILE_SIZE", 3)
+    def test_upstream_area_with_tiles(self):
+        self.assertEqual(self._get_upstream_area(3, 5), 99 * 100)
+
+    @mock.patch("enhydris_openhigis.delineation.RECTANGLE_BATCH_SIZE", 2)
+    def test_rectangle_batches(self):
+        batches = list(self.grid.get_upstream_rectangles(3, 5))
+        self.assertEqual(len(batches), 5)
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
+
+
+class DelineateCommandTestCase(DemMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        mommy.make(
+            models.RiverBasin,
+            imported_id=1851,
+            geom2100=Polygon.from_bbox((500000, 4000000, 500110, 4000120)),
+        )
+        self.station = mommy.make(
+            models.Station,
+            geom2100=Point(x=500065, y=4000085, srid=2100),
+            geom=Point(24.00166, 36.14732, srid=4326),
+        )
+        self.out = StringIO()
+        call_command(
+            "openhigis_delineate", self.dem_path, snap_distance=10, stdout=self.out
+        )
+
+    def test_output(self):
+        self.assertIn("1 station basins inserted", self.out.getvalue())
+
+    def test_area(self):
+        station_basin = models.StationBasin.objects.get(station=self.station)
+        # Snapped to cell (2, 5), which has 10 rows of 11 cells upstream
+        self.assertAlmostEqual(station_basin.area, 0.011)
+
+    def test_existing_basins_are_not_replaced(self):
+        out = StringIO()
+        call_command("openhigis_delineate", self.dem_path, stdout=out)
+        self.assertIn("0 station basins inserted", out.getvalue())
+
+    def test_replace(self):
+        out = StringIO()
+        call_command(
+            "openhigis_delineate",
+            self.dem_path,
+            replace=True,
+            snap_distance=10,
+            stdout=out,
+        )
+        self.assertIn("1 station basins inserted", out.getvalue())
+        self.assertEqual(models.StationBasin.objects.count(), 1)
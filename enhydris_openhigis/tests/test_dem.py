@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.gis.gdal import GDALRaster
+from django.contrib.gis.geos import Polygon
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+
+import numpy as np
+from model_mommy import mommy
+
+from enhydris_openhigis import models
+from enhydris_openhigis.dem import get_slope, rasterize
+
+
+class RasterizeTestCase(SimpleTestCase):
+    def setUp(self):
+        self.square = np.array([[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]], float)
+
+    def test_square(self):
+        mask = rasterize([self.square], (-2, 12), (1, -1), (14, 14))
+        self.assertEqual(mask.sum(), 100)
+        self.assertTrue(mask[2:12, 2:12].all())
+
+    def test_hole(self):
+        hole = np.array([[4, 4], [4, 6], [6, 6], [6, 4], [4, 4]], float)
+        mask = rasterize([self.square, hole], (0, 10), (1, -1), (10, 10))
+        self.assertEqual(mask.sum(), 96)
+        self.assertFalse(mask[4:6, 4:6].any())
+
+    def test_part_of_polygon(self):
+        mask = rasterize([self.square], (5, 5), (1, -1), (10, 10))
+        self.assertEqual(mask.sum(), 25)
+
+
+class GetSlopeTestCase(SimpleTestCase):
+    def test_slope(self):
+        window = np.tile(np.arange(5.0) * 20, (5, 1))
+        np.testing.assert_allclose(get_slope(window, (100, -100)), np.full((3, 3), 20))
+
+    def test_nodata(self):
+        window = np.zeros((3, 3))
+        window[0, 0] = np.nan
+        self.assertTrue(np.isnan(get_slope(window, (100, -100))[0, 0]))
+
+
+class DemMetricsCommandTestCase(TestCase):
+    # The DEM has 20×10 pixels of 100 m; the elevation is 10 m × the column, so the
+    # slope is everywhere 10%. The river basin covers columns 5-9 and rows 2-6.
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dem_path = os.path.join(self.tempdir, "dem.tif")
+        self._make_dem(2100)
+        self.river_basin = mommy.make(
+            models.RiverBasin,
+            geom2100=Polygon.from_bbox((500500, 4000300, 501000, 4000800)),
+        )
+        models.DirtyRegion.objects.all().delete()
+        self.out = StringIO()
+        call_command(
+            "openhigis_dem_metrics", self.dem_path, processes=1, stdout=self.out
+        )
+        self.river_basin.refresh_from_db()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _make_dem(self, srid):
+        GDALRaster(
+            {
+                "driver": "GTiff",
+                "name": self.dem_path,
+                "srid": srid,
+                "width": 20,
+                "height": 10,
+                "origin": (500000, 4001000),
+                "scale": (100, -100),
+                "bands": [
+                    {
+                        "data": np.tile(np.arange(20.0) * 10, (10, 1)),
+                        "nodata_value": -9999,
+                    }
+                ],
+            }
+        )
+
+    def test_output(self):
+        self.assertIn("RiverBasin: 1 updated", self.out.getvalue())
+
+    def test_mean_elevation(self):
+        self.assertAlmostEqual(self.river_basin.mean_elevation, 70)
+
+    def test_mean_slope(self):
+        self.assertAlmostEqual(self.river_basin.mean_slope, 10)
+
+    def test_unchanged_basins_are_not_updated(self):
+        out = StringIO()
+        call_command("openhigis_dem_metrics", self.dem_path, processes=1, stdout=out)
+        self.assertIn("RiverBasin: 0 updated", out.getvalue())
+
+    def test_dirty_region(self):
+        self.assertTrue(models.DirtyRegion.objects.filter(layer="RiverBasin").exists())
+
+    def test_wrong_srid(self):
+        self._make_dem(4326)
+        with self.assertRaises(CommandError):
+            call_command("openhigis_dem_metrics", self.dem_path)
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from model_mommy import mommy
+
+from enhydris_openhigis import export, models
+from enhydris_openhigis.changes import get_cache
+
+
+def fake_ogr2ogr(layer, format, path):
+    with open(path, "w") as f:
+        f.write("{} in {}".format(layer.name, format.driver))
+
+
+@mock.patch("enhydris_openhigis.export._run_ogr2ogr", side_effect=fake_ogr2ogr)
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.export_dir = tempfile.mkdtemp()
+        override = override_settings(ENHYDRIS_OPENHIGIS_EXPORT_DIR=self.export_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        get_cache().clear()
+        self.station = self._make_station()
+
+    def tearDown(self):
+        shutil.rmtree(self.export_dir)
+
+    def _make_station(self):
+        return mommy.make(
+            models.Station,
+            geom2100=Point(x=500000, y=4000000, srid=2100),
+            geom=Point(24.00166, 36.14732, srid=4326),
+        )
+
+    def test_export(self, m):
+        path, regenerated = export.export_layer("Station", "fgb")
+        self.assertTrue(regenerated)
+        with open(path) as f:
+            self.assertEqual(f.read(), "Station in FlatGeobuf")
+
+    def test_up_to_date_file_is_not_regenerated(self, m):
+        export.export_layer("Station", "fgb")
+        _, regenerated = export.export_layer("Station", "fgb")
+        self.assertFalse(regenerated)
+        self.assertEqual(m.call_count, 1)
+
+    def test_file_is_regenerated_after_insert(self, m):
+        export.export_layer("Station", "fgb")
+        self._make_station()
+        _, regenerated = export.export_layer("Station", "fgb")
+        self.assertTrue(regenerated)
+
+    def test_force(self, m):
+        export.export_layer("Station", "fgb")
+        _, regenerated = export.export_layer("Station", "fgb", force=True)
+        self.assertTrue(regenerated)
+
+    def test_no_temporary_files_are_left(self, m):
+        export.export_layer("Station", "gpkg")
+        self.assertEqual(
+            sorted(os.listdir(self.export_dir)),
+            ["Station.gpkg", "Station.gpkg.lock", "Station.gpkg.stamp"],
+        )
+
+    def test_stamp(self, m):
+        path, _ = export.export_layer("Station", "fgb")
+        with open(path + ".stamp") as f:
+            self.assertEqual(f.read(), export.get_stamp("Station"))
+
+    def test_status_missing(self, m):
+        _, status = export.get_status("Station", "fgb")
+        self.assertEqual(status, export.MISSING)
+
+    def test_status_up_to_date(self, m):
+        export.export_layer("Station", "fgb")
+        _, status = export.get_status("Station", "fgb")
+        self.assertEqual(status, export.UP_TO_DATE)
+
+    def test_status_stale(self, m):
+        export.export_layer("Station", "fgb")
+        self._make_station()
+        _, status = export.get_status("Station", "fgb")
+        self.assertEqual(status, export.STALE)
+
+    def test_status_stale_after_edit(self, m):
+        export.export_layer("Station", "fgb")
+        self.station.geom2100 = Point(x=501000, y=4000000, srid=2100)
+        self.station.save()
+        _, status = export.get_status("Station", "fgb")
+        self.assertEqual(status, export.STALE)
+
+    def test_command(self, m):
+        out = StringIO()
+        call_command("openhigis_export", layers=["Station"], stdout=out)
+        self.assertEqual(m.call_count, len(export.FORMATS))
+        self.assertIn("Station.parquet: exported", out.getvalue())
+
+    def _get(self, format_name):
+        return self.client.get(
+            reverse(
+                "openhigis_export",
+                kwargs={"layer": "Station", "format": format_name},
+            )
+        )
+
+    @mock.patch("enhydris_openhigis.tasks.schedule_export")
+    def test_view(self, schedule_export, m):
+        export.export_layer("Station", "gpkg")
+        response = self._get("gpkg")
+        self.assertEqual(b"".join(response.streaming_content), b"Station in GPKG")
+        schedule_export.assert_not_called()
+
+    @mock.patch("enhydris_openhigis.tasks.schedule_export")
+    def test_view_does_not_export(self, schedule_export, m):
+        self._get("gpkg")
+        m.assert_not_called()
+
+    @mock.patch("enhydris_openhigis.tasks.schedule_export")
+    def test_view_with_missing_file(self, schedule_export, m):
+        self.assertEqual(self._get("gpkg").status_code, 404)
+        schedule_export.assert_called_once_with("Station", "gpkg")
+
+    @mock.patch("enhydris_openhigis.tasks.schedule_export")
+    def test_view_with_stale_file(self, schedule_export, m):
+        export.export_layer("Station", "gpkg")
+        self._make_station()
+        response = self._get("gpkg")
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        schedule_export.assert_called_once_with("Station", "gpkg")
+
+    def test_view_with_unknown_format(self, m):
+        self.assertEqual(self._get("shp").status_code, 404)
+
+    @mock.patch("enhydris_openhigis.tasks.export_layer.delay")
+    def test_export_is_queued_once(self, delay, m):
+        self._get("gpkg")
+        self._get("gpkg")
+        delay.assert_called_once_with("Station", "gpkg")
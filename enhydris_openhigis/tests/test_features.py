@@ -0,0 +1,99 @@
+import json
+
+from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from model_mommy import mommy
+
+from enhydris_openhigis import models
+
+
+class FeaturesViewTestCase(TestCase):
+    def setUp(self):
+        self.ids = []
+        for name, x, y in (
+            ("Hello", 500000, 4000000),
+            ("World", 550000, 4050000),
+            ("Again", 560000, 4060000),
+        ):
+            station = mommy.make(
+                models.Station,
+                name=name,
+                geom2100=Point(x=x, y=y, srid=2100),
+                geom=Point(24.00166, 36.14732, srid=4326),
+            )
+            self.ids.append(station.id)
+        with connection.cursor() as cursor:
+            cursor.execute("REFRESH MATERIALIZED VIEW openhigis.Station_mv")
+
+    def _get(self, layer="Station", **params):
+        return self.client.get(
+            reverse("openhigis_features", kwargs={"layer": layer}), params
+        )
+
+    def _get_json(self, **params):
+        response = self._get(**params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_feature_collection(self):
+        result = self._get_json()
+        self.assertEqual(result["type"], "FeatureCollection")
+        self.assertEqual([f["id"] for f in result["features"]], sorted(self.ids))
+        self.assertIsNone(result["next"])
+
+    def test_coordinates_are_wgs84_by_default(self):
+        result = self._get_json(limit=1)
+        coordinates = result["features"][0]["geometry"]["coordinates"]
+        self.assertAlmostEqual(coordinates[0], 24.00166, places=4)
+        self.assertAlmostEqual(coordinates[1], 36.14732, places=4)
+
+    def test_srid(self):
+        result = self._get_json(srid=2100, limit=1)
+        coordinates = result["features"][0]["geometry"]["coordinates"]
+        self.assertAlmostEqual(coordinates[0], 500000, places=2)
+        self.assertAlmostEqual(coordinates[1], 4000000, places=2)
+
+    def test_bbox_in_srid(self):
+        result = self._get_json(srid=2100, bbox="540000,4040000,555000,4055000")
+        self.assertEqual(
+            [f["properties"]["name"] for f in result["features"]], ["World"]
+        )
+
+    def test_fields(self):
+        result = self._get_json(fields="name")
+        feature = result["features"][0]
+        self.assertEqual(list(feature["properties"].keys()), ["name"])
+        self.assertIsNone(feature["geometry"])
+
+    def test_fields_with_geometry(self):
+        result = self._get_json(fields="name,geometry")
+        self.assertEqual(result["features"][0]["geometry"]["type"], "Point")
+
+    def test_pagination(self):
+        ids = sorted(self.ids)
+        result = self._get_json(limit=2)
+        self.assertEqual([f["id"] for f in result["features"]], ids[:2])
+        self.assertEqual(result["next"], ids[1])
+        result = self._get_json(limit=2, after=result["next"])
+        self.assertEqual([f["id"] for f in result["features"]], ids[2:])
+        self.assertIsNone(result["next"])
+
+    @override_settings(ENHYDRIS_OPENHIGIS_FEATURES_MAX_RESULTS=1)
+    def test_limit_is_capped(self):
+        result = self._get_json(limit=100)
+        self.assertEqual(len(result["features"]), 1)
+
+    def test_unknown_layer(self):
+        self.assertEqual(self._get("Basin").status_code, 404)
+
+    def test_unknown_field(self):
+        self.assertEqual(self._get(fields="colour").status_code, 400)
+
+    def test_unknown_srid(self):
+        self.assertEqual(self._get(srid=123456).status_code, 400)
+
+    def test_negative_simplify(self):
+        self.assertEqual(self._get(simplify=-1).status_code, 400)
@@ -0,0 +1,70 @@
+import json
+
+from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from model_mommy import mommy
+
+from enhydris_openhigis import models
+
+
+class GeoJSONViewTestCase(TestCase):
+    def setUp(self):
+        for name, x, y in (("Hello", 500000, 4000000), ("World", 550000, 4050000)):
+            mommy.make(
+                models.Station,
+                name=name,
+                geom2100=Point(x=x, y=y, srid=2100),
+                geom=Point(24.00166, 36.14732, srid=4326),
+            )
+        with connection.cursor() as cursor:
+            cursor.execute("REFRESH MATERIALIZED VIEW openhigis.Station_mv")
+
+    def _get(self, layer, **params):
+        return self.client.get(
+            reverse("openhigis_geojson", kwargs={"layer": layer}), params
+        )
+
+    def _get_names(self, **params):
+        response = self._get("Station", **params)
+        result = json.loads(b"".join(response.streaming_content))
+        return sorted(f["properties"]["name"] for f in result["features"])
+
+    def test_content_type(self):
+        response = self._get("Station")
+        self.assertEqual(response["Content-Type"], "application/geo+json")
+
+    def test_feature_collection(self):
+        response = self._get("Station")
+        result = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(result["type"], "FeatureCollection")
+        self.assertEqual(len(result["features"]), 2)
+
+    def test_coordinates_are_wgs84(self):
+        response = self._get("Station", name="Hello")
+        result = json.loads(b"".join(response.streaming_content))
+        coordinates = result["features"][0]["geometry"]["coordinates"]
+        self.assertAlmostEqual(coordinates[0], 24.00166, places=4)
+        self.assertAlmostEqual(coordinates[1], 36.14732, places=4)
+
+    def test_bbox(self):
+        self.assertEqual(self._get_names(bbox="23.9,36.1,24.1,36.2"), ["Hello"])
+
+    def test_attribute_filter(self):
+        self.assertEqual(self._get_names(name="World"), ["World"])
+
+    def test_empty_layer(self):
+        response = self._get("Watercourse")
+        result = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(result["features"], [])
+
+    def test_unknown_layer(self):
+        self.assertEqual(self._get("Basin").status_code, 404)
+
+    def test_unknown_attribute(self):
+        self.assertEqual(self._get("Station", colour="red").status_code, 400)
+
+    def test_invalid_bbox(self):
+        self.assertEqual(self._get("Station", bbox="1,2,3").status_code, 400)
@@ -0,0 +1,428 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+
+from model_mommy import mommy
+
+from enhydris_openhigis import models
+
+
+class ImportTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        super().tearDown()
+
+    def _write_layer(self, filename, features):
+        path = os.path.join(self.tempdir, filename)
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "type": "FeatureCollection",
+                    "crs": {
+                        "type": "name",
+                        "properties": {"name": "urn:ogc:def:crs:EPSG::2100"},
+                    },
+                    "features": [
+                        {"type": "Feature", "properties": p, "geometry": g}
+                        for p, g in features
+                    ],
+                },
+                f,
+            )
+        return path
+
+    def _square(self, x, y, size):
+        return {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [x, y],
+                    [x + size, y],
+                    [x + size, y + size],
+                    [x, y + size],
+                    [x, y],
+                ]
+            ],
+        }
+
+    def _write_river_basins(self):
+        return self._write_layer(
+            "RiverBasin.geojson",
+            [
+                (
+                    {"id": 1851, "geographicalName": "Attica", "origin": "natural"},
+                    self._square(500000, 4000000, 1000),
+                )
+            ],
+        )
+
+    def _write_new_river_basins(self, *ids):
+        return self._write_layer(
+            "RiverBasin.geojson",
+            [
+                (
+                    {"id": id, "geographicalName": "Attiki"},
+                    self._square(500000, y, 1000),
+                )
+                for id, y in zip(ids, range(4000000, 4100000, 1000))
+            ],
+        )
+
+    def _write_nodes(self):
+        return self._write_layer(
+            "HydroNode.geojson",
+            [
+                (
+                    {"id": 1901, "geographicalName": "Source"},
+                    {"type": "Point", "coordinates": [500100, 4000100]},
+                ),
+                (
+                    {"id": 1902, "geographicalName": "Mouth"},
+                    {"type": "Point", "coordinates": [500400, 4000500]},
+                ),
+            ],
+        )
+
+    def _write_watercourses(self):
+        return self._write_layer(
+            "Watercourse.geojson",
+            [
+                (
+                    {
+                        "id": 1952,
+                        "geographicalName": "Kifisos",
+                        "localType": "river",
+                        "drainsBasin": 1851,
+                        "startNode": 1901,
+                        "endNode": 1902,
+                        "remarks": "Tab\there",
+                    },
+                    {
+                        "type": "LineString",
+                        "coordinates": [[500100, 4000100], [500400, 4000500]],
+                    },
+                )
+            ],
+        )
+
+
+class ImportTestCase(ImportTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.out = StringIO()
+        # Given in reverse order, to check that they are imported in the right order
+        call_command(
+            "openhigis_import",
+            self._write_watercourses(),
+            self._write_nodes(),
+            self._write_river_basins(),
+            stdout=self.out,
+        )
+        self.watercourse = models.Watercourse.objects.get(imported_id=1952)
+
+    def test_output(self):
+        self.assertIn("Watercourse: 1 features", self.out.getvalue())
+        self.assertIn("HydroNode: 2 features", self.out.getvalue())
+
+    def test_name(self):
+        self.assertEqual(self.watercourse.name, "Kifisos")
+
+    def test_text_with_tab(self):
+        self.assertEqual(self.watercourse.remarks, "Tab\there")
+
+    def test_river_basin(self):
+        self.assertEqual(self.watercourse.river_basin.imported_id, 1851)
+
+    def test_nodes(self):
+        self.assertEqual(self.watercourse.start_node.imported_id, 1901)
+        self.assertEqual(self.watercourse.end_node.imported_id, 1902)
+
+    def test_length(self):
+        self.assertAlmostEqual(self.watercourse.length, 0.5)
+
+    def test_area(self):
+        self.assertAlmostEqual(models.RiverBasin.objects.get().area, 1)
+
+    def test_geom(self):
+        self.assertAlmostEqual(self.watercourse.geom.extent[0], 24.0028, places=3)
+
+    def test_simplified_geometry(self):
+        self.assertIsNotNone(models.RiverBasin.objects.get().geom2100_1km)
+
+    def test_origin(self):
+        self.assertFalse(models.RiverBasin.objects.get().man_made)
+
+    def test_dirty_region(self):
+        self.assertTrue(models.DirtyRegion.objects.filter(layer="HydroNode").exists())
+
+
+class ImportLayerMapTestCase(ImportTestMixin, TestCase):
+    def test_layer_map(self):
+        path = self._write_layer(
+            "basins.geojson",
+            [({"id": 1851}, self._square(500000, 4000000, 1000))],
+        )
+        call_command(
+            "openhigis_import", path, layer=["basins=RiverBasin"], stdout=StringIO()
+        )
+        self.assertEqual(models.RiverBasin.objects.get().imported_id, 1851)
+
+    def test_unknown_target(self):
+        path = self._write_river_basins()
+        with self.assertRaises(CommandError):
+            call_command("openhigis_import", path, layer=["RiverBasin=Basin"])
+
+    def test_missing_source(self):
+        path = self._write_river_basins()
+        with self.assertRaises(CommandError):
+            call_command("openhigis_import", path, layer=["basins=RiverBasin"])
+
+
+class ReplaceTestCase(ImportTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        call_command(
+            "openhigis_import",
+            self._write_river_basins(),
+            self._write_nodes(),
+            self._write_watercourses(),
+            stdout=StringIO(),
+        )
+        self.old_river_basin = models.RiverBasin.objects.get()
+        self.station = mommy.make(
+            models.Station,
+            basin=self.old_river_basin,
+            surface_water=models.Watercourse.objects.get(),
+            geom2100=Point(x=500500, y=4000500, srid=2100),
+            geom=Point(24.0072, 36.1518, srid=4326),
+        )
+
+    def _replace(self, *paths):
+        call_command("openhigis_import", *paths, mode="replace", stdout=StringIO())
+
+    def _write_drainage_basins(self, river_basin):
+        return self._write_layer(
+            "DrainageBasin.geojson",
+            [
+                (
+                    {"id": 1871, "riverBasin": river_basin},
+                    self._square(500000, 4000000, 500),
+                )
+            ],
+        )
+
+    def test_replaces_features(self):
+        self._replace(self._write_new_river_basins(1851, 1852))
+        self.assertEqual(models.RiverBasin.objects.count(), 2)
+        self.assertFalse(
+            models.Basin.objects.filter(pk=self.old_river_basin.pk).exists()
+        )
+
+    def test_remaps_station_reference(self):
+        self._replace(self._write_new_river_basins(1851, 1852))
+        self.station.refresh_from_db()
+        self.assertEqual(self.station.basin.imported_id, 1851)
+        self.assertEqual(self.station.basin.name, "Attiki")
+
+    def test_remaps_reference_from_other_layer(self):
+        self._replace(self._write_new_river_basins(1851))
+        watercourse = models.Watercourse.objects.get()
+        self.assertEqual(watercourse.river_basin.imported_id, 1851)
+
+    def test_sets_reference_to_missing_feature_to_null(self):
+        path = self._write_layer(
+            "Watercourse.geojson",
+            [
+                (
+                    {"id": 1953, "localType": "river"},
+                    {
+                        "type": "LineString",
+                        "coordinates": [[500100, 4000100], [500400, 4000500]],
+                    },
+                )
+            ],
+        )
+        self._replace(path)
+        self.station.refresh_from_db()
+        self.assertIsNone(self.station.surface_water)
+
+    def test_missing_feature_with_required_reference(self):
+        call_command(
+            "openhigis_import", self._write_drainage_basins(1851), stdout=StringIO()
+        )
+        with self.assertRaises(CommandError):
+            self._replace(self._write_new_river_basins(1852))
+        self.assertTrue(models.RiverBasin.objects.filter(imported_id=1851).exists())
+
+    def test_staging_tables_are_dropped_after_failure(self):
+        call_command(
+            "openhigis_import", self._write_drainage_basins(1851), stdout=StringIO()
+        )
+        with self.assertRaises(CommandError):
+            self._replace(self._write_new_river_basins(1852))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('openhigis_import_riverbasin')")
+            self.assertIsNone(cursor.fetchone()[0])
+
+    def test_import_after_failure(self):
+        call_command(
+            "openhigis_import", self._write_drainage_basins(1851), stdout=StringIO()
+        )
+        with self.assertRaises(CommandError):
+            self._replace(self._write_new_river_basins(1852))
+        self._replace(self._write_new_river_basins(1851, 1852))
+        self.assertEqual(models.RiverBasin.objects.count(), 2)
+
+    def test_replaces_referring_layer_at_the_same_time(self):
+        call_command(
+            "openhigis_import", self._write_drainage_basins(1851), stdout=StringIO()
+        )
+        self._replace(
+            self._write_new_river_basins(1852), self._write_drainage_basins(1852)
+        )
+        drainage_basin = models.DrainageBasin.objects.get()
+        self.assertEqual(drainage_basin.river_basin.imported_id, 1852)
+
+    def test_keeps_calculated_attributes(self):
+        models.RiverBasin.objects.update(mean_slope=0.1, max_river_length=2.5)
+        self._replace(self._write_new_river_basins(1851))
+        river_basin = models.RiverBasin.objects.get()
+        self.assertAlmostEqual(river_basin.mean_slope, 0.1)
+        self.assertAlmostEqual(river_basin.max_river_length, 2.5)
+
+    def test_calculated_attributes_in_file_are_used(self):
+        models.RiverBasin.objects.update(mean_slope=0.1)
+        path = self._write_layer(
+            "RiverBasin.geojson",
+            [({"id": 1851, "meanSlope": 0.3}, self._square(500000, 4000000, 1000))],
+        )
+        self._replace(path)
+        self.assertAlmostEqual(models.RiverBasin.objects.get().mean_slope, 0.3)
+
+    def test_dirty_region(self):
+        models.DirtyRegion.objects.all().delete()
+        self._replace(self._write_new_river_basins(1851))
+        self.assertEqual(
+            models.DirtyRegion.objects.filter(layer="RiverBasin").count(), 2
+        )
+
+
+class DiffTestCase(ImportTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        call_command(
+            "openhigis_import",
+            self._write_river_basins(),
+            self._write_nodes(),
+            self._write_watercourses(),
+            stdout=StringIO(),
+        )
+        self.river_basin = models.RiverBasin.objects.get()
+        self.station = mommy.make(
+            models.Station,
+            surface_water=models.Watercourse.objects.get(),
+            geom2100=Point(x=500500, y=4000500, srid=2100),
+            geom=Point(24.0072, 36.1518, srid=4326),
+        )
+        models.DirtyRegion.objects.all().delete()
+
+    def _diff(self, *paths):
+        out = StringIO()
+        call_command("openhigis_import", *paths, mode="diff", stdout=out)
+        return out.getvalue()
+
+    def test_hash_is_stored(self):
+        self.assertEqual(len(self.river_basin.imported_hash), 32)
+
+    def test_unchanged(self):
+        out = self._diff(self._write_river_basins())
+        self.assertIn("RiverBasin: 0 inserted, 0 updated, 0 deleted, 1 unchanged", out)
+
+    def test_unchanged_layer_is_not_marked_dirty(self):
+        self._diff(self._write_river_basins())
+        self.assertFalse(models.DirtyRegion.objects.exists())
+
+    def test_updated(self):
+        out = self._diff(self._write_new_river_basins(1851))
+        self.assertIn("RiverBasin: 0 inserted, 1 updated", out)
+
+    def test_updated_row_keeps_its_id(self):
+        self._diff(self._write_new_river_basins(1851))
+        river_basin = models.RiverBasin.objects.get()
+        self.assertEqual(river_basin.id, self.river_basin.id)
+        self.assertEqual(river_basin.name, "Attiki")
+
+    def test_updated_row_keeps_calculated_attributes(self):
+        models.Watercourse.objects.update(
+            hydro_order="2", hydro_order_scheme="strahler", hydro_order_scope="national"
+        )
+        path = self._write_layer(
+            "Watercourse.geojson",
+            [
+                (
+                    {"id": 1952, "geographicalName": "Kifissos"},
+                    {
+                        "type": "LineString",
+                        "coordinates": [[500100, 4000100], [500400, 4000500]],
+                    },
+                )
+            ],
+        )
+        self.assertIn("Watercourse: 0 inserted, 1 updated", self._diff(path))
+        watercourse = models.Watercourse.objects.get()
+        self.assertEqual(watercourse.name, "Kifissos")
+        self.assertEqual(watercourse.hydro_order, "2")
+        self.assertEqual(watercourse.hydro_order_scheme, "strahler")
+
+    def test_inserted(self):
+        path = self._write_layer(
+            "RiverBasin.geojson",
+            [
+                (
+                    {"id": 1851, "geographicalName": "Attica", "origin": "natural"},
+                    self._square(500000, 4000000, 1000),
+                ),
+                ({"id": 1852}, self._square(500000, 4001000, 1000)),
+            ],
+        )
+        out = self._diff(path)
+        self.assertIn("RiverBasin: 1 inserted, 0 updated, 0 deleted, 1 unchanged", out)
+
+    def test_deleted(self):
+        path = self._write_layer(
+            "Watercourse.geojson",
+            [
+                (
+                    {"id": 1953, "localType": "river"},
+                    {
+                        "type": "LineString",
+                        "coordinates": [[500100, 4000100], [500400, 4000500]],
+                    },
+                )
+            ],
+        )
+        out = self._diff(path)
+        self.assertIn("Watercourse: 1 inserted, 0 updated, 1 deleted", out)
+        self.station.refresh_from_db()
+        self.assertIsNone(self.station.surface_water)
+
+    def test_feature_edited_through_view_is_updated(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE openhigis.RiverBasin SET remarks = 'Hello' WHERE id = 1851"
+            )
+        out = self._diff(self._write_river_basins())
+        self.assertIn("RiverBasin: 0 inserted, 1 updated", out)
+        self.assertEqual(models.RiverBasin.objects.get().remarks, "")
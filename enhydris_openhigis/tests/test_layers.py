@@ -0,0 +1,54 @@
+from django.db import connection
+from django.test import TestCase
+
+from enhydris_openhigis import layers
+from enhydris_openhigis.tests.test_dbviews import WatercourseSetupInitialRowMixin
+
+
+class WatercourseLayerTestCase(WatercourseSetupInitialRowMixin, TestCase):
+    def test_attributes(self):
+        watercourse = layers.WatercourseLayer.objects.get(id=1852)
+        self.assertEqual(watercourse.geographical_name, "Attica")
+        self.assertEqual(watercourse.hydro_id, "06")
+        self.assertEqual(watercourse.origin, "manMade")
+        self.assertEqual(watercourse.local_type, "ditch")
+        self.assertEqual(watercourse.stream_order, "18")
+        self.assertAlmostEqual(watercourse.lower_width, 2.718)
+        self.assertAlmostEqual(watercourse.geometry.x, 500000)
+
+    def test_nodes(self):
+        watercourse = layers.WatercourseLayer.objects.get(id=1852)
+        self.assertIsNone(watercourse.start_node_id)
+        self.assertEqual(watercourse.end_node_id, 1901)
+
+    def test_select_related_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            watercourse = layers.WatercourseLayer.objects.select_related(
+                "drains_basin", "end_node"
+            ).get(id=1852)
+            self.assertEqual(watercourse.drains_basin.geographical_name, "Attica")
+            self.assertAlmostEqual(watercourse.end_node.elevation, 782.5)
+
+    def test_reverse_relation(self):
+        river_basin = layers.RiverBasinLayer.objects.get(id=1851)
+        self.assertEqual([w.id for w in river_basin.watercourses.all()], [1852])
+
+
+class LayerModelsTestCase(TestCase):
+    def test_unmanaged(self):
+        for name, model in layers.LAYER_MODELS.items():
+            with self.subTest(layer=name):
+                self.assertFalse(model._meta.managed)
+
+    def test_all_views_are_readable(self):
+        for name, model in layers.LAYER_MODELS.items():
+            with self.subTest(layer=name):
+                self.assertEqual(list(model.objects.all()), [])
+
+    def test_fields_match_view_columns(self):
+        for name, model in layers.LAYER_MODELS.items():
+            with self.subTest(layer=name), connection.cursor() as cursor:
+                cursor.execute("SELECT * FROM openhigis.{} LIMIT 0".format(name))
+                columns = {column[0] for column in cursor.description}
+                fields = {field.column for field in model._meta.concrete_fields}
+                self.assertEqual(fields, columns)
@@ -0,0 +1,119 @@
+from io import StringIO
+
+from django.contrib.gis.geos import LineString, Point, Polygon
+from django.core.management import call_command
+from django.test import TestCase
+
+from model_mommy import mommy
+
+from enhydris_openhigis import models
+
+
+class LinkingTestMixin:
+    # River basin 1851 contains drainage basin 1861, which contains watercourse 1951;
+    # the station is 20 m from the watercourse. The station basin is in 1851 but is
+    # linked to river basin 1852.
+    def setUp(self):
+        super().setUp()
+        self.river_basin = mommy.make(
+            models.RiverBasin,
+            imported_id=1851,
+            geom2100=Polygon.from_bbox((500000, 4000000, 502000, 4002000)),
+        )
+        self.other_river_basin = mommy.make(
+            models.RiverBasin,
+            imported_id=1852,
+            geom2100=Polygon.from_bbox((510000, 4000000, 512000, 4002000)),
+        )
+        self.drainage_basin = mommy.make(
+            models.DrainageBasin,
+            imported_id=1861,
+            river_basin=self.river_basin,
+            geom2100=Polygon.from_bbox((500000, 4000000, 501000, 4001000)),
+        )
+        self.watercourse = mommy.make(
+            models.Watercourse,
+            imported_id=1951,
+            geom2100=LineString((500100, 4000500), (500900, 4000500), srid=2100),
+        )
+        self.station = self._make_station(500500, 4000520)
+        self.station_basin = mommy.make(
+            models.StationBasin,
+            station=self.station,
+            river_basin=self.other_river_basin,
+            geom2100=Polygon.from_bbox((500000, 4000000, 500500, 4000500)),
+        )
+
+    def _make_station(self, x, y):
+        station = mommy.make(
+            models.Station,
+            geom2100=Point(x=x, y=y, srid=2100),
+            geom=Point(24.00166, 36.14732, srid=4326),
+        )
+        models.Station.objects.filter(id=station.id).update(
+            basin=None, surface_water=None
+        )
+        station.refresh_from_db()
+        return station
+
+    def _link(self, **kwargs):
+        out = StringIO()
+        call_command("openhigis_link", stdout=out, **kwargs)
+        for obj in (self.station, self.watercourse, self.station_basin):
+            obj.refresh_from_db()
+        return out.getvalue()
+
+
+class LinkCommandTestCase(LinkingTestMixin, TestCase):
+    def test_station_basin(self):
+        self._link()
+        self.assertEqual(self.station.basin_id, self.drainage_basin.id)
+
+    def test_station_surface_water(self):
+        self._link()
+        self.assertEqual(self.station.surface_water_id, self.watercourse.id)
+
+    def test_station_too_far_from_surface_water(self):
+        self._link(tolerance=10)
+        self.assertIsNone(self.station.surface_water_id)
+
+    def test_surface_water_river_basin(self):
+        self._link()
+        self.assertEqual(self.watercourse.river_basin_id, self.river_basin.id)
+
+    def test_existing_links_are_kept(self):
+        self._link()
+        self.assertEqual(self.station_basin.river_basin_id, self.other_river_basin.id)
+
+    def test_overwrite(self):
+        self._link(overwrite=True)
+        self.assertEqual(self.station_basin.river_basin_id, self.river_basin.id)
+
+    def test_output(self):
+        output = self._link()
+        self.assertIn("station_basin: 1 changed", output)
+
+    def test_dry_run(self):
+        output = self._link(dry_run=True)
+        self.assertIn("station_basin: 1 changed", output)
+        self.assertIsNone(self.station.basin_id)
+
+    def test_link(self):
+        self._link(links=["station_basin"])
+        self.assertIsNone(self.station.surface_water_id)
+
+
+class LinkNewStationTestCase(LinkingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.new_station = mommy.make(
+            models.Station,
+            geom2100=Point(x=500600, y=4000490, srid=2100),
+            geom=Point(24.00166, 36.14732, srid=4326),
+        )
+
+    def test_basin(self):
+        self.assertEqual(self.new_station.basin_id, self.drainage_basin.id)
+
+    def test_surface_water(self):
+        self.assertEqual(self.new_station.surface_water_id, self.watercourse.id)
@@ -0,0 +1,136 @@
+import json
+
+from django.contrib.gis.geos import Polygon
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from enhydris_openhigis.changes import layer_has_changed
+from enhydris_openhigis.locate import LOCATE_LAYERS, PolygonIndex, get_indexes
+
+
+class PolygonIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        self.index = PolygonIndex(
+            [1, 2, 3],
+            ["Big", "Small", "Far"],
+            [
+                Polygon.from_bbox((0, 0, 10, 10)),
+                Polygon.from_bbox((2, 2, 4, 4)),
+                Polygon(((20, 0), (30, 0), (20, 10), (20, 0))),
+            ],
+        )
+
+    def test_len(self):
+        self.assertEqual(len(self.index), 3)
+
+    def test_smallest_polygon_is_found(self):
+        self.assertEqual(self.index.find(3, 3), (2, "Small"))
+
+    def test_larger_polygon(self):
+        self.assertEqual(self.index.find(8, 8), (1, "Big"))
+
+    def test_boundary(self):
+        self.assertEqual(self.index.find(10, 5), (1, "Big"))
+
+    def test_inside_bbox_but_outside_polygon(self):
+        self.assertIsNone(self.index.find(29, 9))
+
+    def test_outside(self):
+        self.assertIsNone(self.index.find(15, 5))
+
+    def test_empty(self):
+        self.assertIsNone(PolygonIndex([], [], []).find(0, 0))
+
+
+class LocateTestCase(TestCase):
+    # The point (500000, 4000000) in EPSG:2100
+    lat = 36.14732
+    lon = 24.00166
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO openhigis.RiverBasinDistrict
+                (geographicalName, geometry, id)
+                VALUES (
+                    'Attica',
+                    'SRID=2100;POLYGON((400000 3900000, 600000 3900000,
+                        600000 4100000, 400000 4100000, 400000 3900000))',
+                    1850
+                )
+                """
+            )
+            cursor.execute(
+                """
+                INSERT INTO openhigis.RiverBasin (geographicalName, geometry, id)
+                VALUES (
+                    'Kifisos',
+                    'SRID=2100;POLYGON((490000 3990000, 510000 3990000,
+                        510000 4010000, 490000 4010000, 490000 3990000))',
+                    1851
+                )
+                """
+            )
+        for layer_name in LOCATE_LAYERS:
+            layer_has_changed(layer_name)
+
+    def _get(self, **params):
+        return self.client.get(reverse("openhigis_locate"), params)
+
+    def test_locate(self):
+        response = self._get(lat=self.lat, lon=self.lon)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content),
+            {
+                "RiverBasinDistrict": {"id": 1850, "name": "Attica"},
+                "RiverBasin": {"id": 1851, "name": "Kifisos"},
+                "DrainageBasin": None,
+            },
+        )
+
+    def test_outside(self):
+        response = self._get(lat=38.5, lon=21.5)
+        self.assertEqual(
+            json.loads(response.content),
+            {"RiverBasinDistrict": None, "RiverBasin": None, "DrainageBasin": None},
+        )
+
+    def test_index_is_reused(self):
+        indexes = get_indexes()
+        for layer_name, index in get_indexes().items():
+            self.assertIs(index, indexes[layer_name])
+
+    def test_index_is_reloaded_when_layer_changes(self):
+        get_indexes()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO openhigis.DrainageBasin
+                (geographicalName, geometry, id, riverBasin)
+                VALUES (
+                    'Kifisos upstream',
+                    'SRID=2100;POLYGON((495000 3995000, 505000 3995000,
+                        505000 4005000, 495000 4005000, 495000 3995000))',
+                    1852,
+                    1851
+                )
+                """
+            )
+        layer_has_changed("DrainageBasin")
+        response = self._get(lat=self.lat, lon=self.lon)
+        self.assertEqual(
+            json.loads(response.content)["DrainageBasin"],
+            {"id": 1852, "name": "Kifisos upstream"},
+        )
+
+    def test_missing_parameter(self):
+        self.assertEqual(self._get(lat=self.lat).status_code, 400)
+
+    def test_invalid_parameter(self):
+        self.assertEqual(self._get(lat="north", lon=self.lon).status_code, 400)
+
+    def test_out_of_range(self):
+        self.assertEqual(self._get(lat=95, lon=self.lon).status_code, 400)
@@ -0,0 +1,251 @@
+import json
+from io import StringIO
+from unittest import mock
+
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from model_mommy import mommy
+
+from enhydris_openhigis import models
+from enhydris_openhigis.changes import get_cache
+from enhydris_openhigis.network import Network, get_network
+
+
+class NetworkTestCase(SimpleTestCase):
+    # Watercourses 11 and 12 join at node 3 and flow through 13 and 14 to node 5;
+    # 15 isn't connected at its start and ends at node 4.
+    def setUp(self):
+        self.network = Network(
+            watercourse_ids=[14, 11, 13, 12, 15],
+            watercourse_imported_ids=[114, 111, 113, 112, 115],
+            start_node_ids=[4, 1, 3, 2, -1],
+            end_node_ids=[5, 3, 4, 3, 4],
+            node_ids=[5, 4, 3, 2, 1],
+            node_imported_ids=[105, 104, 103, 102, 101],
+        )
+
+    def test_upstream_of_node(self):
+        self.assertEqual(self.network.upstream_of_node(4).tolist(), [11, 12, 13, 15])
+
+    def test_downstream_of_node(self):
+        self.assertEqual(self.network.downstream_of_node(1).tolist(), [11, 13, 14])
+
+    def test_nothing_upstream_of_source(self):
+        self.assertEqual(self.network.upstream_of_node(1).tolist(), [])
+
+    def test_upstream_of_watercourse(self):
+        self.assertEqual(
+            self.network.upstream_of_watercourse(13).tolist(), [11, 12, 13]
+        )
+
+    def test_downstream_of_watercourse(self):
+        self.assertEqual(
+            self.network.downstream_of_watercourse(12).tolist(), [12, 13, 14]
+        )
+
+    def test_unknown_node(self):
+        with self.assertRaises(KeyError):
+            self.network.upstream_of_node(6)
+
+    def test_get_node_id(self):
+        self.assertEqual(self.network.get_node_id(103), 3)
+
+    def test_get_imported_ids(self):
+        self.assertEqual(self.network.get_imported_ids([11, 14]).tolist(), [111, 114])
+
+    def test_cycle(self):
+        network = Network([1, 2], [1, 2], [1, 2], [2, 1], [1, 2], [1, 2])
+        self.assertEqual(network.upstream_of_node(1).tolist(), [1, 2])
+
+
+class StreamOrderTestCase(SimpleTestCase):
+    def setUp(self):
+        self.network = Network(
+            watercourse_ids=[11, 12, 13, 14, 15],
+            watercourse_imported_ids=[111, 112, 113, 114, 115],
+            start_node_ids=[1, 2, 3, 4, -1],
+            end_node_ids=[3, 3, 4, 5, 4],
+            node_ids=[1, 2, 3, 4, 5],
+            node_imported_ids=[101, 102, 103, 104, 105],
+        )
+
+    def test_strahler(self):
+        self.assertEqual(self.network.get_stream_orders().tolist(), [1, 1, 2, 2, 1])
+
+    def test_shreve(self):
+        self.assertEqual(
+            self.network.get_stream_orders("shreve").tolist(), [1, 1, 2, 3, 1]
+        )
+
+    def test_cycle(self):
+        network = Network([1, 2, 3], [1, 2, 3], [1, 2, 2], [2, 1, -1], [1, 2], [1, 2])
+        self.assertEqual(network.get_stream_orders().tolist(), [0, 0, 0])
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            self.network.get_stream_orders("horton")
+
+    def test_no_nodes(self):
+        network = Network([1, 2], [1, 2], [-1, -1], [-1, -1], [], [])
+        self.assertEqual(network.get_stream_orders().tolist(), [1, 1])
+
+
+class LongestPathTestCase(SimpleTestCase):
+    def test_longest_paths(self):
+        network = Network(
+            watercourse_ids=[11, 12, 13, 14, 15],
+            watercourse_imported_ids=[111, 112, 113, 114, 115],
+            start_node_ids=[1, 2, 3, 4, -1],
+            end_node_ids=[3, 3, 4, 5, 4],
+            node_ids=[1, 2, 3, 4, 5],
+            node_imported_ids=[101, 102, 103, 104, 105],
+        )
+        self.assertEqual(
+            network.get_longest_paths([1, 2, 3, 4, 10]).tolist(), [1, 2, 5, 14, 10]
+        )
+
+    def test_no_nodes(self):
+        network = Network([1, 2], [1, 2], [-1, -1], [-1, -1], [], [])
+        self.assertEqual(network.get_longest_paths([3, 4]).tolist(), [3, 4])
+
+
+class NetworkDataMixin:
+    def setUp(self):
+        super().setUp()
+        nodes = [mommy.make(models.HydroNode, imported_id=i) for i in (101, 102, 103)]
+        self.watercourse1 = mommy.make(
+            models.Watercourse,
+            imported_id=111,
+            start_node=nodes[0],
+            end_node=nodes[1],
+        )
+        self.watercourse2 = mommy.make(
+            models.Watercourse,
+            imported_id=112,
+            start_node=nodes[1],
+            end_node=nodes[2],
+        )
+        self.station = mommy.make(
+            models.Station,
+            surface_water=self.watercourse2,
+            geom2100=Point(x=500000, y=4000000, srid=2100),
+            geom=Point(24.00166, 36.14732, srid=4326),
+        )
+        # In a TestCase the saves aren't committed, so they don't change the layer
+        # versions; without this, get_network() could return another test's network
+        # (the test cases also set the reload interval to zero for the same reason).
+        get_cache().clear()
+
+
+@override_settings(ENHYDRIS_OPENHIGIS_NETWORK_RELOAD_INTERVAL=0)
+class GetNetworkTestCase(NetworkDataMixin, TestCase):
+    def test_loads_network(self):
+        network = get_network()
+        node_id = network.get_node_id(102)
+        self.assertEqual(
+            network.upstream_of_node(node_id).tolist(), [self.watercourse1.id]
+        )
+
+
+@override_settings(ENHYDRIS_OPENHIGIS_NETWORK_RELOAD_INTERVAL=0)
+class ReloadNetworkTestCase(NetworkDataMixin, TransactionTestCase):
+    # The network is reloaded after the change is committed, which TestCase never does
+    serialized_rollback = True
+
+    def setUp(self):
+        # Committing queues a refresh, but there is no Celery broker
+        patcher = mock.patch("enhydris_openhigis.tasks.schedule_refresh")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def test_reloads_network_when_watercourses_change(self):
+        get_network()
+        self.watercourse2.delete()
+        network = get_network()
+        node_id = network.get_node_id(102)
+        self.assertEqual(network.downstream_of_node(node_id).tolist(), [])
+
+    def test_reloads_network_at_most_once_per_interval(self):
+        get_network()
+        watercourse2_id = self.watercourse2.id
+        with override_settings(ENHYDRIS_OPENHIGIS_NETWORK_RELOAD_INTERVAL=3600):
+            self.watercourse2.delete()
+            network = get_network()
+        node_id = network.get_node_id(102)
+        self.assertEqual(
+            network.downstream_of_node(node_id).tolist(), [watercourse2_id]
+        )
+
+
+@override_settings(ENHYDRIS_OPENHIGIS_NETWORK_RELOAD_INTERVAL=0)
+class NetworkViewTestCase(NetworkDataMixin, TestCase):
+    def _get_node(self, node_id, direction):
+        return self.client.get(
+            reverse(
+                "openhigis_network_node",
+                kwargs={"node_id": node_id, "direction": direction},
+            )
+        )
+
+    def _get_station(self, station_id, direction):
+        return self.client.get(
+            reverse(
+                "openhigis_network_station",
+                kwargs={"station_id": station_id, "direction": direction},
+            )
+        )
+
+    def test_upstream_of_node(self):
+        response = self._get_node(103, "upstream")
+        self.assertEqual(json.loads(response.content), {"watercourses": [111, 112]})
+
+    def test_downstream_of_node(self):
+        response = self._get_node(102, "downstream")
+        self.assertEqual(json.loads(response.content), {"watercourses": [112]})
+
+    def test_upstream_of_station(self):
+        response = self._get_station(self.station.id, "upstream")
+        self.assertEqual(json.loads(response.content), {"watercourses": [111, 112]})
+
+    def test_unknown_node(self):
+        self.assertEqual(self._get_node(104, "upstream").status_code, 404)
+
+    def test_unknown_direction(self):
+        self.assertEqual(self._get_node(102, "sideways").status_code, 404)
+
+    def test_station_not_on_watercourse(self):
+        self.station.surface_water = None
+        self.station.save()
+        self.assertEqual(
+            self._get_station(self.station.id, "upstream").status_code, 404
+        )
+
+
+class StreamOrderCommandTestCase(NetworkDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        models.DirtyRegion.objects.all().delete()
+        self.out = StringIO()
+        call_command("openhigis_stream_order", stdout=self.out)
+        self.watercourse2.refresh_from_db()
+
+    def test_output(self):
+        self.assertIn("2 watercourses updated", self.out.getvalue())
+
+    def test_hydro_order(self):
+        self.assertEqual(self.watercourse2.hydro_order, "1")
+
+    def test_hydro_order_scheme(self):
+        self.assertEqual(self.watercourse2.hydro_order_scheme, "strahler")
+
+    def test_unchanged_watercourses_are_not_updated(self):
+        out = StringIO()
+        call_command("openhigis_stream_order", stdout=out)
+        self.assertIn("0 watercourses updated", out.getvalue())
+
+    def test_dirty_region(self):
+        self.assertTrue(models.DirtyRegion.objects.filter(layer="Watercourse").exists())
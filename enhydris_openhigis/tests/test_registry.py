@@ -0,0 +1,61 @@
+from django.test import SimpleTestCase
+
+from enhydris_openhigis import models
+from enhydris_openhigis.registry import build_registry, get_registry
+
+
+class RegistryTestCase(SimpleTestCase):
+    def test_is_built_once(self):
+        self.assertIs(get_registry(), get_registry())
+
+    def test_same_as_freshly_built(self):
+        self.assertEqual(get_registry(), build_registry())
+
+    def test_sorted_by_name(self):
+        names = [layer.name for layer in get_registry()]
+        self.assertEqual(names, sorted(names))
+
+    def test_get_by_name(self):
+        self.assertIs(get_registry()["Watercourse"].model, models.Watercourse)
+
+    def test_get_by_model(self):
+        self.assertEqual(
+            get_registry().get_by_model(models.HydroNode).name, "HydroNode"
+        )
+
+    def test_unknown_layer(self):
+        with self.assertRaises(KeyError):
+            get_registry()["Basin"]
+
+
+class LayerTestCase(SimpleTestCase):
+    def test_inherited_geometry_table(self):
+        layer = get_registry()["RiverBasin"]
+        self.assertEqual(layer.table, "enhydris_openhigis_riverbasin")
+        self.assertEqual(layer.pk_column, "basin_ptr_id")
+        self.assertEqual(layer.geom_table, "enhydris_openhigis_basin")
+        self.assertEqual(layer.geom_pk_column, "garea_ptr_id")
+        self.assertEqual(layer.geom_column, "geom2100")
+
+    def test_own_geometry_table(self):
+        layer = get_registry()["Station"]
+        self.assertEqual(layer.geom_table, "enhydris_openhigis_station")
+
+    def test_imported_id(self):
+        self.assertEqual(
+            get_registry()["DrainageBasin"].imported_id, 'gt."imported_id"'
+        )
+
+    def test_no_imported_id(self):
+        self.assertEqual(get_registry()["StationBasin"].imported_id, "NULL")
+
+    def test_materialized_view(self):
+        self.assertEqual(
+            get_registry()["Watercourse"].materialized_view, "openhigis.Watercourse_mv"
+        )
+
+    def test_simplified(self):
+        self.assertTrue(get_registry()["RiverBasin"].simplified)
+
+    def test_not_simplified(self):
+        self.assertFalse(get_registry()["HydroNode"].simplified)
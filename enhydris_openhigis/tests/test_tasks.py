@@ -0,0 +1,125 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from enhydris_openhigis import models
+from enhydris_openhigis.changes import get_cache
+from enhydris_openhigis.tasks import (
+    get_layers_affected_by,
+    get_stale_layers,
+    refresh_materialized_views,
+    schedule_refresh,
+)
+
+
+class GetLayersAffectedByTestCase(SimpleTestCase):
+    def test_layer_referenced_by_others(self):
+        self.assertEqual(
+            get_layers_affected_by("HydroNode"), ["HydroNode", "Watercourse"]
+        )
+
+    def test_layer_not_referenced(self):
+        self.assertEqual(
+            get_layers_affected_by("RiverBasinDistrict"), ["RiverBasinDistrict"]
+        )
+
+
+class RefreshMaterializedViewsTestCase(TestCase):
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO openhigis.RiverBasin
+                (geographicalName, hydroId, remarks, geometry, origin, meanSlope,
+                meanElevation, maxRiverLength, id)
+                VALUES
+                ('Attica', '06', 'Hello world', 'SRID=2100;POINT(500000 4000000)',
+                'manMade', 0.15, 200, 27.5, 1851)
+                """
+            )
+            cursor.execute(
+                """
+                INSERT INTO openhigis.DrainageBasin
+                (geographicalName, hydroId, remarks, geometry, origin, id, riverBasin)
+                VALUES
+                ('Kifisos', '07', '', 'SRID=2100;POINT(500000 4000000)',
+                'natural', 1852, 1851)
+                """
+            )
+
+    def _get_names(self, layer_name):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT geographicalName FROM openhigis.{}_mv".format(layer_name)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_stale_before_refresh(self):
+        self.assertEqual(self._get_names("RiverBasin"), [])
+
+    def test_refreshed(self):
+        refresh_materialized_views("RiverBasin")
+        self.assertEqual(self._get_names("RiverBasin"), ["Attica"])
+
+    def test_referencing_layers_refreshed(self):
+        refresh_materialized_views("RiverBasin")
+        self.assertEqual(self._get_names("DrainageBasin"), ["Kifisos"])
+
+
+@override_settings(ENHYDRIS_OPENHIGIS_REFRESH_DELAY=30)
+@mock.patch("enhydris_openhigis.tasks.refresh_materialized_views.apply_async")
+class ScheduleRefreshTestCase(TestCase):
+    def setUp(self):
+        get_cache().clear()
+
+    def test_delayed(self, apply_async):
+        schedule_refresh("RiverBasin")
+        apply_async.assert_called_once_with(("RiverBasin",), countdown=30)
+
+    def test_changes_are_coalesced(self, apply_async):
+        schedule_refresh("RiverBasin")
+        schedule_refresh("RiverBasin")
+        self.assertEqual(apply_async.call_count, 1)
+
+    def test_layers_are_refreshed_separately(self, apply_async):
+        schedule_refresh("RiverBasin")
+        schedule_refresh("Watercourse")
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_scheduled_again_after_refresh(self, apply_async):
+        schedule_refresh("RiverBasin")
+        refresh_materialized_views("RiverBasin")
+        schedule_refresh("RiverBasin")
+        self.assertEqual(apply_async.call_count, 2)
+
+
+@override_settings(ENHYDRIS_OPENHIGIS_REFRESH_DELAY=60)
+class GetStaleLayersTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for layer_name, minutes_ago in (
+            ("RiverBasin", 30),
+            ("RiverBasin", 20),
+            ("Watercourse", 1),
+        ):
+            models.DirtyRegion.objects.create(
+                layer=layer_name, created=now - timedelta(minutes=minutes_ago)
+            )
+        self.stale_layers = get_stale_layers(600)
+
+    def test_stale(self):
+        self.assertEqual(list(self.stale_layers), ["RiverBasin"])
+
+    def test_oldest_region(self):
+        self.assertAlmostEqual(
+            self.stale_layers["RiverBasin"],
+            timezone.now() - timedelta(minutes=30),
+            delta=timedelta(minutes=1),
+        )
+
+    def test_refreshed(self):
+        refresh_materialized_views("RiverBasin")
+        self.assertEqual(get_stale_layers(600), {})
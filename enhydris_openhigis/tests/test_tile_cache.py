@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.gis.geos import Polygon
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from model_mommy import mommy
+
+from enhydris_openhigis import models, tile_cache
+
+
+class TileCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            ENHYDRIS_OPENHIGIS_TILE_CACHE_DIR=self.cache_dir
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def test_not_cached(self):
+        self.assertIsNone(tile_cache.get_tile("Station", 10, 580, 401))
+
+    def test_cached(self):
+        tile_cache.set_tile("Station", 10, 580, 401, b"hello")
+        self.assertEqual(tile_cache.get_tile("Station", 10, 580, 401), b"hello")
+
+    @override_settings(ENHYDRIS_OPENHIGIS_TILE_CACHE_DIR=None)
+    def test_disabled(self):
+        tile_cache.set_tile("Station", 10, 580, 401, b"hello")
+        self.assertIsNone(tile_cache.get_tile("Station", 10, 580, 401))
+
+
+class PurgeDirtyTilesTestCase(TileCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        # Tile 10/580/401 contains point (500000, 4000000) of EPSG:2100; the others
+        # are far from it.
+        for z, x, y in [(10, 580, 401), (10, 560, 401), (10, 580, 380)]:
+            tile_cache.set_tile("Station", z, x, y, b"hello")
+        tile_cache.set_tile("RiverBasin", 10, 580, 401, b"hello")
+        envelope = Polygon.from_bbox((499000, 3999000, 501000, 4001000))
+        envelope.srid = 2100
+        self.region = models.DirtyRegion.objects.create(
+            layer="Station", envelope=envelope
+        )
+
+    def _exists(self, layer_name, z, x, y):
+        return tile_cache.get_tile(layer_name, z, x, y) is not None
+
+    def test_tile_in_region_is_purged(self):
+        tile_cache.purge_dirty_tiles("Station", ["Station"], self.region.id)
+        self.assertFalse(self._exists("Station", 10, 580, 401))
+
+    def test_tiles_outside_region_are_kept(self):
+        tile_cache.purge_dirty_tiles("Station", ["Station"], self.region.id)
+        self.assertTrue(self._exists("Station", 10, 560, 401))
+        self.assertTrue(self._exists("Station", 10, 580, 380))
+
+    def test_unaffected_layer_is_kept(self):
+        tile_cache.purge_dirty_tiles("Station", ["Station"], self.region.id)
+        self.assertTrue(self._exists("RiverBasin", 10, 580, 401))
+
+    def test_affected_layer_is_purged(self):
+        tile_cache.purge_dirty_tiles(
+            "Station", ["Station", "RiverBasin"], self.region.id
+        )
+        self.assertFalse(self._exists("RiverBasin", 10, 580, 401))
+
+    def test_region_is_deleted(self):
+        tile_cache.purge_dirty_tiles("Station", ["Station"], self.region.id)
+        self.assertFalse(models.DirtyRegion.objects.exists())
+
+    def test_more_recent_regions_are_kept(self):
+        tile_cache.purge_dirty_tiles("Station", ["Station"], self.region.id - 1)
+        self.assertTrue(self._exists("Station", 10, 580, 401))
+        self.assertTrue(models.DirtyRegion.objects.exists())
+
+    def test_whole_layer(self):
+        models.DirtyRegion.objects.create(layer="Station", envelope=None)
+        tile_cache.purge_dirty_tiles(
+            "Station", ["Station"], tile_cache.get_last_dirty_region_id("Station")
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "Station")))
+
+
+class DirtyRegionTriggersTestCase(TestCase):
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO openhigis.RiverBasin (geographicalName, geometry, id)
+                VALUES ('Attica', 'SRID=2100;POINT(500000 4000000)', 1851)
+                """
+            )
+
+    def _get_envelopes(self):
+        regions = models.DirtyRegion.objects.filter(layer="RiverBasin").order_by("id")
+        return [region.envelope.extent for region in regions]
+
+    def test_insert(self):
+        self.assertEqual(self._get_envelopes(), [(500000, 4000000, 500000, 4000000)])
+
+    def test_update(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE openhigis.RiverBasin
+                SET geometry='SRID=2100;POINT(550000 4500000)'
+                WHERE id=1851
+                """
+            )
+        self.assertEqual(
+            self._get_envelopes()[1:],
+            [(500000, 4000000, 500000, 4000000), (550000, 4500000, 550000, 4500000)],
+        )
+
+    def test_delete(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM openhigis.RiverBasin WHERE id=1851")
+        self.assertEqual(
+            self._get_envelopes()[1:], [(500000, 4000000, 500000, 4000000)]
+        )
+
+
+class DirtyRegionModelSignalsTestCase(TestCase):
+    # Rows saved through Django rather than the views
+    def setUp(self):
+        self.river_basin = mommy.make(
+            models.RiverBasin,
+            geom2100=Polygon.from_bbox((500000, 4000000, 501000, 4001000)),
+        )
+
+    def _get_envelopes(self):
+        regions = models.DirtyRegion.objects.filter(layer="RiverBasin").order_by("id")
+        return [region.envelope.extent for region in regions]
+
+    def test_create(self):
+        self.assertEqual(self._get_envelopes(), [(500000, 4000000, 501000, 4001000)])
+
+    def test_update(self):
+        self.river_basin.geom2100 = Polygon.from_bbox(
+            (550000, 4500000, 551000, 4501000)
+        )
+        self.river_basin.save()
+        self.assertEqual(
+            self._get_envelopes()[1:],
+            [(500000, 4000000, 501000, 4001000), (550000, 4500000, 551000, 4501000)],
+        )
+
+    def test_delete(self):
+        self.river_basin.delete()
+        self.assertEqual(
+            self._get_envelopes()[1:], [(500000, 4000000, 501000, 4001000)]
+        )
@@ -0,0 +1,90 @@
+from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from model_mommy import mommy
+
+from enhydris_openhigis import models, tiles
+from enhydris_openhigis.registry import get_registry
+
+
+class GetTileBoundsTestCase(SimpleTestCase):
+    def test_world(self):
+        h = tiles.HALF_WORLD
+        self.assertEqual(tiles.get_tile_bounds(0, 0, 0), (-h, -h, h, h))
+
+    def test_northeast_quarter(self):
+        h = tiles.HALF_WORLD
+        self.assertEqual(tiles.get_tile_bounds(1, 1, 0), (0, 0, h, h))
+
+    def test_nonexistent(self):
+        with self.assertRaises(ValueError):
+            tiles.get_tile_bounds(1, 2, 0)
+
+
+class GetSearchBoxTestCase(SimpleTestCase):
+    def test_contains_point(self):
+        x1, y1, x2, y2 = tiles.get_search_box(tiles.get_tile_bounds(10, 580, 401))
+        self.assertTrue(x1 < 500000 < x2)
+        self.assertTrue(y1 < 4000000 < y2)
+
+    def test_outside_greece(self):
+        self.assertIsNone(tiles.get_search_box(tiles.get_tile_bounds(10, 0, 0)))
+
+
+class GetGeometryColumnTestCase(SimpleTestCase):
+    def test_country(self):
+        layer = get_registry()["RiverBasin"]
+        self.assertEqual(tiles.get_geometry_column(layer, 6), "geometry_1km")
+
+    def test_region(self):
+        layer = get_registry()["RiverBasin"]
+        self.assertEqual(tiles.get_geometry_column(layer, 9), "geometry_100m")
+
+    def test_street(self):
+        layer = get_registry()["RiverBasin"]
+        self.assertEqual(tiles.get_geometry_column(layer, 15), "geometry")
+
+    def test_not_simplified(self):
+        layer = get_registry()["Station"]
+        self.assertEqual(tiles.get_geometry_column(layer, 6), "geometry")
+
+
+class TileViewTestCase(TestCase):
+    def setUp(self):
+        mommy.make(
+            models.Station,
+            name="Hello",
+            geom2100=Point(x=500000, y=4000000, srid=2100),
+            geom=Point(24.00166, 36.14732, srid=4326),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("REFRESH MATERIALIZED VIEW openhigis.Station_mv")
+
+    def _get(self, layer, z, x, y):
+        return self.client.get(
+            reverse("openhigis_tile", kwargs={"layer": layer, "z": z, "x": x, "y": y})
+        )
+
+    def test_content_type(self):
+        response = self._get("Station", 10, 580, 401)
+        self.assertEqual(response["Content-Type"], "application/vnd.mapbox-vector-tile")
+
+    def test_tile_with_feature(self):
+        response = self._get("Station", 10, 580, 401)
+        self.assertIn(b"Hello", response.content)
+
+    def test_tile_without_features(self):
+        response = self._get("Station", 10, 581, 401)
+        self.assertEqual(response.content, b"")
+
+    def test_tile_outside_greece(self):
+        response = self._get("Station", 10, 0, 0)
+        self.assertEqual(response.content, b"")
+
+    def test_unknown_layer(self):
+        self.assertEqual(self._get("Basin", 10, 580, 401).status_code, 404)
+
+    def test_nonexistent_tile(self):
+        self.assertEqual(self._get("Station", 1, 2, 0).status_code, 404)
@@ -1,10 +1,14 @@
-from django.contrib.gis.geos import Point
-from django.test import TestCase, override_settings
+import json
+from unittest import mock
+
+from django.contrib.gis.geos import Point, Polygon
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 
 from model_mommy import mommy
 
-from enhydris_openhigis import models
+from enhydris_openhigis import models, search_cache
+from enhydris_openhigis.changes import get_cache
 from enhydris_openhigis.views import get_all_geomodels
 
 
@@ -31,12 +35,16 @@ class SearchDataMixin:
         "Northeast hello": (500, 4000),
         "Southeast": (600, 3800),
         "Southwest hello": (400, 3900),
+        "Café": (350, 4300),
     }
 
     def setUp(self):
         super().setUp()
         for p in self.points:
             self._make_point(p, self.points[p])
+        # In a TestCase the saves aren't committed, so they don't change the layer
+        # versions; without this, searches could return another test's results.
+        get_cache().clear()
 
     def _make_point(self, name, coordinates):
         mommy.make(
@@ -46,14 +54,23 @@ class SearchDataMixin:
             geom=Point(23, 38, srid=4326),
         )
 
+    def _get_bbox(self, search_term):
+        response = self.client.get(
+            reverse("openhigis_search", kwargs={"search_term": search_term})
+        )
+        return json.loads(response.content.decode("utf-8"))["bbox"]
+
 
 class SearchViewTestCase(SearchDataMixin, TestCase):
-    def _test(self, search_term, expected_x1, expected_y1, expected_x2, expected_y2):
+    def _get(self, search_term):
         response = self.client.get(
             reverse("openhigis_search", kwargs={"search_term": search_term})
         )
         self.assertEqual(response.status_code, 200)
-        x1, y1, x2, y2 = map(float, response.content.decode("utf-8").split())
+        return json.loads(response.content.decode("utf-8"))
+
+    def _test(self, search_term, expected_x1, expected_y1, expected_x2, expected_y2):
+        x1, y1, x2, y2 = self._get(search_term)["bbox"]
         self.assertAlmostEqual(x1, expected_x1)
         self.assertAlmostEqual(y1, expected_y1)
         self.assertAlmostEqual(x2, expected_x2)
@@ -77,3 +94,143 @@ class SearchViewTestCase(SearchDataMixin, TestCase):
             expected_x2=24.0,
             expected_y2=36.0,
         )
+
+    def test_search_ignores_case_and_accents(self):
+        x1, y1, x2, y2 = self._get("CAFE")["layers"]["Station"]
+        self.assertAlmostEqual(x1, x2)
+        self.assertAlmostEqual(y1, y2)
+
+    def test_layer_extents(self):
+        layers = self._get("hello")["layers"]
+        self.assertEqual(list(layers.keys()), ["Station"])
+        x1, y1, x2, y2 = layers["Station"]
+        self.assertAlmostEqual(x1, 22.9025706)
+        self.assertAlmostEqual(y1, 35.2407093)
+        self.assertAlmostEqual(x2, 24.0016625)
+        self.assertAlmostEqual(y2, 36.1473217)
+
+    def test_no_layer_extents_when_nothing_found(self):
+        self.assertEqual(self._get("nonexistent")["layers"], {})
+
+
+@override_settings(ENHYDRIS_OPENHIGIS_AUTOCOMPLETE_MAX_RESULTS=3)
+class AutocompleteViewTestCase(SearchDataMixin, TestCase):
+    def _get(self, **params):
+        response = self.client.get(reverse("openhigis_autocomplete"), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode("utf-8"))
+
+    def test_names(self):
+        names = [r["name"] for r in self._get(q="hello")["results"]]
+        self.assertEqual(sorted(names), ["Northeast hello", "Southwest hello"])
+
+    def test_layer(self):
+        result = self._get(q="Northeast")["results"][0]
+        self.assertEqual(result["layer"], "Station")
+
+    def test_imported_id_is_null_for_stations(self):
+        result = self._get(q="Northeast")["results"][0]
+        self.assertIsNone(result["imported_id"])
+
+    def test_id_of_station(self):
+        result = self._get(q="Northeast")["results"][0]
+        station = models.Station.objects.get(name="Northeast hello")
+        self.assertEqual(result["id"], station.id)
+
+    def test_id_is_that_of_the_view(self):
+        mommy.make(
+            models.RiverBasin,
+            imported_id=1851,
+            name="Kifisos",
+            geom2100=Polygon.from_bbox((500000, 4000000, 501000, 4001000)),
+        )
+        result = self._get(q="Kifisos")["results"][0]
+        self.assertEqual(result["layer"], "RiverBasin")
+        self.assertEqual(result["id"], 1851)
+
+    def test_bbox(self):
+        x1, y1, x2, y2 = self._get(q="Northeast hello")["results"][0]["bbox"]
+        self.assertAlmostEqual(x1, 24.0016625)
+        self.assertAlmostEqual(y1, 36.1473217)
+        self.assertAlmostEqual(x2, 24.0016625)
+        self.assertAlmostEqual(y2, 36.1473217)
+
+    def test_best_match_first(self):
+        result = self._get(q="Southwest hello")["results"][0]
+        self.assertEqual(result["name"], "Southwest hello")
+
+    def test_no_next_when_everything_returned(self):
+        self.assertIsNone(self._get(q="hello")["next"])
+
+    def test_limit_is_capped(self):
+        results = self._get(q="e", limit=100)["results"]
+        self.assertEqual(len(results), 3)
+
+    def test_pagination(self):
+        names = []
+        page = self._get(q="e", limit=2)
+        while True:
+            names.extend(r["name"] for r in page["results"])
+            if not page["next"]:
+                break
+            page = self._get(q="e", limit=2, after=page["next"])
+        self.assertEqual(
+            sorted(names),
+            ["Café", "Northeast hello", "Northwest", "Southeast", "Southwest hello"],
+        )
+
+    def test_bad_limit(self):
+        response = self.client.get(
+            reverse("openhigis_autocomplete"), {"q": "hello", "limit": "x"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchCacheTestCase(SearchDataMixin, TestCase):
+    def test_second_search_is_a_hit(self):
+        self._get_bbox("hello")
+        hits = search_cache.get_stats()["hits"]
+        self._get_bbox("hello")
+        self.assertEqual(search_cache.get_stats()["hits"], hits + 1)
+
+    def test_first_search_is_a_miss(self):
+        misses = search_cache.get_stats()["misses"]
+        self._get_bbox("a term that has never been searched")
+        self.assertEqual(search_cache.get_stats()["misses"], misses + 1)
+
+    def test_equivalent_term_is_a_hit(self):
+        self._get_bbox("hello")
+        hits = search_cache.get_stats()["hits"]
+        self._get_bbox("HÉLLO")
+        self.assertEqual(search_cache.get_stats()["hits"], hits + 1)
+
+
+class InvalidateSearchCacheTestCase(SearchDataMixin, TransactionTestCase):
+    # The cache is invalidated when the change is committed, which TestCase never does
+    serialized_rollback = True
+
+    def setUp(self):
+        # Committing queues a refresh, but there is no Celery broker
+        patcher = mock.patch("enhydris_openhigis.tasks.schedule_refresh")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def test_invalidated_on_save(self):
+        self._get_bbox("hello")
+        self._make_point("Far west hello", (200, 4100))
+        self.assertLess(self._get_bbox("hello")[0], 22)
+
+
+class NormalizeSearchTermTestCase(SimpleTestCase):
+    def test_greek(self):
+        self.assertEqual(
+            search_cache.normalize_search_term("Αχελώος"),
+            search_cache.normalize_search_term("ΑΧΕΛΩΟΣ"),
+        )
+
+    def test_whitespace_is_significant(self):
+        self.assertNotEqual(
+            search_cache.normalize_search_term("hello"),
+            search_cache.normalize_search_term("hello "),
+        )
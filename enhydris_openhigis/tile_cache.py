@@ -0,0 +1,127 @@
+"""On-disk cache of the vector tiles.
+
+Tiles are stored as <layer>/<z>/<x>/<y>.mvt in the directory specified by the
+ENHYDRIS_OPENHIGIS_TILE_CACHE_DIR setting; if it isn't set, tiles are not cached.
+
+Cached tiles never expire; instead, they are purged when they become stale. Whenever a
+feature is inserted, updated or deleted through the views, the triggers record the
+bounding boxes of its old and new geometry as a DirtyRegion (see create_views.sql);
+the model signals do the same for features saved through Django (see changes.py).
+After the materialized views from which the tiles are made are refreshed,
+tasks.refresh_materialized_views() calls purge_dirty_tiles(), which removes the
+cached tiles that intersect the dirty regions, and then deletes the regions.
+"""
+
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db.models import Max
+
+from . import tiles
+from .models import DirtyRegion
+
+
+def get_cache_dir():
+    return getattr(settings, "ENHYDRIS_OPENHIGIS_TILE_CACHE_DIR", None)
+
+
+def _get_path(cache_dir, layer_name, z, x, y):
+    return os.path.join(cache_dir, layer_name, str(z), str(x), "{}.mvt".format(y))
+
+
+def get_tile(layer_name, z, x, y):
+    """Return the cached tile, or None if it isn't cached."""
+    cache_dir = get_cache_dir()
+    if not cache_dir:
+        return None
+    try:
+        with open(_get_path(cache_dir, layer_name, z, x, y), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def set_tile(layer_name, z, x, y, tile):
+    cache_dir = get_cache_dir()
+    if not cache_dir:
+        return
+    path = _get_path(cache_dir, layer_name, z, x, y)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    # Write to a temporary file and rename it, so that readers never see a partly
+    # written tile.
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(tile)
+    os.replace(tmp_path, path)
+
+
+def get_last_dirty_region_id(layer_name):
+    """Return the id of the most recent dirty region of the layer (or None)."""
+    regions = DirtyRegion.objects.filter(layer=layer_name)
+    return regions.aggregate(Max("id"))["id__max"]
+
+
+def purge_dirty_tiles(layer_name, affected_layer_names, last_region_id):
+    """Remove the cached tiles in the dirty regions of a layer.
+
+    The regions of layer_name up to last_region_id are processed and deleted; this
+    must be the id of the last region recorded before the materialized views were
+    refreshed, because tiles made from the materialized views before more recent
+    changes had been refreshed may still be stale. Since the views of some layers
+    show attributes of other layers, the tiles of affected_layer_names in the regions
+    are also removed. Returns the number of tiles removed.
+    """
+    if last_region_id is None:
+        return 0
+    regions = DirtyRegion.objects.filter(layer=layer_name, id__lte=last_region_id)
+    cache_dir = get_cache_dir()
+    result = 0
+    if cache_dir:
+        for region in regions:
+            for name in affected_layer_names:
+                result += _purge_region(os.path.join(cache_dir, name), region.envelope)
+    regions.delete()
+    return result
+
+
+def _purge_region(layer_dir, envelope):
+    if envelope is None:
+        result = sum(len(files) for _, _, files in os.walk(layer_dir))
+        shutil.rmtree(layer_dir, ignore_errors=True)
+        return result
+    result = 0
+    for z, z_dir in _get_numbered_entries(layer_dir):
+        xmin, ymin, xmax, ymax = tiles.get_tile_range(envelope.extent, z)
+        for x, x_dir in _get_numbered_entries(z_dir):
+            if not xmin <= x <= xmax:
+                continue
+            for y, path in _get_numbered_entries(x_dir, ".mvt"):
+                if ymin <= y <= ymax:
+                    try:
+                        os.remove(path)
+                        result += 1
+                    except FileNotFoundError:
+                        # Removed by another process at the same time
+                        pass
+    return result
+
+
+def _get_numbered_entries(directory, suffix=""):
+    """Yield (number, path) for the entries of directory named <number><suffix>.
+
+    Listing the directory rather than iterating over the range of tiles is faster
+    at large zooms, where a region may intersect millions of tiles, few of which
+    are cached.
+    """
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        number = entry.name[: len(entry.name) - len(suffix)]
+        if entry.name.endswith(suffix) and number.isdigit():
+            yield int(number), entry.path
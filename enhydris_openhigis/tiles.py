@@ -0,0 +1,185 @@
+"""Mapbox vector tiles of the layers.
+
+Tiles are in the usual web mercator (EPSG:3857) tiling scheme and are made by PostGIS
+(ST_AsMVT) from the materialized views. The features are stored in EPSG:2100, so, in
+order for the spatial index to be used, the tile is transformed to a bounding box in
+EPSG:2100 (in Python, see get_search_box()) and the features are filtered by that
+before being transformed to EPSG:3857.
+
+At small zooms the simplified geometries are used (see SimplifiedGeometryMixin); the
+one chosen is the most simplified one whose tolerance is smaller than a pixel.
+"""
+
+import math
+
+from django.db import connection
+
+import numpy as np
+
+from . import tile_cache
+from .coordinates import transform_coordinates
+from .registry import get_registry
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_PIXELS = 256
+MAX_ZOOM = 22
+HALF_WORLD = 20037508.342789244
+
+# Longitude/latitude bounds of the area where there are data; tiles outside it are
+# empty, and it limits the search box of tiles that are partly outside it (EPSG:2100
+# is meaningless far away from Greece).
+DATA_EXTENT = (19.0, 34.0, 30.5, 42.0)
+
+SIMPLIFIED_GEOMETRIES = (
+    (1000, "geometry_1km"),
+    (100, "geometry_100m"),
+    (10, "geometry_10m"),
+)
+
+_attribute_columns = {}
+
+
+def get_tile_bounds(z, x, y):
+    """Return the bounds (xmin, ymin, xmax, ymax) of a tile in EPSG:3857."""
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2**z or not 0 <= y < 2**z:
+        raise ValueError("Tile {}/{}/{} does not exist".format(z, x, y))
+    size = 2 * HALF_WORLD / 2**z
+    return (
+        -HALF_WORLD + x * size,
+        HALF_WORLD - (y + 1) * size,
+        -HALF_WORLD + (x + 1) * size,
+        HALF_WORLD - y * size,
+    )
+
+
+def get_search_box(bounds):
+    """Return the bounding box in EPSG:2100 of the data that can be in a tile.
+
+    "bounds" are the bounds of the tile in EPSG:3857. They are expanded by the tile
+    buffer and clipped to DATA_EXTENT; the result is None if nothing is left.
+    """
+    buffer = (bounds[2] - bounds[0]) * TILE_BUFFER / TILE_EXTENT
+    lon1, lat1 = mercator_to_lonlat(bounds[0] - buffer, bounds[1] - buffer)
+    lon2, lat2 = mercator_to_lonlat(bounds[2] + buffer, bounds[3] + buffer)
+    lon1, lat1 = max(lon1, DATA_EXTENT[0]), max(lat1, DATA_EXTENT[1])
+    lon2, lat2 = min(lon2, DATA_EXTENT[2]), min(lat2, DATA_EXTENT[3])
+    if lon1 >= lon2 or lat1 >= lat2:
+        return None
+    return transform_box((lon1, lat1, lon2, lat2), 4326, 2100)
+
+
+def get_tile_range(box, z):
+    """Return the range of tiles of zoom z whose data can be in a box.
+
+    "box" is in EPSG:2100. The result is (xmin, ymin, xmax, ymax), inclusive. The
+    tiles are those that intersect the box expanded by the tile buffer.
+    """
+    x1, y1, x2, y2 = transform_box(box, 2100, 3857)
+    size = 2 * HALF_WORLD / 2**z
+    buffer = size * TILE_BUFFER / TILE_EXTENT
+    last = 2**z - 1
+    return (
+        min(max(math.floor((x1 - buffer + HALF_WORLD) / size), 0), last),
+        min(max(math.floor((HALF_WORLD - y2 - buffer) / size), 0), last),
+        min(max(math.floor((x2 + buffer + HALF_WORLD) / size), 0), last),
+        min(max(math.floor((HALF_WORLD - y1 + buffer) / size), 0), last),
+    )
+
+
+def transform_box(box, source_srid, target_srid):
+    """Return the bounding box of the transformation of a box.
+
+    Points along the edges are transformed, and not only the corners, because the
+    edges of the box are curved in the target reference system.
+    """
+    x1, y1, x2, y2 = box
+    xs = np.linspace(x1, x2, 9)
+    ys = np.linspace(y1, y2, 9)
+    edges = np.concatenate(
+        [
+            np.column_stack([xs, np.full(9, y1)]),
+            np.column_stack([xs, np.full(9, y2)]),
+            np.column_stack([np.full(9, x1), ys]),
+            np.column_stack([np.full(9, x2), ys]),
+        ]
+    )
+    points = transform_coordinates(edges, source_srid, target_srid)
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+def mercator_to_lonlat(x, y):
+    lon = math.degrees(x / HALF_WORLD * math.pi)
+    lat = math.degrees(2 * math.atan(math.exp(y / HALF_WORLD * math.pi)) - math.pi / 2)
+    return lon, lat
+
+
+def get_geometry_column(layer, z):
+    if layer.simplified:
+        pixel_size = 2 * HALF_WORLD / 2**z / TILE_PIXELS
+        for tolerance, column in SIMPLIFIED_GEOMETRIES:
+            if tolerance <= pixel_size:
+                return column
+    return "geometry"
+
+
+def get_attribute_columns(layer):
+    """Return the (quoted) non-geometry columns of the layer's materialized view."""
+    if layer.name not in _attribute_columns:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT * FROM {} LIMIT 0".format(layer.materialized_view))
+            _attribute_columns[layer.name] = [
+                connection.ops.quote_name(column[0])
+                for column in cursor.description
+                if not column[0].startswith("geometry")
+            ]
+    return _attribute_columns[layer.name]
+
+
+def get_tile(layer_name, z, x, y):
+    """Return the tile as bytes (empty if there are no features in it).
+
+    Tiles are cached (see tile_cache.py). Raises KeyError if the layer does not exist
+    and ValueError if the tile does not exist.
+    """
+    layer = get_registry()[layer_name]
+    bounds = get_tile_bounds(z, x, y)
+    tile = tile_cache.get_tile(layer.name, z, x, y)
+    if tile is None:
+        tile = make_tile(layer, z, bounds)
+        tile_cache.set_tile(layer.name, z, x, y, tile)
+    return tile
+
+
+def make_tile(layer, z, bounds):
+    search_box = get_search_box(bounds)
+    if search_box is None:
+        return b""
+    geometry_column = get_geometry_column(layer, z)
+    query = """
+        SELECT ST_AsMVT(tile, %s, {extent}, 'mvtgeom')
+        FROM (
+            SELECT
+                ST_AsMVTGeom(
+                    ST_Transform(t.{geometry}, 3857),
+                    ST_MakeEnvelope(%s, %s, %s, %s, 3857),
+                    {extent},
+                    {buffer},
+                    true
+                ) AS mvtgeom,
+                {columns}
+            FROM {materialized_view} t
+            WHERE t.{geometry} && ST_MakeEnvelope(%s, %s, %s, %s, 2100)
+        ) tile
+        WHERE mvtgeom IS NOT NULL
+    """.format(
+        extent=TILE_EXTENT,
+        buffer=TILE_BUFFER,
+        geometry=geometry_column,
+        columns=", ".join("t.{}".format(c) for c in get_attribute_columns(layer)),
+        materialized_view=layer.materialized_view,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(query, [layer.name, *bounds, *search_box])
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] else b""
@@ -6,4 +6,40 @@ urlpatterns = [
     path(
         "search/<path:search_term>", views.SearchView.as_view(), name="openhigis_search"
     ),
+    path(
+        "autocomplete/",
+        views.AutocompleteView.as_view(),
+        name="openhigis_autocomplete",
+    ),
+    path(
+        "tiles/<str:layer>/<int:z>/<int:x>/<int:y>.mvt",
+        views.TileView.as_view(),
+        name="openhigis_tile",
+    ),
+    path(
+        "geojson/<str:layer>.geojson",
+        views.GeoJSONView.as_view(),
+        name="openhigis_geojson",
+    ),
+    path(
+        "features/<str:layer>/",
+        views.FeaturesView.as_view(),
+        name="openhigis_features",
+    ),
+    path(
+        "export/<str:layer>.<str:format>",
+        views.ExportView.as_view(),
+        name="openhigis_export",
+    ),
+    path("locate/", views.LocateView.as_view(), name="openhigis_locate"),
+    path(
+        "network/node/<int:node_id>/<str:direction>/",
+        views.NetworkView.as_view(),
+        name="openhigis_network_node",
+    ),
+    path(
+        "network/station/<int:station_id>/<str:direction>/",
+        views.NetworkView.as_view(),
+        name="openhigis_network_station",
+    ),
 ]
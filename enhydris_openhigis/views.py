@@ -1,71 +1,455 @@
-from django.apps import apps
+import json
+import os
+
 from django.conf import settings
-from django.contrib.gis.db.models import Extent
-from django.contrib.gis.geos import Point
-from django.http import HttpResponse
+from django.db import connection
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    StreamingHttpResponse,
+)
 from django.views.generic import View
 
 from enhydris.views_common import ensure_extent_is_large_enough
 
+from . import export, geojson, locate, models, network, search_cache, tasks, tiles
+from .coordinates import transform_coordinates
+from .registry import get_registry
+
 
 def get_all_geomodels():
-    result = {
-        model
-        for model in apps.get_app_config("enhydris_openhigis").get_models()
-        if _model_has_field(model, "geom2100")
-    }
-    result = _get_leaf_classes(result)
-    return result
+    return get_registry().models
 
 
-def _model_has_field(model, fieldname):
-    fieldnames = {f.name for f in model._meta.get_fields()}
-    return fieldname in fieldnames
+NAME_MATCHES_SQL = "openhigis_normalize(g.name) LIKE openhigis_normalize(%s)"
 
 
-def _get_leaf_classes(class_list):
-    """Return a subset of class_list that only contains classes without subclasses.
+def get_like_pattern(search_term):
+    return "%{}%".format(connection.ops.prep_for_like_query(search_term))
 
-    Returns a subset of class_list that does not contain classes that are inherited by
-    other classes of class_list.
-    """
-    return {
-        klass for klass in class_list if _class_has_no_subclasses(klass, class_list)
-    }
 
-
-def _class_has_no_subclasses(klass, class_list):
-    return not any({issubclass(k, klass) for k in class_list if k != klass})
+def parse_bbox(value):
+    if value is None:
+        return None
+    bbox = [float(x) for x in value.split(",")]
+    if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+        raise ValueError("bbox must be xmin,ymin,xmax,ymax")
+    return bbox
 
 
 class SearchView(View):
+    """Find geographical entities by name and return their bounding box.
+
+    The response is JSON; "bbox" is the union of the extents of all matching entities,
+    and "layers" has the extent of the matches of each layer separately (layers with
+    no matches are omitted). All extents are in WGS84.
+
+    All layers are searched with a single query; the extent of each layer is
+    aggregated in a subquery, and the subqueries are combined with UNION ALL. Names
+    are compared through openhigis_normalize() (uppercase and unaccented), which has
+    a trigram index on enhydris_gentity (see migration 0102). Results are cached (see
+    search_cache.py).
+    """
+
     def get(self, request, *args, **kwargs):
         self.search_term = kwargs["search_term"]
-        bb = self.get_bounding_box()
-        return HttpResponse(" ".join(map(str, bb)), content_type="text/plain")
-
-    def get_bounding_box(self):
-        min_x, min_y, max_x, max_y = 1e9, 1e9, -1e9, -1e9
-        for model in get_all_geomodels():
-            extent = model.objects.filter(
-                name__unaccent__icontains=self.search_term
-            ).aggregate(Extent("geom2100"))["geom2100__extent"]
-            if not extent:
-                continue
-            min_x = min(min_x, extent[0])
-            min_y = min(min_y, extent[1])
-            max_x = max(max_x, extent[2])
-            max_y = max(max_y, extent[3])
-        if (min_x, min_y, max_x, max_y) == (1e9, 1e9, -1e9, -1e9):
-            return settings.ENHYDRIS_MAP_DEFAULT_VIEWPORT[:]
-        extent = [min_x, min_y, max_x, max_y]
-        self.transform_extent_to_wgs84(extent)
-        ensure_extent_is_large_enough(extent)
-        return extent
-
-    def transform_extent_to_wgs84(self, extent):
-        p1 = Point(*extent[:2], srid=2100)
-        p1.transform(4326)
-        p2 = Point(*extent[2:], srid=2100)
-        p2.transform(4326)
-        extent[:] = [p1.x, p1.y, p2.x, p2.y]
+        cache_key = search_cache.get_key(self.search_term)
+        result = search_cache.get_result(cache_key)
+        if result is None:
+            result = self.get_result()
+            search_cache.set_result(cache_key, result)
+        return HttpResponse(json.dumps(result), content_type="application/json")
+
+    def get_result(self):
+        layer_extents = self.get_layer_extents()
+        if not layer_extents:
+            return {"bbox": settings.ENHYDRIS_MAP_DEFAULT_VIEWPORT[:], "layers": {}}
+        layers = sorted(layer_extents)
+        extents = [self.get_union(layer_extents.values())]
+        extents.extend(layer_extents[layer] for layer in layers)
+        corners = transform_coordinates(extents, 2100, 4326).reshape(-1, 4)
+        bbox = corners[0].tolist()
+        ensure_extent_is_large_enough(bbox)
+        return {
+            "bbox": bbox,
+            "layers": {layer: e.tolist() for layer, e in zip(layers, corners[1:])},
+        }
+
+    def get_layer_extents(self):
+        layers = get_registry()
+        subqueries = [
+            """
+            SELECT %s AS layer, ST_Extent({}) AS extent
+            FROM {}
+            WHERE {}
+            """.format(
+                layer.geom, layer.from_clause, NAME_MATCHES_SQL
+            )
+            for layer in layers
+        ]
+        query = """
+            SELECT layer, ST_XMin(extent), ST_YMin(extent), ST_XMax(extent),
+                ST_YMax(extent)
+            FROM ({}) extents
+            WHERE extent IS NOT NULL
+        """.format(
+            " UNION ALL ".join(subqueries)
+        )
+        pattern = get_like_pattern(self.search_term)
+        params = []
+        for layer in layers:
+            params.extend([layer.name, pattern])
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return {row[0]: list(row[1:]) for row in cursor.fetchall()}
+
+    def get_union(self, extents):
+        return [
+            min(e[0] for e in extents),
+            min(e[1] for e in extents),
+            max(e[2] for e in extents),
+            max(e[3] for e in extents),
+        ]
+
+
+class AutocompleteView(View):
+    """Return the features whose names best match a search term.
+
+    Query parameters are "q" (the search term), "limit" (the maximum number of
+    results, which is capped by the ENHYDRIS_OPENHIGIS_AUTOCOMPLETE_MAX_RESULTS
+    setting) and "after" (the "next" of the previous page). Features match if their
+    name contains the term or is similar to it (as in pg_trgm's "%" operator), and
+    they are ranked by trigram similarity. The "id" of each result is the id of the
+    feature as in the layer's view, i.e. its imported_id, except for stations, which
+    have none. The bounding boxes (in WGS84) are only calculated for the features
+    that are returned.
+
+    Pagination is keyset-based: "next" is the (score, layer, id) of the last result,
+    and the next page continues after it, so the cost of a page doesn't depend on how
+    many pages precede it.
+    """
+
+    default_limit = 10
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.search_term = request.GET.get("q", "").strip()
+            self.limit = self.get_limit()
+            self.after = self.get_after()
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        results = self.get_results() if self.search_term else []
+        next_ = None
+        if len(results) == self.limit:
+            last = results[-1]
+            next_ = "{}:{}:{}".format(last["score"], last["layer"], last["id"])
+        return HttpResponse(
+            json.dumps({"results": results, "next": next_}),
+            content_type="application/json",
+        )
+
+    def get_limit(self):
+        max_results = getattr(
+            settings, "ENHYDRIS_OPENHIGIS_AUTOCOMPLETE_MAX_RESULTS", 50
+        )
+        limit = int(self.request.GET.get("limit", self.default_limit))
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        return min(limit, max_results)
+
+    def get_after(self):
+        after = self.request.GET.get("after")
+        if not after:
+            return None
+        score, layer, id = after.split(":")
+        return int(score), layer, int(id)
+
+    def get_results(self):
+        layers = get_registry()
+        subqueries = [
+            """
+            SELECT %(layer_{i})s AS layer, COALESCE({imported_id}, g.id) AS id,
+                {imported_id} AS imported_id,
+                g.name, {geom} AS geom,
+                ROUND(
+                    1000 * similarity(
+                        openhigis_normalize(g.name), openhigis_normalize(%(term)s)
+                    )
+                )::integer AS score
+            FROM {from_clause}
+            WHERE openhigis_normalize(g.name) LIKE openhigis_normalize(%(pattern)s)
+                OR openhigis_normalize(g.name) %% openhigis_normalize(%(term)s)
+            """.format(
+                i=i,
+                imported_id=layer.imported_id,
+                geom=layer.geom,
+                from_clause=layer.from_clause,
+            )
+            for i, layer in enumerate(layers)
+        ]
+        keyset_condition = "TRUE"
+        if self.after:
+            keyset_condition = """
+                score < %(after_score)s
+                OR (score = %(after_score)s AND (layer, id) > (%(after_layer)s,
+                    %(after_id)s))
+            """
+        query = """
+            SELECT layer, id, imported_id, name, score, ST_XMin(bbox), ST_YMin(bbox),
+                ST_XMax(bbox), ST_YMax(bbox)
+            FROM (
+                SELECT layer, id, imported_id, name, score,
+                    Box2D(ST_Transform(geom, 4326)) AS bbox
+                FROM ({subqueries}) candidates
+                WHERE {keyset_condition}
+                ORDER BY score DESC, layer, id
+                LIMIT %(limit)s
+            ) results
+            ORDER BY score DESC, layer, id
+        """.format(
+            subqueries=" UNION ALL ".join(subqueries),
+            keyset_condition=keyset_condition,
+        )
+        params = {
+            "term": self.search_term,
+            "pattern": get_like_pattern(self.search_term),
+            "limit": self.limit,
+        }
+        params.update({"layer_{}".format(i): x.name for i, x in enumerate(layers)})
+        if self.after:
+            params.update(
+                {
+                    "after_score": self.after[0],
+                    "after_layer": self.after[1],
+                    "after_id": self.after[2],
+                }
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return [
+                {
+                    "layer": row[0],
+                    "id": row[1],
+                    "imported_id": row[2],
+                    "name": row[3],
+                    "score": row[4],
+                    "bbox": list(row[5:]),
+                }
+                for row in cursor.fetchall()
+            ]
+
+
+class TileView(View):
+    """Return a Mapbox vector tile of a layer (see tiles.py)."""
+
+    def get(self, request, *args, **kwargs):
+        try:
+            tile = tiles.get_tile(
+                kwargs["layer"], kwargs["z"], kwargs["x"], kwargs["y"]
+            )
+        except (KeyError, ValueError) as e:
+            raise Http404(str(e))
+        return HttpResponse(tile, content_type="application/vnd.mapbox-vector-tile")
+
+
+class GeoJSONView(View):
+    """Stream all features of a layer as GeoJSON (see geojson.py).
+
+    The optional "bbox" query parameter is "xmin,ymin,xmax,ymax" in WGS84; any other
+    query parameter is an attribute of the layer (e.g. "origin=natural") and only the
+    features whose attribute has that value are returned.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            layer = get_registry()[kwargs["layer"]]
+        except KeyError as e:
+            raise Http404(str(e))
+        filters = request.GET.dict()
+        try:
+            bbox = parse_bbox(filters.pop("bbox", None))
+            query, params = geojson.get_query(layer, bbox, filters)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        response = StreamingHttpResponse(
+            geojson.stream_features(query, params), content_type="application/geo+json"
+        )
+        response["Content-Disposition"] = 'attachment; filename="{}.geojson"'.format(
+            layer.name
+        )
+        return response
+
+
+class FeaturesView(View):
+    """Return a page of the features of a layer as a GeoJSON FeatureCollection.
+
+    Query parameters are "bbox" ("xmin,ymin,xmax,ymax", in the SRID of the
+    response), "fields" (a comma-separated list of the attributes to include;
+    "geometry" may be one of them, and if it isn't the geometry is null; by default
+    all attributes and the geometry are included), "simplify" (a tolerance in metres),
+    "srid" (by default 4326), "limit" (capped by the
+    ENHYDRIS_OPENHIGIS_FEATURES_MAX_RESULTS setting) and "after" (the "next" of the
+    previous page). Pagination is keyset-based on the id (see geojson.py).
+    """
+
+    default_limit = 100
+
+    def get(self, request, *args, **kwargs):
+        try:
+            layer = get_registry()[kwargs["layer"]]
+        except KeyError as e:
+            raise Http404(str(e))
+        try:
+            self.limit = self.get_limit()
+            fields, geometry = self.get_fields()
+            query, params = geojson.get_query(
+                layer,
+                bbox=parse_bbox(request.GET.get("bbox")),
+                fields=fields,
+                geometry=geometry,
+                simplify=self.get_simplify(),
+                srid=int(request.GET.get("srid", 4326)),
+                after=self.get_after(),
+                limit=self.limit,
+            )
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        rows = geojson.get_features(query, params)
+        next_ = rows[-1][0] if len(rows) == self.limit else None
+        return HttpResponse(
+            '{{"type": "FeatureCollection", "features": [{}], "next": {}}}'.format(
+                ",\n".join(row[1] for row in rows), json.dumps(next_)
+            ),
+            content_type="application/geo+json",
+        )
+
+    def get_limit(self):
+        max_results = getattr(settings, "ENHYDRIS_OPENHIGIS_FEATURES_MAX_RESULTS", 1000)
+        limit = int(self.request.GET.get("limit", self.default_limit))
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        return min(limit, max_results)
+
+    def get_fields(self):
+        value = self.request.GET.get("fields")
+        if value is None:
+            return None, True
+        fields = [x.strip() for x in value.split(",") if x.strip()]
+        geometry = "geometry" in fields
+        return [x for x in fields if x != "geometry"], geometry
+
+    def get_simplify(self):
+        value = self.request.GET.get("simplify")
+        if not value:
+            return None
+        simplify = float(value)
+        if simplify < 0:
+            raise ValueError("simplify must not be negative")
+        return simplify
+
+    def get_after(self):
+        after = self.request.GET.get("after")
+        return int(after) if after else None
+
+
+# Seconds after which clients should retry downloading a file that is being exported
+EXPORT_RETRY_AFTER = 300
+
+
+class ExportView(View):
+    """Return a layer as a FlatGeobuf, GeoPackage or GeoParquet file (see export.py).
+
+    Only files that are up to date are served. If the file hasn't been exported, the
+    response is 404, and if the layer has changed since, 503; in both cases the
+    export is queued.
+    """
+
+    def get(self, request, *args, **kwargs):
+        layer_name, format_name = kwargs["layer"], kwargs["format"]
+        try:
+            path, status = export.get_status(layer_name, format_name)
+        except (KeyError, ValueError) as e:
+            raise Http404(str(e))
+        if status != export.UP_TO_DATE:
+            tasks.schedule_export(layer_name, format_name)
+        if status == export.MISSING:
+            raise Http404("{} has not been exported yet".format(layer_name))
+        if status == export.STALE:
+            response = HttpResponse(
+                "{} is being exported; try again later".format(layer_name),
+                status=503,
+                content_type="text/plain",
+            )
+            response["Retry-After"] = str(EXPORT_RETRY_AFTER)
+            return response
+        return FileResponse(
+            open(path, "rb"), as_attachment=True, filename=os.path.basename(path)
+        )
+
+
+class LocateView(View):
+    """Return the river basin district, river basin and drainage basin of a point.
+
+    The query parameters "lat" and "lon" are in WGS84. The response is JSON; for
+    each layer, it has the id (as in the layer's view) and name of the feature that
+    contains the point, or null. See locate.py.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            lat = float(request.GET["lat"])
+            lon = float(request.GET["lon"])
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest("lat and lon must be numbers")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return HttpResponseBadRequest("lat or lon is out of range")
+        result = {
+            layer_name: {"id": feature[0], "name": feature[1]} if feature else None
+            for layer_name, feature in locate.locate(lat, lon).items()
+        }
+        return HttpResponse(json.dumps(result), content_type="application/json")
+
+
+class NetworkView(View):
+    """Return the watercourses upstream or downstream of a hydro node or a station.
+
+    The node is specified by its imported id (i.e. the id in the HydroNode view) and
+    the station by its id. For a station, the watercourse on which it is (its
+    surface water) is included. The response is JSON; "watercourses" is a list of the
+    ids of the watercourses in the Watercourse view. See network.py.
+    """
+
+    def get(self, request, *args, **kwargs):
+        direction = kwargs["direction"]
+        if direction not in ("upstream", "downstream"):
+            raise Http404("Unknown direction {}".format(direction))
+        self.network = network.get_network()
+        try:
+            if "node_id" in kwargs:
+                watercourse_ids = self.trace_node(kwargs["node_id"], direction)
+            else:
+                watercourse_ids = self.trace_station(kwargs["station_id"], direction)
+        except KeyError as e:
+            raise Http404("Not found in the network: {}".format(e))
+        imported_ids = self.network.get_imported_ids(watercourse_ids)
+        return HttpResponse(
+            json.dumps({"watercourses": sorted(imported_ids.tolist())}),
+            content_type="application/json",
+        )
+
+    def trace_node(self, imported_id, direction):
+        node_id = self.network.get_node_id(imported_id)
+        if direction == "upstream":
+            return self.network.upstream_of_node(node_id)
+        return self.network.downstream_of_node(node_id)
+
+    def trace_station(self, station_id, direction):
+        stations = models.Station.objects.filter(id=station_id)
+        surface_water_ids = stations.values_list("surface_water_id", flat=True)
+        if not surface_water_ids or surface_water_ids[0] is None:
+            raise Http404("Station {} is not on a watercourse".format(station_id))
+        if direction == "upstream":
+            return self.network.upstream_of_watercourse(surface_water_ids[0])
+        return self.network.downstream_of_watercourse(surface_water_ids[0])
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Generate layers.map, the layers of openhigis.map that have simplified geometries.
+
+Each of these layers is rendered, depending on the scale, from the full resolution
+geometry or from a geometry simplified with a tolerance of 10 m, 100 m or 1 km. In
+MapServer this needs a layer for each of these, and the four layers are put in a
+group, which WMS clients use as a single layer. WFS is disabled on them, and each
+layer also has a layer with its original name for WFS only (which reads the full
+resolution geometry). As this would be a lot of copying and pasting, these layers
+are generated by this script; run it after modifying it, and don't edit layers.map.
+"""
+
+import os
+
+CONNECTION = "host=localhost dbname=openmeteo user=mapserver"
+
+# Name suffix, geometry column, tolerance, min and max scale denominator
+VARIANTS = (
+    ("full", "geometry", None, None, 50000),
+    ("10m", "geometry_10m", "10 m", 50000, 500000),
+    ("100m", "geometry_100m", "100 m", 500000, 5000000),
+    ("1km", "geometry_1km", "1 km", 5000000, None),
+)
+
+# Layer name, title, view, type, popup template, style
+LAYERS = (
+    (
+        "RiverBasinDistricts",
+        "River basin districts",
+        "RiverBasinDistrict",
+        "POLYGON",
+        "wmspopup-general.html",
+        ("OUTLINECOLOR 0 0 255", "COLOR 127 127 255", "OPACITY 50"),
+    ),
+    (
+        "RiverBasins",
+        "River basins",
+        "RiverBasin",
+        "POLYGON",
+        "wmspopup-basin.html",
+        ("OUTLINECOLOR 0 102 255", "OPACITY 100", "WIDTH 4"),
+    ),
+    (
+        "DrainageBasins",
+        "Drainage basins",
+        "DrainageBasin",
+        "POLYGON",
+        "wmspopup-basin.html",
+        ("OUTLINECOLOR 0 102 255", "OPACITY 100", "WIDTH 2"),
+    ),
+    (
+        "StationBasins",
+        "Station basins",
+        "StationBasin",
+        "POLYGON",
+        "wmspopup-basin.html",
+        ("OUTLINECOLOR 0 102 255", "OPACITY 100", "WIDTH 2"),
+    ),
+    (
+        "Watercourses",
+        "Watercourses",
+        "Watercourse",
+        "LINE",
+        "wmspopup-river.html",
+        ("OUTLINECOLOR 51 204 255", "OPACITY 100", "WIDTH [streamorder]"),
+    ),
+    (
+        "StandingWaters",
+        "Standing waters",
+        "StandingWater",
+        "POLYGON",
+        "wmspopup-general.html",
+        ("OUTLINECOLOR 51 204 255", "COLOR 51 204 255", "OPACITY 50", "WIDTH 1"),
+    ),
+)
+
+WFS_LAYER = """
+    LAYER
+        NAME "{name}"
+        TYPE {type}
+        CONNECTIONTYPE POSTGIS
+        CONNECTION "{connection}"
+        METADATA
+            "wfs_title" "{title}"
+            "wms_enable_request" "!*"
+            "gml_include_items" "all"
+            "gml_exclude_items" "{other_columns}"
+            "gml_featureid" "id"
+        END
+        STATUS ON
+        DATA "geometry FROM openhigis.{view}_mv USING UNIQUE id USING SRID=2100"
+        PROJECTION
+            "init=epsg:2100"
+        END
+    END
+"""
+
+WMS_LAYER = """
+    LAYER
+        NAME "{name}_{variant}"
+        GROUP "{name}"
+        TYPE {type}
+        CONNECTIONTYPE POSTGIS
+        CONNECTION "{connection}"
+        METADATA
+            "wms_title" "{variant_title}"
+            "wms_group_title" "{title}"
+            "wfs_enable_request" "!*"
+            "gml_include_items" "all"
+            "gml_exclude_items" "{other_columns}"
+            "gml_featureid" "id"
+        END
+        STATUS ON{scales}
+        DATA "{column} FROM openhigis.{view}_mv USING UNIQUE id USING SRID=2100"
+        PROJECTION
+            "init=epsg:2100"
+        END
+        TEMPLATE "{template}"
+        CLASS
+            NAME "{title}"
+            STYLE
+{style}
+            END
+        END
+    END
+"""
+
+
+def _get_other_columns(column):
+    # MapServer publishes all columns of the view other than the geometry it reads
+    # as attributes; the other geometries would be output as hex EWKB.
+    return ",".join(c for _, c, _, _, _ in VARIANTS if c != column)
+
+
+def get_layers():
+    result = ["# Generated by make_layers.py; do not edit.\n"]
+    for name, title, view, type, template, style in LAYERS:
+        params = {
+            "name": name,
+            "title": title,
+            "view": view,
+            "type": type,
+            "template": template,
+            "style": "\n".join(" " * 16 + line for line in style),
+            "connection": CONNECTION,
+        }
+        result.append(
+            WFS_LAYER.format(other_columns=_get_other_columns("geometry"), **params)
+        )
+        for variant, column, tolerance, min_scale, max_scale in VARIANTS:
+            scales = ""
+            if min_scale:
+                scales += "\n        MINSCALEDENOM {}".format(min_scale)
+            if max_scale:
+                scales += "\n        MAXSCALEDENOM {}".format(max_scale)
+            if tolerance:
+                variant_title = "{} (simplified, {})".format(title, tolerance)
+            else:
+                variant_title = title
+            result.append(
+                WMS_LAYER.format(
+                    variant=variant,
+                    variant_title=variant_title,
+                    column=column,
+                    other_columns=_get_other_columns(column),
+                    scales=scales,
+                    **params,
+                )
+            )
+    return "".join(result)
+
+
+if __name__ == "__main__":
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layers.map")
+    with open(path, "w") as f:
+        f.write(get_layers())